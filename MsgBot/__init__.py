@@ -1,4 +1,68 @@
 # -*- coding: utf-8 -*-
+import importlib
+from typing import TYPE_CHECKING
 
-from MsgBot.wx_com_bot.bot import WxComBot
-from MsgBot.ding_talk_bot.bot import DingTalkBot
+# 公开名称 -> 所在模块，首次访问时才导入（PEP 562），命令行单次发送不必加载 aiohttp 等未用到的依赖
+_EXPORTS = {
+    'WxComBot': 'MsgBot.wx_com_bot.bot',
+    'DingTalkBot': 'MsgBot.ding_talk_bot.bot',
+    'AsyncWxComBot': 'MsgBot.wx_com_bot.async_bot',
+    'AsyncDingTalkBot': 'MsgBot.ding_talk_bot.async_bot',
+    'WxComWebhookBot': 'MsgBot.wx_com_bot.webhook',
+    'Channel': 'MsgBot.channel',
+    'AsyncChannel': 'MsgBot.channel',
+    'Notifier': 'MsgBot.notifier',
+    'Dispatcher': 'MsgBot.dispatcher',
+    'PriorityScheduler': 'MsgBot.scheduler',
+    'SlidingWindowRateLimiter': 'MsgBot.rate_limiter',
+    'TokenBucketRateLimiter': 'MsgBot.rate_limiter',
+    'UnlimitedRateLimiter': 'MsgBot.rate_limiter',
+    'DingTalkCoalescer': 'MsgBot.ding_talk_bot.coalescer',
+    'DedupCache': 'MsgBot.dedup',
+    'DingTalkBotPool': 'MsgBot.ding_talk_bot.pool',
+    'Outbox': 'MsgBot.outbox',
+    'RetryPolicy': 'MsgBot.retry',
+    'CircuitBreaker': 'MsgBot.retry',
+    'MessageTemplate': 'MsgBot.template',
+    'Slot': 'MsgBot.template',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def _lazy_getattr(module_name: str, exports: dict, name: str):
+    """
+    供各包的 __getattr__ 使用，导入 name 所在的模块并缓存到包的命名空间
+    """
+    if name not in exports:
+        raise AttributeError(f'module {module_name!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(exports[name]), name)
+    setattr(importlib.import_module(module_name), name, value)
+    return value
+
+
+def __getattr__(name: str):
+    return _lazy_getattr(__name__, _EXPORTS, name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from MsgBot.wx_com_bot.bot import WxComBot
+    from MsgBot.ding_talk_bot.bot import DingTalkBot
+    from MsgBot.wx_com_bot.async_bot import AsyncWxComBot
+    from MsgBot.ding_talk_bot.async_bot import AsyncDingTalkBot
+    from MsgBot.wx_com_bot.webhook import WxComWebhookBot
+    from MsgBot.channel import Channel, AsyncChannel
+    from MsgBot.notifier import Notifier
+    from MsgBot.dispatcher import Dispatcher
+    from MsgBot.scheduler import PriorityScheduler
+    from MsgBot.rate_limiter import SlidingWindowRateLimiter, TokenBucketRateLimiter, UnlimitedRateLimiter
+    from MsgBot.ding_talk_bot.coalescer import DingTalkCoalescer
+    from MsgBot.dedup import DedupCache
+    from MsgBot.ding_talk_bot.pool import DingTalkBotPool
+    from MsgBot.outbox import Outbox
+    from MsgBot.retry import RetryPolicy, CircuitBreaker
+    from MsgBot.template import MessageTemplate, Slot
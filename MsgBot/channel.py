@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+import json
+from time import monotonic
+from MsgBot.session import build_session, build_async_session
+from MsgBot.dedup import DedupCache, SUPPRESSED_RESPONSE
+from MsgBot.retry import RetryPolicy
+from MsgBot.template import dumps
+from MsgBot.metrics import MetricsHook, trace
+from MsgBot.rate_limiter import RateLimiter
+from MsgBot.exceptions import SendError, ChannelError, RateLimitError
+
+
+class Channel(object):
+    """
+    消息渠道的公共发送流程：构造消息体 → 去重 → 重试 / 熔断 → 限流 → 编码 → 发送 HTTP 请求 → 解析响应
+    各渠道只需实现：
+        _endpoint: 返回请求地址（如需 access_token 在此获取）
+        _recover: 平台返回错误时能否修复后重发一次（如 token 失效），默认不能
+        _check_form: 发送前检查消息体，默认不检查
+        send_* : 构造消息体后调用 _send_msg / _send_parts
+        notify: 供 MsgBot.notifier.Notifier 调用，以渠道默认的格式发送一条标题 + 正文的通知
+    """
+    # 平台返回错误时抛出的异常，及错误信息中附带的文档地址
+    error_class = ChannelError
+    error_doc = ''
+    # 渠道名称，用于错误信息
+    channel_name = '消息'
+    # 请求头，平台要求 POST 请求的字符集为 UTF-8
+    headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+    def __init__(self, session=None, pool_maxsize: int = 10, max_retries=0, keep_alive: bool = True,
+                 rate_limiter: RateLimiter = None, dedup: DedupCache = None, retry_policy: RetryPolicy = None,
+                 max_bytes: int = None, metrics: MetricsHook = None, metrics_name: str = None,
+                 circuit_key: str = ''):
+        """
+        :param session: 共用的 requests.Session ，传入后由调用方负责关闭，此时连接池相关参数无效
+        :param pool_maxsize: 连接池最多保持的连接数，多线程并发发送时应不小于线程数
+        :param max_retries: int 或 urllib3.util.Retry ，连接层面的重试策略，默认不重试
+        :param keep_alive: 是否保持长连接
+        :param rate_limiter: 限流器，为 None 时不在客户端限流
+        :param dedup: 客户端去重缓存，默认不去重
+        :param retry_policy: 重试策略，默认不重试
+        :param max_bytes: 消息内容的字节上限，超出时自动拆分，为 None 时不拆分
+        :param metrics: 指标回调，默认不收集
+        :param metrics_name: 指标中的渠道名称
+        :param circuit_key: 熔断器的键，同一个键的渠道共享熔断状态
+        """
+        self.rate_limiter = rate_limiter
+        self.dedup = dedup
+        self.retry_policy = retry_policy
+        self.max_bytes = max_bytes
+        self.metrics = metrics
+        self.metrics_name = metrics_name
+        self.circuit_key = circuit_key
+        if metrics is not None:
+            metrics.register(self.metrics_name, self)
+        # 自行创建的 Session 在 close() 时关闭，外部传入的 Session 由调用方管理
+        self._own_session = session is None
+        self.session = session if session is not None else self._build_session(pool_maxsize, max_retries, keep_alive)
+
+    @staticmethod
+    def _build_session(pool_maxsize: int, max_retries, keep_alive: bool):
+        return build_session(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=max_retries,
+                             keep_alive=keep_alive)
+
+    def close(self):
+        """
+        关闭连接池（仅关闭自行创建的 Session）
+        :return:
+        """
+        if self._own_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _parse_response(self, content: bytes, status: int = None) -> dict:
+        try:
+            response = json.loads(content.decode('utf-8'))
+        except ValueError:
+            response = None
+        if not isinstance(response, dict):
+            # 网关返回的 HTML 错误页等，按网络错误处理（可重试）
+            body = content[:200].decode('utf-8', 'replace')
+            raise SendError(f'{self.channel_name}响应不是 JSON （HTTP {status}），详情如下：\n{body}')
+        errcode = response.get('errcode', 1)
+        if errcode != 0:
+            raise self.error_class(f'{response}\n{self.error_doc}', errcode=errcode)
+        return response
+
+    @staticmethod
+    def _encode(form_data) -> bytes:
+        # 模板渲染后的消息体已经是字节串
+        return form_data if isinstance(form_data, bytes) else dumps(form_data)
+
+    def _check_form(self, form_data):
+        pass
+
+    def _dedup(self, form_data: dict):
+        """
+        :return: 实际要发送的消息体，被去重拦截时返回 None
+        """
+        return form_data if self.dedup is None else self.dedup.check(form_data)
+
+    def _release(self, form_data):
+        if self.dedup is not None:
+            self.dedup.release(form_data)
+
+    def flush_duplicates(self, *args, **kwargs) -> list:
+        """
+        补发去重窗口已结束、且窗口内有重复的消息（附带重复次数）
+        :param args: 同 _send_once ，如超时时间
+        :return: 每条补发消息返回的响应
+        """
+        if self.dedup is None:
+            return []
+        return [self._send_msg(form_data, *args, **kwargs) for form_data in self.dedup.expired_summaries()]
+
+    def _suppressed(self) -> dict:
+        if self.metrics is not None:
+            self.metrics.on_result(self.metrics_name, 'suppressed')
+        return dict(SUPPRESSED_RESPONSE)
+
+    def _send_msg(self, form_data, *args, **kwargs):
+        self._check_form(form_data)
+        payload = self._dedup(form_data)
+        if payload is None:
+            return self._suppressed()
+        try:
+            if self.retry_policy is None:
+                return self._send_once(payload, *args, **kwargs)
+            return self.retry_policy.call(self._send_once, payload, *args, key=self.circuit_key, **kwargs)
+        except BaseException:
+            # 发送失败时撤销去重登记，否则调用方（或发件箱）重发时会被拦截
+            self._release(form_data)
+            raise
+
+    def _send_parts(self, forms: list, *args, **kwargs):
+        """
+        按顺序发送拆分后的消息（依次经过限流），只有一条时直接返回其响应
+        """
+        if len(forms) == 1:
+            return self._send_msg(forms[0], *args, **kwargs)
+        return [self._send_msg(form_data, *args, **kwargs) for form_data in forms]
+
+    def _endpoint(self, stages) -> str:
+        """
+        :param stages: 当前请求的 Trace ，获取 access_token 等耗时操作完成后应调用 stages.mark
+        :return: 请求地址
+        """
+        raise NotImplementedError
+
+    def _recover(self, error: Exception, url: str) -> bool:
+        """
+        平台返回错误后调用
+        :return: 是否已修复（如刷新了 access_token ），为 True 时重发一次
+        """
+        return False
+
+    def _send_once(self, form_data, q_timeout: float = 60, r_timeout: float = None, **kwargs):
+        """
+        发送一条消息（不含去重与重试）
+        :param form_data: 消息体，或已编码的字节串
+        :param q_timeout: 等待限流名额的超时时间
+        :param r_timeout: 请求超时时间，也可以通过 kwargs 中的 timeout 传入
+        :param kwargs: requests 相关参数
+        """
+        if r_timeout is not None:
+            kwargs['timeout'] = r_timeout
+        with trace(self.metrics, self.metrics_name) as stages:
+            if self.rate_limiter is not None:
+                if not self.rate_limiter.acquire(timeout=q_timeout):
+                    raise RateLimitError(f'等待 {q_timeout}s 后仍超出{self.channel_name}发送频率限制')
+                stages.mark('rate_limit')
+            data = self._encode(form_data)
+            stages.mark('encode')
+            for retry in (False, True):
+                url = self._endpoint(stages)
+                try:
+                    r = self.session.post(url, data=data, headers=self.headers, **kwargs)
+                except Exception as e:
+                    raise SendError(f'发送 post 请求失败，详情如下：\n{e}')
+                stages.mark('http')
+                try:
+                    response = self._parse_response(r.content, r.status_code)
+                except self.error_class as e:
+                    if retry or not self._recover(e, url):
+                        raise
+                    continue
+                stages.mark('parse')
+                return response
+
+    def notify(self, title: str, text: str, **kwargs):
+        """
+        发送一条通知，各渠道以合适的格式（通常为 markdown）组织标题与正文
+        :param title: 标题
+        :param text: 正文（markdown）
+        :param kwargs: 渠道相关参数，如接收者
+        """
+        raise NotImplementedError
+
+
+class AsyncChannel(object):
+    """
+    Channel 的 asyncio 版本，与具体渠道类组合使用，如 class AsyncDingTalkBot(AsyncChannel, DingTalkBot)
+    发送流程相同， HTTP 请求使用 aiohttp ，限流等待使用 asyncio.sleep ，不会阻塞事件循环
+    各渠道可覆盖 _aendpoint （默认调用 _endpoint ）
+    """
+
+    def __init__(self, *args, pool_maxsize: int = 100, keep_alive: bool = True, **kwargs):
+        # aiohttp 与 asyncio 导入较慢，只在使用异步渠道时导入
+        try:
+            import aiohttp
+        except ImportError:
+            raise ImportError(f'{type(self).__name__} 依赖 aiohttp ，请先安装： pip install MsgBot[async]')
+        self._client_timeout = aiohttp.ClientTimeout
+        self._pool_maxsize = pool_maxsize
+        self._keep_alive = keep_alive
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def _build_session(pool_maxsize: int, max_retries, keep_alive: bool):
+        # aiohttp.ClientSession 须在事件循环中创建，延迟到首次发送时
+        return None
+
+    def _get_session(self):
+        if self.session is None:
+            self.session = build_async_session(self._pool_maxsize, self._keep_alive)
+        return self.session
+
+    async def close(self):
+        """
+        关闭连接池（仅关闭自行创建的 Session）
+        :return:
+        """
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        raise TypeError(f'{type(self).__name__} 请使用 async with')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _request_kwargs(self, kwargs: dict) -> dict:
+        timeout = kwargs.get('timeout')
+        if isinstance(timeout, (int, float)):
+            kwargs = dict(kwargs, timeout=self._client_timeout(total=timeout))
+        return kwargs
+
+    async def flush_duplicates(self, *args, **kwargs) -> list:
+        if self.dedup is None:
+            return []
+        return [await self._send_msg(form_data, *args, **kwargs) for form_data in self.dedup.expired_summaries()]
+
+    async def _send_msg(self, form_data, *args, **kwargs):
+        self._check_form(form_data)
+        payload = self._dedup(form_data)
+        if payload is None:
+            return self._suppressed()
+        try:
+            if self.retry_policy is None:
+                return await self._send_once(payload, *args, **kwargs)
+            return await self.retry_policy.acall(self._send_once, payload, *args, key=self.circuit_key, **kwargs)
+        except BaseException:
+            self._release(form_data)
+            raise
+
+    async def _send_parts(self, forms: list, *args, **kwargs):
+        if len(forms) == 1:
+            return await self._send_msg(forms[0], *args, **kwargs)
+        return [await self._send_msg(form_data, *args, **kwargs) for form_data in forms]
+
+    async def notify(self, title: str, text: str, **kwargs):
+        # 渠道的 notify 调用的 send_* 在异步版本中返回协程
+        return await super().notify(title, text, **kwargs)
+
+    async def _aendpoint(self, stages) -> str:
+        return self._endpoint(stages)
+
+    async def _acquire(self, q_timeout: float):
+        import asyncio
+        deadline = monotonic() + q_timeout
+        while True:
+            wait = self.rate_limiter.try_acquire()
+            if wait <= 0:
+                return
+            if monotonic() + wait > deadline:
+                raise RateLimitError(f'等待 {q_timeout}s 后仍超出{self.channel_name}发送频率限制')
+            await asyncio.sleep(wait)
+
+    async def _send_once(self, form_data, q_timeout: float = 60, r_timeout: float = None, **kwargs):
+        if r_timeout is not None:
+            kwargs['timeout'] = r_timeout
+        kwargs = self._request_kwargs(kwargs)
+        with trace(self.metrics, self.metrics_name) as stages:
+            if self.rate_limiter is not None:
+                await self._acquire(q_timeout)
+                stages.mark('rate_limit')
+            data = self._encode(form_data)
+            stages.mark('encode')
+            for retry in (False, True):
+                url = await self._aendpoint(stages)
+                try:
+                    async with self._get_session().post(url, data=data, headers=self.headers, **kwargs) as r:
+                        status, content = r.status, await r.read()
+                except Exception as e:
+                    raise SendError(f'发送 post 请求失败，详情如下：\n{e}')
+                stages.mark('http')
+                try:
+                    response = self._parse_response(content, status)
+                except self.error_class as e:
+                    if retry or not self._recover(e, url):
+                        raise
+                    continue
+                stages.mark('parse')
+                return response
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+命令行发送消息
+
+    msgbot dingtalk '部署完成'
+    msgbot wx_com --agent-id 1000002 --to-user zhangsan --markdown '**部署完成**'
+    msgbot relay --outbox-dir /var/lib/msgbot &
+    msgbot dingtalk --relay '部署完成'
+    tail -F app.log | grep ERROR | msgbot dingtalk --coalesce 10
+
+不传消息内容（或为 - ）时从标准输入逐行读取，每行一条消息，由同一个机器人发送，
+复用连接池、 access_token 与限流器；以 { 开头的行按 JSON 解析，可覆盖单条消息的参数，如
+    {"content": "磁盘使用率 95%", "at_mobiles": ["156xxxx8827"]}
+    {"title": "日报", "content": "**完成**", "markdown": true}
+机器人相关的模块在解析参数后才导入，单次发送不会加载用不到的依赖
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+# 退出码：全部发送成功 / 部分或全部发送失败 / 参数错误 / 被 Ctrl+C 中断
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='msgbot', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    channels = parser.add_subparsers(dest='channel', metavar='{dingtalk,wx_com,relay}')
+    channels.required = True
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('message', nargs='?', default='-', help='消息内容，省略或为 - 时从标准输入逐行读取')
+    common.add_argument('--markdown', action='store_true', help='以 markdown 类型发送')
+    common.add_argument('--format', choices=('auto', 'text', 'json'), default='auto',
+                        help='标准输入每行的格式， auto 表示以 { 开头的行按 JSON 解析')
+    common.add_argument('--timeout', type=float, default=60, help='请求超时时间（秒）')
+    common.add_argument('--relay', action='store_true',
+                        help='通过本机的中继服务（ msgbot relay ）发送，共用其连接、 token 与限流器，服务不可用时直接发送')
+    common.add_argument('--relay-socket', help='中继服务的套接字路径，默认读取环境变量 MSGBOT_RELAY_SOCKET')
+
+    ding_talk = channels.add_parser('dingtalk', parents=[common], help='钉钉群聊天机器人')
+    ding_talk.add_argument('--web-hook', default=os.environ.get('DING_TALK_WEB_HOOK'),
+                           help='Webhook 地址，默认读取环境变量 DING_TALK_WEB_HOOK')
+    ding_talk.add_argument('--secret', default=os.environ.get('DING_TALK_SECRET'),
+                           help='加签密钥，默认读取环境变量 DING_TALK_SECRET')
+    ding_talk.add_argument('--title', default='消息通知', help='markdown 消息的标题')
+    ding_talk.add_argument('--at', dest='at_mobiles', action='append', metavar='MOBILE', help='@ 的手机号，可重复')
+    ding_talk.add_argument('--at-all', action='store_true', help='@所有人')
+    ding_talk.add_argument('--coalesce', type=float, metavar='SECONDS',
+                           help='将该时间窗口内的消息合并为一条发送（读取标准输入时有效）')
+    ding_talk.add_argument('--shared-rate-limit', action='store_true',
+                           help='与本机其他进程共享同一 Webhook 的限流窗口（如多个 cron 任务）')
+
+    wx_com = channels.add_parser('wx_com', parents=[common], help='企业微信应用消息')
+    wx_com.add_argument('--corp-id', default=os.environ.get('WX_COM_CORP_ID'),
+                        help='企业 id ，默认读取环境变量 WX_COM_CORP_ID')
+    wx_com.add_argument('--corp-secret', default=os.environ.get('WX_COM_CORP_SECRET'),
+                        help='应用的凭证密钥，默认读取环境变量 WX_COM_CORP_SECRET')
+    wx_com.add_argument('--agent-id', type=int, default=os.environ.get('WX_COM_AGENT_ID'),
+                        help='企业应用的 id ，默认读取环境变量 WX_COM_AGENT_ID')
+    wx_com.add_argument('--to-user', default=os.environ.get('WX_COM_TO_USER'),
+                        help='接收消息的成员，多个用 | 分隔，默认读取环境变量 WX_COM_TO_USER')
+    wx_com.add_argument('--to-party', help='接收消息的部门')
+    wx_com.add_argument('--to-tag', help='接收消息的标签')
+    wx_com.add_argument('--token-cache', default=os.environ.get('WX_COM_TOKEN_CACHE'),
+                        help='access_token 缓存文件，多次调用可复用未过期的 token ，默认读取环境变量 WX_COM_TOKEN_CACHE')
+    wx_com.add_argument('--api-base', default=None, help='企业微信接口地址，默认为官方地址')
+
+    relay = channels.add_parser('relay', help='运行本机中继服务')
+    relay.add_argument('--socket', help='套接字路径，默认读取环境变量 MSGBOT_RELAY_SOCKET')
+    relay.add_argument('--outbox-dir', help='发件箱目录，设置后支持 durable 请求')
+    relay.add_argument('--token-cache-dir', help='企业微信 access_token 缓存目录')
+    relay.add_argument('--metrics-port', type=int, help='在该端口导出 Prometheus 指标')
+    return parser
+
+
+def parse_line(line: str, fmt: str = 'auto') -> dict:
+    """
+    解析标准输入中的一行
+    :param line: 一行内容（不含换行）
+    :param fmt: auto / text / json
+    :return: 消息参数，空行返回 None
+    """
+    if not line.strip():
+        return None
+    if fmt == 'json' or (fmt == 'auto' and line.lstrip().startswith('{')):
+        message = json.loads(line)
+        if not isinstance(message, dict):
+            raise ValueError('[message] must be a JSON object...')
+        if 'content' not in message and 'text' in message:
+            message['content'] = message.pop('text')
+        if message.get('msgtype') == 'markdown':
+            message['markdown'] = True
+        return message
+    return {'content': line}
+
+
+class _DingTalkSender(object):
+
+    def __init__(self, args):
+        if not args.web_hook:
+            raise ValueError('[web_hook] 不能为空，请使用 --web-hook 或设置环境变量 DING_TALK_WEB_HOOK')
+        self.args = args
+        if args.relay:
+            from MsgBot.relay import RelayClient
+            self.bot = RelayClient('dingtalk', args.relay_socket, web_hook=args.web_hook, secret=args.secret)
+        else:
+            from MsgBot.ding_talk_bot.bot import DingTalkBot
+            rate_limiter = None
+            if args.shared_rate_limit:
+                from MsgBot.rate_limiter import SlidingWindowRateLimiter
+                rate_limiter = SlidingWindowRateLimiter.shared(args.web_hook)
+            self.bot = DingTalkBot(args.web_hook, args.secret, rate_limiter=rate_limiter)
+        self.target = self.bot
+        if args.coalesce and args.message == '-':
+            from MsgBot.ding_talk_bot.coalescer import DingTalkCoalescer
+            self.target = DingTalkCoalescer(self.bot, window=args.coalesce)
+
+    def send(self, message: dict):
+        args = self.args
+        at_mobiles = message.get('at_mobiles', args.at_mobiles)
+        at_all = message.get('at_all', args.at_all)
+        if message.get('markdown', args.markdown):
+            return self.target.send_markdown(message.get('title', args.title), message['content'], at_mobiles,
+                                             at_all, r_timeout=args.timeout)
+        return self.target.send_text(message['content'], at_mobiles, at_all, r_timeout=args.timeout)
+
+    def close(self):
+        if self.target is not self.bot:
+            self.target.close()
+        self.bot.close()
+
+
+class _WxComSender(object):
+
+    def __init__(self, args):
+        if not args.corp_id or not args.corp_secret or args.agent_id is None:
+            raise ValueError('[corp_id, corp_secret, agent_id] 不能为空，请使用命令行参数或设置对应的环境变量')
+        self.args = args
+        kwargs = {'api_base': args.api_base} if args.api_base else {}
+        if args.relay:
+            from MsgBot.relay import RelayClient
+            self.bot = RelayClient('wx_com', args.relay_socket, corp_id=args.corp_id, corp_secret=args.corp_secret,
+                                   **kwargs)
+        else:
+            from MsgBot.wx_com_bot.bot import WxComBot
+            self.bot = WxComBot(args.corp_id, args.corp_secret, token_cache=args.token_cache, **kwargs)
+
+    def send(self, message: dict):
+        args = self.args
+        send = self.bot.send_msg_md if message.get('markdown', args.markdown) else self.bot.send_msg_text
+        return send(agent_id=message.get('agent_id', args.agent_id), content=message['content'],
+                    to_user=message.get('to_user', args.to_user), to_party=message.get('to_party', args.to_party),
+                    to_tag=message.get('to_tag', args.to_tag), timeout=args.timeout)
+
+    def close(self):
+        self.bot.close()
+
+
+_SENDERS = {'dingtalk': _DingTalkSender, 'wx_com': _WxComSender}
+
+
+def _relay(args) -> int:
+    from MsgBot.relay import serve
+    metrics = None
+    if args.metrics_port:
+        from MsgBot.metrics import Metrics
+        metrics = Metrics()
+        metrics.serve(args.metrics_port)
+    try:
+        serve(args.socket, outbox_dir=args.outbox_dir, token_cache_dir=args.token_cache_dir, metrics=metrics)
+    except RuntimeError as e:
+        print(f'msgbot: {e}', file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def _send_one(sender, content: str) -> int:
+    try:
+        sender.send({'content': content})
+    except Exception as e:
+        print(f'msgbot: 发送失败：{e}', file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def _stream(sender, stdin, fmt: str) -> int:
+    failed = 0
+    for lineno, line in enumerate(stdin, 1):
+        try:
+            message = parse_line(line.rstrip('\r\n'), fmt)
+            if message is not None:
+                sender.send(message)
+        except Exception as e:
+            failed += 1
+            print(f'msgbot: 第 {lineno} 行发送失败：{e}', file=sys.stderr)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def main(argv: list = None, stdin=None) -> int:
+    """
+    :param argv: 命令行参数，默认为 sys.argv[1:]
+    :param stdin: 标准输入，默认为 sys.stdin
+    :return: 退出码
+    """
+    args = build_parser().parse_args(argv)
+    # 合并发送等后台线程的错误通过 logging 输出到标准错误
+    logging.basicConfig(level=logging.WARNING, format='msgbot: %(message)s')
+    if args.channel == 'relay':
+        return _relay(args)
+    try:
+        sender = _SENDERS[args.channel](args)
+    except ValueError as e:
+        print(f'msgbot: {e}', file=sys.stderr)
+        return EXIT_USAGE
+    try:
+        if args.message == '-':
+            code = _stream(sender, sys.stdin if stdin is None else stdin, args.format)
+        else:
+            code = _send_one(sender, args.message)
+    except KeyboardInterrupt:
+        code = EXIT_INTERRUPTED
+    try:
+        # 发送合并窗口中剩余的消息
+        sender.close()
+    except Exception as e:
+        print(f'msgbot: 发送失败：{e}', file=sys.stderr)
+        code = code or EXIT_FAILED
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
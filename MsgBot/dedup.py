@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import hashlib
+import threading
+from time import monotonic
+from collections import OrderedDict
+
+# 被去重缓存拦截时 _send_msg 返回的响应
+SUPPRESSED_RESPONSE = {'errcode': 0, 'errmsg': 'suppressed by dedup', 'suppressed': True}
+
+
+def payload_key(form_data: dict) -> str:
+    """
+    计算消息的去重键：对规范化（键排序）后的整个消息体取摘要，包含消息类型、内容与接收者
+    模板渲染后的字节串直接取摘要（同一模板的输出是确定的）
+    :param form_data: 消息体
+    :return: 十六进制摘要
+    """
+    if isinstance(form_data, bytes):
+        return hashlib.blake2b(form_data, digest_size=16).hexdigest()
+    normalized = json.dumps(form_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def with_suffix(form_data: dict, suffix: str) -> dict:
+    """
+    在消息正文末尾追加内容（text / markdown / actionCard 等含正文的类型），返回新的消息体
+    :param form_data: 消息体
+    :param suffix: 追加的内容
+    :return: 新的消息体
+    """
+    form_data = json.loads(form_data) if isinstance(form_data, bytes) else copy.deepcopy(form_data)
+    body = form_data.get(form_data.get('msgtype'))
+    if isinstance(body, dict):
+        for field in ('content', 'text'):
+            if isinstance(body.get(field), str):
+                body[field] += suffix
+                break
+    return form_data
+
+
+class DedupCache(object):
+    """
+    客户端消息去重
+    ttl 秒内相同的消息只发送一次，其余的直接拦截，不占用网络请求与限流名额
+    缓存按 LRU 淘汰，最多保存 maxsize 条
+    resend_summary 为 True 时，窗口结束后再次发送相同消息会附带此前被拦截的次数，
+    也可以调用机器人的 flush_duplicates 主动补发
+    """
+
+    def __init__(self, ttl: float = 300, maxsize: int = 1024, resend_summary: bool = True,
+                 suffix: str = '\n（该消息在过去 {ttl}s 内重复了 {count} 次）', clock=monotonic):
+        """
+        :param ttl: 去重窗口（秒）
+        :param maxsize: 最多缓存的消息条数
+        :param resend_summary: 是否在窗口结束后附带被拦截次数
+        :param suffix: 附带在正文末尾的内容，可使用 {ttl} 与 {count}
+        :param clock: 时钟函数
+        """
+        if ttl <= 0 or maxsize < 1:
+            raise ValueError('[ttl, maxsize] must be positive...')
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.resend_summary = resend_summary
+        self.suffix = suffix
+        self.clock = clock
+        # 去重键 -> [过期时间, 被拦截次数, 消息体, 本次放行时附带的重复次数]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 累计放行与拦截次数
+        self.passed = 0
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _summary(self, form_data: dict, count: int) -> dict:
+        return with_suffix(form_data, self.suffix.format(ttl=self.ttl, count=count))
+
+    def check(self, form_data: dict):
+        """
+        登记一次发送
+        :param form_data: 消息体
+        :return: 需要发送时返回实际要发送的消息体（可能附带重复次数），需要拦截时返回 None
+        """
+        key = payload_key(form_data)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                entry[1] += 1
+                self.suppressed += 1
+                self._entries.move_to_end(key)
+                return None
+            repeated = entry[1] if entry is not None else 0
+            self._entries[key] = [now + self.ttl, 0, form_data, repeated if self.resend_summary else 0]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.passed += 1
+        if repeated and self.resend_summary:
+            return self._summary(form_data, repeated)
+        return form_data
+
+    def release(self, form_data: dict):
+        """
+        撤销一次放行（发送失败时调用），之后相同的消息可以立即重发，此前附带的重复次数会保留
+        :param form_data: 传给 check 的原始消息体
+        """
+        key = payload_key(form_data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] += entry[3]
+            entry[3] = 0
+            if entry[1]:
+                # 保留重复次数，标记为已过期
+                entry[0] = self.clock()
+            else:
+                del self._entries[key]
+            self.passed -= 1
+
+    def expired_summaries(self) -> list:
+        """
+        取出窗口已结束且有被拦截记录的消息，并从缓存中移除
+        :return: 附带重复次数的消息体列表
+        """
+        now = self.clock()
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry[0] <= now and entry[1]]
+            entries = [self._entries.pop(key) for key in keys]
+        return [self._summary(form_data, count) for _, count, form_data, _ in entries]
@@ -1,2 +1,25 @@
 # -*- coding: utf-8 -*-
-from MsgBot.ding_talk_bot.bot import DingTalkBot
+from typing import TYPE_CHECKING
+from MsgBot import _lazy_getattr
+
+_EXPORTS = {
+    'DingTalkBot': 'MsgBot.ding_talk_bot.bot',
+    'AsyncDingTalkBot': 'MsgBot.ding_talk_bot.async_bot',
+    'DingTalkCoalescer': 'MsgBot.ding_talk_bot.coalescer',
+    'DingTalkBotPool': 'MsgBot.ding_talk_bot.pool',
+    'Signer': 'MsgBot.ding_talk_bot.signer',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    return _lazy_getattr(__name__, _EXPORTS, name)
+
+
+if TYPE_CHECKING:
+    from MsgBot.ding_talk_bot.bot import DingTalkBot
+    from MsgBot.ding_talk_bot.async_bot import AsyncDingTalkBot
+    from MsgBot.ding_talk_bot.coalescer import DingTalkCoalescer
+    from MsgBot.ding_talk_bot.pool import DingTalkBotPool
+    from MsgBot.ding_talk_bot.signer import Signer
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from MsgBot.channel import AsyncChannel
+from MsgBot.ding_talk_bot.bot import DingTalkBot
+
+
+class AsyncDingTalkBot(AsyncChannel, DingTalkBot):
+    """
+    钉钉群聊天机器人（asyncio 版本）
+    所有 send_* 方法与 DingTalkBot 同名同参，返回协程，需 await 调用
+    限流等待使用 asyncio.sleep ，不会阻塞事件循环
+    依赖 aiohttp ： pip install MsgBot[async]
+    """
+
+    def __init__(self, web_hook: str, secret: str = None, session=None, pool_maxsize: int = 100,
+                 keep_alive: bool = True, **kwargs):
+        """
+        :param web_hook: 钉钉机器人 Webhook 地址
+        :param secret:
+        :param session: 共用的 aiohttp.ClientSession ，传入后由调用方负责关闭
+                        并发向大量 Webhook 发送时建议所有机器人共用一个
+        :param pool_maxsize: 连接池最多同时打开的连接数
+        :param keep_alive: 是否保持长连接
+        :param kwargs: 其余参数同 DingTalkBot ，如 rate_limiter 、 dedup
+        """
+        super().__init__(web_hook, secret, session=session, pool_maxsize=pool_maxsize, keep_alive=keep_alive,
+                         **kwargs)
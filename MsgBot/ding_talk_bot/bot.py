@@ -1,27 +1,40 @@
 # -*- coding: utf-8 -*-
 
 import re
-import hmac
-import json
-import queue
-import base64
 import hashlib
 import requests
-from time import sleep
-from urllib import parse
-from datetime import datetime, timedelta
-from MsgBot.exceptions import SendError, DingTalkError
+from datetime import datetime
+from MsgBot.channel import Channel
+from MsgBot.dedup import DedupCache
+from MsgBot.retry import RetryPolicy
+from MsgBot.template import MessageTemplate, Slot
+from MsgBot.splitter import split_text
+from MsgBot.metrics import MetricsHook
+from MsgBot.ding_talk_bot.signer import Signer
+from MsgBot.rate_limiter import RateLimiter, SlidingWindowRateLimiter
+from MsgBot.exceptions import DingTalkError
 
+# 钉钉限流错误码：发送过快（超出每分钟 20 条），触发后该机器人会被限流 10 分钟
+THROTTLE_ERRCODE = 130101
+# 单条消息内容的字节上限
+MAX_BYTES = 20000
 
-class DingTalkBot(object):
+
+class DingTalkBot(Channel):
     """
     钉钉群聊天机器人
     只能在在钉钉PC端生成和设置
     每个机器人每分钟限制最多发送20条消息
     钉钉官方文档：https://ding-doc.dingtalk.com/doc#/serverapi2/qf2nxq/404d04c3
     """
+    error_class = DingTalkError
+    error_doc = '请查阅钉钉文档 [ https://ding-doc.dingtalk.com/doc#/serverapi2/qf2nxq ]'
+    channel_name = '钉钉'
 
-    def __init__(self, web_hook: str, secret: str = None):
+    def __init__(self, web_hook: str, secret: str = None, session: requests.Session = None,
+                 pool_maxsize: int = 10, max_retries=0, keep_alive: bool = True, rate_limiter: RateLimiter = None,
+                 dedup: DedupCache = None, retry_policy: RetryPolicy = None, max_bytes: int = MAX_BYTES,
+                 metrics: MetricsHook = None, metrics_name: str = None):
         """
         初始化聊天机器人
         聊天机器人可设置三种安全设置：
@@ -30,60 +43,73 @@ class DingTalkBot(object):
                                 3. IP地址、段白名单
         :param web_hook: 钉钉机器人 Webhook 地址
         :param secret:
+        :param session: 共用的 requests.Session ，传入后由调用方负责关闭，此时连接池相关参数无效
+        :param pool_maxsize: 连接池最多保持的连接数，多线程并发发送时应不小于线程数
+        :param max_retries: int 或 urllib3.util.Retry ，连接层面的重试策略，默认不重试
+        :param keep_alive: 是否保持长连接
+        :param rate_limiter: 限流器，默认每分钟最多 20 条的滑动窗口限流
+                             多个实例使用同一 Webhook 时应共用同一个限流器
+        :param dedup: 客户端去重缓存，相同消息在窗口内只发送一次，默认不去重
+        :param retry_policy: 重试策略（含按 Webhook 共享的熔断器），默认不重试
+        :param max_bytes: text / markdown 消息内容的字节上限，超出时自动拆分为多条依次发送，为 None 时不拆分
+        :param metrics: 指标回调（如 MsgBot.metrics.Metrics ），默认不收集
+        :param metrics_name: 指标中的机器人名称，默认由 Webhook 摘要生成（不暴露 access_token ）
         """
-        self.web_hook = web_hook
         self.web_hook_raw = web_hook
         self.secret = secret
-        # 上次加签时间（钉钉限定请求所带时间戳与发送请求时的时间间隔不能超过 1 小时）
-        self.sign_time = datetime.now() - timedelta(hours=1)
-        # 存储发送消息时的时间的队列
-        self.time_queue = queue.Queue(maxsize=20)
-        # 钉钉限定发起POST请求时，必须将字符集编码设置成UTF-8。
-        self.headers = {'Content-Type': 'application/json; charset=utf-8'}
+        # 加签（钉钉限定请求所带时间戳与发送请求时的时间间隔不能超过 1 小时）
+        self.signer = Signer(web_hook, secret) if secret else None
+        # 指标与熔断器使用 Webhook 摘要，日志与异常信息中不会出现 access_token
+        digest = f'dingtalk:{hashlib.blake2b(str(web_hook).encode(), digest_size=4).hexdigest()}'
+        super().__init__(session=session, pool_maxsize=pool_maxsize, max_retries=max_retries, keep_alive=keep_alive,
+                         rate_limiter=rate_limiter if rate_limiter is not None else SlidingWindowRateLimiter(20, 60),
+                         dedup=dedup, retry_policy=retry_policy, max_bytes=max_bytes, metrics=metrics,
+                         metrics_name=metrics_name or digest, circuit_key=digest)
+
+    @property
+    def web_hook(self) -> str:
+        """
+        实际请求的 Webhook 地址，设置了加签时带有时间戳和签名参数
+        """
+        if self.signer is None:
+            return self.web_hook_raw
+        return self.signer.url()
 
     def update_web_hook(self, now: datetime):
         """
-        计算加签，更新 web_hook （加上时间戳和签名参数）
-        :param now: 当前时间
+        立即重新计算加签
+        :param now: 签名使用的时间
         :return:
         """
-        timestamp = str(round(now.timestamp() * 1000))
-        if not isinstance(self.secret, str) or not self.secret.startswith('SEC'):
+        if self.signer is None:
             raise ValueError(f'Please check the secret: {self.secret}')
-        secret_enc = self.secret.encode('utf-8')
-        string_to_sign = '{}\n{}'.format(timestamp, self.secret)
-        string_to_sign_enc = string_to_sign.encode('utf-8')
-        hmac_code = hmac.new(secret_enc, string_to_sign_enc, digestmod=hashlib.sha256).digest()
-        sign = parse.quote_plus(base64.b64encode(hmac_code))
-        # print(timestamp)
-        # print(sign)
-        self.web_hook = f'{self.web_hook_raw}&timestamp={timestamp}&sign={sign}'
-        self.sign_time = now
+        self.signer.refresh(now.timestamp())
 
-    def _send_msg(self, form_data: dict, q_timeout: int = 60, r_timeout: int = 60):
-        now = datetime.now()
-        if self.secret:
-            # 提前 2 分钟更换，避免过于极限
-            if (now - self.sign_time).total_seconds >= 3480:
-                self.update_web_hook(now)
-        self.time_queue.put(now, timeout=q_timeout)
-        if self.time_queue.full():
-            # 当队列已满20条时，取20条消息中最早的时间
-            earliest_time = self.time_queue.get(timeout=q_timeout)
-            time_diff = (now - earliest_time).total_seconds
-            # 判断提前 2 秒，避免过于极限
-            if time_diff <= 58:
-                sleep(60 - time_diff)
-        try:
-            r = requests.post(url=self.web_hook, data=json.dumps(form_data), headers=self.headers, timeout=r_timeout)
-        except Exception as e:
-            raise SendError(f'发送 post 请求失败，详情如下：\n{e}')
-        response = json.loads(r.content.decode('utf-8'))
-        errcode = response.get('errcode', 1)
-        if errcode != 0:
-            raise DingTalkError(f'{response}\n请查阅钉钉文档 [ https://ding-doc.dingtalk.com/doc#/serverapi2/qf2nxq ]')
+    def _endpoint(self, stages) -> str:
+        return self.web_hook
 
-        return response
+    def _split_msg(self, msg: dict, field: str) -> list:
+        """
+        将正文超出字节上限的消息拆分为多条，@ 只保留在最后一条
+        :param msg: 消息体
+        :param field: 正文字段
+        :return: 消息体列表
+        """
+        if not self.max_bytes:
+            return [msg]
+        msgtype = msg['msgtype']
+        body = msg[msgtype]
+        parts = split_text(body[field], self.max_bytes, markdown=msgtype == 'markdown')
+        if len(parts) == 1:
+            return [msg]
+        msgs = []
+        for i, part in enumerate(parts, 1):
+            part_body = dict(body, **{field: part})
+            if 'title' in body:
+                part_body['title'] = f'{body["title"]} ({i}/{len(parts)})'
+            msgs.append({'msgtype': msgtype, msgtype: part_body})
+        msgs[-1]['at'] = msg['at']
+        return msgs
 
     def send_text(self, content: str, at_mobiles: list = None, at_all=False, q_timeout: int = 60,
                   r_timeout: int = 60):
@@ -95,9 +121,9 @@ class DingTalkBot(object):
         :param at_mobiles: 如  ['156xxxx8827', '189xxxx8325']
         :type at_mobiles: list
         :param at_all: 是否@所有人
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
-        :return: 发送钉钉消息后返回的响应
+        :return: 发送钉钉消息后返回的响应，消息被拆分时为各条消息的响应列表
         """
         if not isinstance(content, str):
             raise ValueError('[content] type must be string...')
@@ -114,7 +140,7 @@ class DingTalkBot(object):
                 'isAtAll': at_all
             }
         }
-        return self._send_msg(msg, q_timeout, r_timeout)
+        return self._send_parts(self._split_msg(msg, 'content'), q_timeout, r_timeout)
 
     def send_link(self, title: str, text: str, msg_url: str, pic_url: str = None,
                   q_timeout: int = 60, r_timeout: int = 60):
@@ -124,7 +150,7 @@ class DingTalkBot(object):
         :param text: str,消息内容（如果太长只会部分展示）
         :param msg_url: str,点击消息跳转的 URL
         :param pic_url: str,展示图片的 URL
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
         :return: 发送钉钉消息后返回的响应
         """
@@ -152,9 +178,9 @@ class DingTalkBot(object):
         :param at_mobiles: 如  ['156xxxx8827', '189xxxx8325']
         :type at_mobiles: list
         :param at_all: 是否@所有人
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
-        :return: 发送钉钉消息后返回的响应
+        :return: 发送钉钉消息后返回的响应，消息被拆分时为各条消息的响应列表
         """
         if not isinstance(title, str) or not isinstance(text, str):
             raise ValueError('[title, text] type must be string...')
@@ -172,7 +198,7 @@ class DingTalkBot(object):
                 'isAtAll': at_all
             }
         }
-        return self._send_msg(msg, q_timeout, r_timeout)
+        return self._send_parts(self._split_msg(msg, 'text'), q_timeout, r_timeout)
 
     def send_entire_action_card(self, title: str, text: str, single_title: str, single_url: str,
                                 q_timeout: int = 60, r_timeout: int = 60):
@@ -183,7 +209,7 @@ class DingTalkBot(object):
         :param text: markdown格式的消息
         :param single_title: 单个按钮的标题(设置此项和 ingleURL 后 btns 无效)
         :param single_url: 点击 single_title 按钮触发的URL
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
         :return: 发送钉钉消息后返回的响应
         """
@@ -215,7 +241,7 @@ class DingTalkBot(object):
                         title,按钮标题
                         actionURL,点击按钮触发的URL
         :param btn_orientation: 0-按钮竖直排列，1-按钮横向排列（按钮超过两个则自动竖排）
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
         :return: 发送钉钉消息后返回的响应
         """
@@ -250,7 +276,7 @@ class DingTalkBot(object):
                         title,消息标题文本
                         messageURL,消息跳转链接
                         picURL,该消息图片 URL
-        :param q_timeout: 队列等待超时时间
+        :param q_timeout: 等待限流名额的超时时间
         :param r_timeout: requests 超时时间
         :return: 发送钉钉消息后返回的响应
         """
@@ -272,3 +298,79 @@ class DingTalkBot(object):
         }
 
         return self._send_msg(msg, q_timeout, r_timeout)
+
+    @staticmethod
+    def _at_template(text: str, at_mobiles, at_all) -> dict:
+        if isinstance(at_mobiles, Slot):
+            return {'atMobiles': at_mobiles, 'isAtAll': at_all}
+        at_mobiles = [] if not isinstance(at_mobiles, list) else at_mobiles
+        # 只能在编译时从固定文本中匹配 @某人 ，参数中的手机号需通过 Slot 形式的 at_mobiles 传入
+        at_mobiles_from_text = [mobile for literal in MessageTemplate.literals(text)
+                                for mobile in re.findall('@(\\d+)', literal)]
+        return {'atMobiles': at_mobiles + at_mobiles_from_text, 'isAtAll': at_all}
+
+    @classmethod
+    def text_template(cls, content: str, at_mobiles=None, at_all=False) -> MessageTemplate:
+        """
+        编译 text 类型消息模板，参数同 send_text
+        :param content: 消息内容，可以包含 {name} 形式的参数
+        :param at_mobiles: 手机号列表，或 Slot('name') 表示渲染时传入
+        :param at_all: 是否@所有人，或 Slot('name') 表示渲染时传入
+        :return: MessageTemplate
+        """
+        if not isinstance(content, str):
+            raise ValueError('[content] type must be string...')
+        return MessageTemplate({
+            'msgtype': 'text',
+            'text': {
+                'content': content
+            },
+            'at': cls._at_template(content, at_mobiles, at_all)
+        })
+
+    @classmethod
+    def markdown_template(cls, title: str, text: str, at_mobiles=None, at_all=False) -> MessageTemplate:
+        """
+        编译 markdown 类型消息模板，参数同 send_markdown
+        :param title: 首屏会话透出的展示内容，可以包含 {name} 形式的参数
+        :param text: markdown 格式的消息，可以包含 {name} 形式的参数（花括号本身写作 {{ 与 }} ）
+        :param at_mobiles: 手机号列表，或 Slot('name') 表示渲染时传入
+        :param at_all: 是否@所有人，或 Slot('name') 表示渲染时传入
+        :return: MessageTemplate
+        """
+        if not isinstance(title, str) or not isinstance(text, str):
+            raise ValueError('[title, text] type must be string...')
+        return MessageTemplate({
+            'msgtype': 'markdown',
+            'markdown': {
+                'title': title,
+                'text': text
+            },
+            'at': cls._at_template(text, at_mobiles, at_all)
+        })
+
+    def send_template(self, template, values: dict = None, q_timeout: int = 60, r_timeout: int = 60):
+        """
+        使用预编译的模板发送消息
+        :param template: MessageTemplate ，或 MessageTemplate.render 渲染好的字节串
+        :param values: 模板参数
+        :param q_timeout: 等待限流名额的超时时间
+        :param r_timeout: requests 超时时间
+        :return: 发送钉钉消息后返回的响应
+        """
+        data = template.render(values) if isinstance(template, MessageTemplate) else template
+        if not isinstance(data, bytes):
+            raise ValueError('[template] must be MessageTemplate or bytes...')
+        return self._send_msg(data, q_timeout, r_timeout)
+
+    def notify(self, title: str, text: str, at_mobiles: list = None, at_all=False, **kwargs):
+        """
+        以 markdown 消息发送通知，供 MsgBot.notifier.Notifier 调用
+        :param title: 标题，同时作为 markdown 的一级标题
+        :param text: markdown 格式的正文
+        :param at_mobiles: 如  ['156xxxx8827', '189xxxx8325']
+        :param at_all: 是否@所有人
+        :param kwargs: 同 send_markdown ，如 q_timeout 、 r_timeout
+        :return: 发送钉钉消息后返回的响应
+        """
+        return self.send_markdown(title, f'### {title}\n\n{text}', at_mobiles, at_all, **kwargs)
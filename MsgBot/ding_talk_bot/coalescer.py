@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from time import monotonic
+from MsgBot.ding_talk_bot.bot import DingTalkBot
+
+logger = logging.getLogger(__name__)
+
+
+def build_digest(entries: list, title: str) -> str:
+    """
+    将多条消息合并为一条 markdown 汇总
+    :param entries: [(消息内容, 次数), ...]
+    :param title: 汇总标题
+    :return: markdown 格式的消息
+    """
+    total = sum(count for _, count in entries)
+    lines = [f'#### {title}（共 {total} 条）']
+    for text, count in entries:
+        lines.append(text if count == 1 else f'{text} **（×{count}）**')
+    return '\n\n'.join(lines)
+
+
+class DingTalkCoalescer(object):
+    """
+    钉钉消息合并发送
+    send_text / send_markdown 只是将消息放入缓冲区，窗口结束或缓冲区接近字节上限时，
+    由后台线程合并为一条 markdown 消息发送：相同内容只保留一条并标注次数，@ 的手机号合并去重
+    适用于故障时短时间内大量相似告警的场景，避免耗尽每分钟 20 条的额度
+    后台发送失败的汇总消息每隔 retry_interval 秒重新发送，flush / close 时也会立即重新发送；
+    等待重发的汇总超过 max_failed 条时丢弃最早的，交给 on_drop 回调
+    """
+
+    def __init__(self, bot: DingTalkBot, window: float = 10, max_bytes: int = 18000, title: str = '消息汇总',
+                 key=None, on_error=None, retry_interval: float = None, max_failed: int = 100, on_drop=None):
+        """
+        :param bot: DingTalkBot 实例
+        :param window: 合并窗口（秒），窗口内第一条消息到达后开始计时
+        :param max_bytes: 单条汇总消息的字节上限，超出时提前发送（钉钉消息上限约 20000 字节）
+        :param title: 汇总消息的标题
+        :param key: 计算消息分组键的函数，默认为消息内容本身，可用于合并仅时间戳等不同的相似消息
+        :param on_error: 后台发送汇总消息失败时的回调 on_error(entries, e) ， entries 为 [(消息内容, 次数), ...] ，
+                         默认记录错误日志
+        :param retry_interval: 发送失败的汇总消息重新发送的间隔（秒），默认与 window 相同
+        :param max_failed: 最多保留的发送失败的汇总消息条数
+        :param on_drop: 超出 max_failed 而丢弃汇总消息时的回调 on_drop(entries) ，默认记录错误日志
+        """
+        if max_failed < 1:
+            raise ValueError('[max_failed] must be positive...')
+        self.bot = bot
+        self.window = window
+        self.max_bytes = max_bytes
+        self.title = title
+        self.key = key
+        self.on_error = on_error
+        self.retry_interval = window if retry_interval is None else retry_interval
+        self.max_failed = max_failed
+        self.on_drop = on_drop
+        self._cond = threading.Condition()
+        # 取出批次并发送的过程持有该锁，保证后台线程与 flush 按顺序发送
+        self._send_lock = threading.Lock()
+        # 分组键 -> [消息内容, 次数]
+        self._entries = {}
+        self._at_mobiles = {}
+        self._at_all = False
+        # 发送参数（ q_timeout / r_timeout ），取本批消息中的最大值
+        self._kwargs = {}
+        self._size = 0
+        # 当前窗口的截止时间
+        self._deadline = None
+        # 已凑满、等待后台线程发送的批次
+        self._ready = []
+        # 发送失败、等待重新发送的批次
+        self._failed = []
+        # 下次重新发送失败批次的时间
+        self._retry_at = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='MsgBot-DingTalkCoalescer', daemon=True)
+        self._thread.start()
+
+    def send_text(self, content: str, at_mobiles: list = None, at_all=False, q_timeout: int = None,
+                  r_timeout: int = None):
+        """
+        缓冲 text 类型消息，参数同 DingTalkBot.send_text
+        q_timeout / r_timeout 作用于包含该消息的汇总消息，同一批次取最大值，不传时使用 DingTalkBot 的默认值
+        :return:
+        """
+        if not isinstance(content, str):
+            raise ValueError('[content] type must be string...')
+        self._add(content, at_mobiles, at_all, q_timeout=q_timeout, r_timeout=r_timeout)
+
+    def send_markdown(self, title: str, text: str, at_mobiles: list = None, at_all=False, q_timeout: int = None,
+                      r_timeout: int = None):
+        """
+        缓冲 markdown 类型消息，参数同 DingTalkBot.send_markdown ， q_timeout / r_timeout 同 send_text
+        :return:
+        """
+        if not isinstance(title, str) or not isinstance(text, str):
+            raise ValueError('[title, text] type must be string...')
+        self._add(f'**{title}**\n\n{text}', at_mobiles, at_all, q_timeout=q_timeout, r_timeout=r_timeout)
+
+    def _add(self, text: str, at_mobiles: list, at_all: bool, **kwargs):
+        key = self.key(text) if self.key else text
+        size = len(text.encode('utf-8'))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('DingTalkCoalescer has been closed')
+            entry = self._entries.get(key)
+            if entry is None:
+                if self._entries and self._size + size > self.max_bytes:
+                    self._ready.append(self._take())
+                self._entries[key] = [text, 1]
+                # 预留标题、次数标注与分隔符的空间
+                self._size += size + 32
+            else:
+                entry[1] += 1
+            for mobile in at_mobiles or ():
+                self._at_mobiles[mobile] = None
+            self._at_all = self._at_all or at_all
+            for name, value in kwargs.items():
+                if value is not None:
+                    self._kwargs[name] = max(self._kwargs.get(name, value), value)
+            if self._deadline is None:
+                self._deadline = monotonic() + self.window
+            self._cond.notify_all()
+
+    def _take(self):
+        """
+        在持有锁时调用，取出当前缓冲区并重置
+        """
+        batch = (list(self._entries.values()), list(self._at_mobiles), self._at_all, self._kwargs)
+        self._entries = {}
+        self._at_mobiles = {}
+        self._at_all = False
+        self._kwargs = {}
+        self._size = 0
+        self._deadline = None
+        return batch
+
+    def _send(self, batch):
+        entries, at_mobiles, at_all, kwargs = batch
+        return self.bot.send_markdown(self.title, build_digest(entries, self.title), at_mobiles, at_all, **kwargs)
+
+    def _report(self, batch, e: Exception):
+        if self.on_error is None:
+            logger.error('发送汇总消息失败，将在 %ss 后重新发送：%s', self.retry_interval, e)
+            return
+        try:
+            self.on_error([tuple(entry) for entry in batch[0]], e)
+        except Exception as callback_error:
+            logger.error('on_error 回调失败：%s', callback_error)
+
+    def _keep_failed(self, batches: list, front: bool = False) -> list:
+        """
+        在持有锁时调用，保留发送失败的批次等待重发
+        :param front: 是否排在已有的失败批次之前
+        :return: 超出 max_failed 而丢弃的最早的批次
+        """
+        if front:
+            self._failed[:0] = batches
+        else:
+            self._failed.extend(batches)
+        self._retry_at = monotonic() + self.retry_interval
+        # flush 失败时唤醒后台线程按新的重发时间等待
+        self._cond.notify_all()
+        dropped = self._failed[:-self.max_failed]
+        del self._failed[:len(dropped)]
+        return dropped
+
+    def _drop(self, batches: list):
+        for batch in batches:
+            entries = [tuple(entry) for entry in batch[0]]
+            if self.on_drop is None:
+                logger.error('等待重发的汇总消息超过 %s 条，已丢弃：%s', self.max_failed, entries)
+                continue
+            try:
+                self.on_drop(entries)
+            except Exception as callback_error:
+                logger.error('on_drop 回调失败：%s', callback_error)
+
+    def _due(self) -> bool:
+        """
+        在持有锁时调用
+        :return: 是否有需要后台线程发送的批次
+        """
+        now = monotonic()
+        return bool(self._ready) or bool(self._entries and self._deadline is not None and self._deadline <= now) or \
+            bool(self._failed and self._retry_at <= now)
+
+    def _wait_timeout(self):
+        """
+        在持有锁时调用
+        :return: 距离窗口结束或重发失败批次的秒数，都没有时返回 None
+        """
+        times = [t for t in (self._deadline, self._retry_at if self._failed else None) if t is not None]
+        return max(0, min(times) - monotonic()) if times else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._due() and not self._closed:
+                    self._cond.wait(self._wait_timeout())
+                if not self._due():
+                    # 已关闭，剩余消息由 close 在调用方线程发送
+                    return
+            with self._send_lock:
+                with self._cond:
+                    # 等待发送锁期间 flush 可能已取走全部消息
+                    if not self._due():
+                        continue
+                    if self._entries and self._deadline is not None and self._deadline <= monotonic():
+                        self._ready.append(self._take())
+                    # 之前失败的批次排在前面重新发送
+                    batches = self._failed + self._ready
+                    self._failed, self._ready = [], []
+                for batch in batches:
+                    try:
+                        self._send(batch)
+                    except Exception as e:
+                        with self._cond:
+                            dropped = self._keep_failed([batch])
+                        self._report(batch, e)
+                        self._drop(dropped)
+
+    def pending(self) -> int:
+        """
+        :return: 缓冲区中尚未发送（含发送失败等待重发）的消息条数
+        """
+        with self._cond:
+            return sum(count for _, count in self._entries.values()) + \
+                sum(count for batch in self._failed + self._ready for _, count in batch[0])
+
+    def flush(self) -> list:
+        """
+        在当前线程立即发送缓冲区中的所有消息（含之前发送失败的汇总），后台线程正在发送时等待其完成
+        发送失败时抛出异常，未发送成功的批次保留，下次 flush / close 时重新发送
+        :return: 每条汇总消息发送后返回的响应
+        """
+        with self._send_lock:
+            with self._cond:
+                batches = self._failed + self._ready
+                self._failed, self._ready = [], []
+                if self._entries:
+                    batches.append(self._take())
+            responses = []
+            for i, batch in enumerate(batches):
+                try:
+                    responses.append(self._send(batch))
+                except Exception:
+                    with self._cond:
+                        dropped = self._keep_failed(batches[i:], front=True)
+                    self._drop(dropped)
+                    raise
+            return responses
+
+    def close(self):
+        """
+        发送剩余消息并停止后台线程
+        :return:
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+from time import monotonic
+from collections import deque
+from functools import partial
+from MsgBot.session import build_session
+from MsgBot.exceptions import DingTalkError, RateLimitError
+from MsgBot.ding_talk_bot.bot import DingTalkBot, THROTTLE_ERRCODE
+
+logger = logging.getLogger(__name__)
+
+
+class DingTalkBotPool(object):
+    """
+    多个钉钉机器人组成的发送池
+    单个机器人每分钟最多发送 20 条，在同一个群中添加多个机器人并放入发送池，吞吐量随机器人数量线性增加
+    路由策略：
+        least_loaded: 发送给当前剩余额度最多的机器人
+        round_robin: 轮流发送，跳过额度已用完的机器人
+    某个机器人被钉钉限流（errcode 130101）时，在 cooldown 秒内不再使用，并立即改用其他机器人发送
+    send_* 方法与 DingTalkBot 同名同参
+    """
+    LEAST_LOADED = 'least_loaded'
+    ROUND_ROBIN = 'round_robin'
+
+    def __init__(self, robots: list, strategy: str = LEAST_LOADED, cooldown: float = 600, pool_maxsize: int = 10):
+        """
+        :param robots: 机器人列表，元素可以是 DingTalkBot 实例、 web_hook 字符串或 (web_hook, secret) 元组
+        :param strategy: 路由策略， least_loaded / round_robin
+        :param cooldown: 机器人被限流后暂停使用的秒数（钉钉限流持续 10 分钟）
+        :param pool_maxsize: 由 web_hook 创建机器人时，共用连接池最多保持的连接数
+        """
+        if strategy not in (self.LEAST_LOADED, self.ROUND_ROBIN):
+            raise ValueError(f'Unknown strategy: {strategy}')
+        if not robots:
+            raise ValueError('[robots] must not be empty...')
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._session = None
+        self.bots = []
+        for robot in robots:
+            if not isinstance(robot, DingTalkBot):
+                if self._session is None:
+                    # 钉钉机器人都在同一个域名下，共用一个连接池即可
+                    self._session = build_session(pool_connections=1, pool_maxsize=pool_maxsize)
+                web_hook, secret = (robot, None) if isinstance(robot, str) else robot
+                robot = DingTalkBot(web_hook, secret, session=self._session)
+            self.bots.append(robot)
+        self._lock = threading.Lock()
+        self._next = 0
+        # 机器人下标 -> 暂停使用的截止时间
+        self._cooling = {}
+        # 每个机器人的发送成功、失败、被限流次数
+        self._counts = [{'sent': 0, 'failed': 0, 'throttled': 0} for _ in self.bots]
+        # 最近 60 秒内发送成功的时间，用于计算吞吐量
+        self._recent = deque()
+
+    def __getattr__(self, name: str):
+        # pool.send_text(...) 等价于 pool.send('send_text', ...)
+        if name.startswith('send_') and callable(getattr(DingTalkBot, name, None)):
+            return partial(self.send, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def _candidates(self) -> list:
+        """
+        按路由策略排列可用机器人的下标，有额度的在前；全部在冷却时也返回全部，交由限流器等待
+        """
+        now = monotonic()
+        with self._lock:
+            indexes = [i for i in range(len(self.bots)) if self._cooling.get(i, 0) <= now] or \
+                list(range(len(self.bots)))
+            if self.strategy == self.ROUND_ROBIN:
+                start = self._next % len(self.bots)
+                self._next += 1
+                indexes.sort(key=lambda i: (i - start) % len(self.bots))
+        budgets = {i: (self.bots[i].rate_limiter.remaining(), self.bots[i].rate_limiter.time_until_next())
+                   for i in indexes}
+        if self.strategy == self.LEAST_LOADED:
+            # 剩余额度多的优先，额度都用完时等待时间短的优先
+            return sorted(indexes, key=lambda i: (-budgets[i][0], budgets[i][1]))
+        # 轮询时保持顺序，仅把额度已用完的放到最后
+        return sorted(indexes, key=lambda i: budgets[i][0] <= 0)
+
+    def send(self, method: str, *args, **kwargs):
+        """
+        选择机器人发送消息，被限流时自动改用下一个机器人
+        :param method: DingTalkBot 的方法名，如 send_text
+        :return: 发送钉钉消息后返回的响应
+        """
+        candidates = self._candidates()
+        for n, i in enumerate(candidates):
+            last = n == len(candidates) - 1
+            try:
+                response = getattr(self.bots[i], method)(*args, **kwargs)
+            except (DingTalkError, RateLimitError) as e:
+                throttled = isinstance(e, RateLimitError) or e.errcode == THROTTLE_ERRCODE
+                with self._lock:
+                    self._counts[i]['throttled' if throttled else 'failed'] += 1
+                    if throttled and isinstance(e, DingTalkError):
+                        self._cooling[i] = monotonic() + self.cooldown
+                if not throttled or last:
+                    raise
+                logger.warning('机器人 %s 已被限流，改用其他机器人发送', i)
+                continue
+            except Exception:
+                with self._lock:
+                    self._counts[i]['failed'] += 1
+                raise
+            with self._lock:
+                self._counts[i]['sent'] += 1
+                self._recent.append(monotonic())
+            return response
+
+    def throughput(self) -> int:
+        """
+        :return: 最近 60 秒内发送成功的消息数
+        """
+        with self._lock:
+            start = monotonic() - 60
+            while self._recent and self._recent[0] <= start:
+                self._recent.popleft()
+            return len(self._recent)
+
+    def stats(self) -> dict:
+        """
+        :return: 发送池的汇总统计
+        """
+        now = monotonic()
+        per_bot = []
+        with self._lock:
+            for i, bot in enumerate(self.bots):
+                per_bot.append(dict(self._counts[i], remaining=bot.rate_limiter.remaining(),
+                                    cooling=max(0.0, self._cooling.get(i, 0) - now)))
+        return {
+            'sent': sum(c['sent'] for c in per_bot),
+            'failed': sum(c['failed'] for c in per_bot),
+            'throttled': sum(c['throttled'] for c in per_bot),
+            'per_minute': self.throughput(),
+            'capacity_per_minute': sum(bot.rate_limiter.limit for bot in self.bots
+                                       if hasattr(bot.rate_limiter, 'limit')),
+            'bots': per_bot
+        }
+
+    def close(self):
+        """
+        关闭发送池自行创建的连接池
+        :return:
+        """
+        if self._session is not None:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
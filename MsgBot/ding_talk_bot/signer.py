@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import time
+import hmac
+import base64
+import hashlib
+import threading
+from urllib import parse
+
+
+class Signer(object):
+    """
+    钉钉机器人加签
+    HMAC 密钥对象只创建一次，每次签名复制后使用；签名后的 URL 在有效期内缓存复用
+    URL 与其有效期作为一个整体原子替换，多线程读取时不会拿到更新了一半的 URL
+    钉钉限定请求所带时间戳与发送请求时的时间间隔不能超过 1 小时，默认提前 2 分钟重新签名
+    """
+
+    def __init__(self, web_hook: str, secret: str, ttl: float = 3480, clock=time.time):
+        """
+        :param web_hook: 钉钉机器人 Webhook 地址（不含时间戳与签名参数）
+        :param secret: 加签密钥，以 SEC 开头
+        :param ttl: 签名后的 URL 复用的秒数
+        :param clock: 时钟函数，返回时间戳
+        """
+        if not isinstance(secret, str) or not secret.startswith('SEC'):
+            raise ValueError(f'Please check the secret: {secret}')
+        self.web_hook = web_hook
+        self.ttl = ttl
+        self.clock = clock
+        self._secret = secret
+        self._mac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+        # (签名后的 URL, 过期时间戳)
+        self._signed = (None, 0.0)
+        self._lock = threading.Lock()
+
+    def sign(self, timestamp: int) -> str:
+        """
+        :param timestamp: 毫秒时间戳
+        :return: URL 编码后的签名
+        """
+        mac = self._mac.copy()
+        mac.update(f'{timestamp}\n{self._secret}'.encode('utf-8'))
+        return parse.quote_plus(base64.b64encode(mac.digest()))
+
+    def refresh(self, now: float = None) -> str:
+        """
+        立即重新签名
+        :param now: 签名使用的时间戳（秒），默认为当前时间
+        :return: 签名后的 URL
+        """
+        now = self.clock() if now is None else now
+        timestamp = round(now * 1000)
+        url = f'{self.web_hook}&timestamp={timestamp}&sign={self.sign(timestamp)}'
+        self._signed = (url, now + self.ttl)
+        return url
+
+    def url(self) -> str:
+        """
+        :return: 有效期内的签名 URL ，临近过期时重新签名
+        """
+        url, expires_at = self._signed
+        if self.clock() < expires_at:
+            return url
+        with self._lock:
+            # 等待锁期间其他线程可能已重新签名
+            url, expires_at = self._signed
+            if self.clock() < expires_at:
+                return url
+            return self.refresh()
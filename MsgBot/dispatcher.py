@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+import atexit
+import inspect
+import logging
+import weakref
+import threading
+from time import monotonic
+from collections import deque
+from functools import partial
+from concurrent.futures import Future
+from MsgBot.channel import AsyncChannel
+from MsgBot.exceptions import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# 解释器退出时需要优雅关闭的 Dispatcher
+_dispatchers = weakref.WeakSet()
+
+
+def _check_bot(bot):
+    # 工作线程不运行事件循环，异步机器人的 send_* 返回的协程不会被执行
+    if isinstance(bot, AsyncChannel):
+        raise TypeError(f'{type(bot).__name__} 的 send_* 返回协程，请直接 await ，不能在工作线程中发送')
+
+
+def _call(func, args: tuple, kwargs: dict):
+    """
+    在工作线程中调用 bot 方法，返回值为协程等可等待对象时关闭它并抛出 TypeError
+    """
+    result = func(*args, **kwargs)
+    if inspect.isawaitable(result):
+        if inspect.iscoroutine(result):
+            result.close()
+        raise TypeError(f'{getattr(func, "__name__", func)} 返回了可等待对象，工作线程不运行事件循环，消息未发送')
+    return result
+
+
+class Dispatcher(object):
+    """
+    后台异步发送
+    send_* 调用只是把消息放入有界队列并立即返回 concurrent.futures.Future ，由后台工作线程实际发送
+    队列已满时的处理策略：
+        block: 阻塞等待队列空出位置（可设置 put_timeout ，超时抛出 QueueFullError）
+        drop_oldest: 丢弃队列中最早的消息，其 Future 被设置为 QueueFullError
+        drop_newest: 丢弃当前消息，返回的 Future 被设置为 QueueFullError
+    解释器退出时会等待队列中的消息发送完毕（最多 exit_timeout 秒）
+    """
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    def __init__(self, bot, workers: int = 2, maxsize: int = 1000, policy: str = BLOCK, put_timeout: float = None,
+                 exit_timeout: float = 10):
+        """
+        :param bot: DingTalkBot / WxComBot 实例（不支持 AsyncDingTalkBot 等异步机器人）
+        :param workers: 工作线程数
+        :param maxsize: 队列最大长度
+        :param policy: 队列已满时的处理策略， block / drop_oldest / drop_newest
+        :param put_timeout: policy 为 block 时最多阻塞的秒数，None 表示一直等待
+        :param exit_timeout: 解释器退出时最多等待发送的秒数
+        """
+        if policy not in (self.BLOCK, self.DROP_OLDEST, self.DROP_NEWEST):
+            raise ValueError(f'Unknown policy: {policy}')
+        if workers < 1 or maxsize < 1:
+            raise ValueError('[workers, maxsize] must be positive...')
+        _check_bot(bot)
+        self.bot = bot
+        self.maxsize = maxsize
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self.exit_timeout = exit_timeout
+        self._queue = deque()
+        self._cond = threading.Condition()
+        # 已入队但尚未完成（含发送中）的消息数
+        self._unfinished = 0
+        self._closed = False
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._worker, name=f'MsgBot-Dispatcher-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        _dispatchers.add(self)
+
+    def __getattr__(self, name: str):
+        # dispatcher.send_text(...) 等价于 dispatcher.submit('send_text', ...)
+        bot = self.__dict__.get('bot')
+        if name.startswith('send_') and callable(getattr(bot, name, None)):
+            return partial(self.submit, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """
+        将一次 bot 方法调用放入队列
+        :param method: bot 的方法名，如 send_text
+        :return: Future ，结果为发送消息后返回的响应
+        """
+        func = getattr(self.bot, method)
+        future = Future()
+        dropped = None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Dispatcher has been shut down')
+            if len(self._queue) >= self.maxsize:
+                if self.policy == self.DROP_NEWEST:
+                    future.set_exception(QueueFullError('队列已满，消息被丢弃'))
+                    return future
+                if self.policy == self.DROP_OLDEST:
+                    dropped = self._queue.popleft()[0]
+                    self._unfinished -= 1
+                else:
+                    deadline = None if self.put_timeout is None else monotonic() + self.put_timeout
+                    while len(self._queue) >= self.maxsize and not self._closed:
+                        remaining = None if deadline is None else deadline - monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise QueueFullError(f'队列已满，等待 {self.put_timeout}s 后仍无空位')
+                        self._cond.wait(remaining)
+                    if self._closed:
+                        raise RuntimeError('Dispatcher has been shut down')
+            self._queue.append((future, func, args, kwargs))
+            self._unfinished += 1
+            self._cond.notify_all()
+        if dropped is not None:
+            dropped.set_exception(QueueFullError('队列已满，消息被丢弃'))
+        return future
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                future, func, args, kwargs = self._queue.popleft()
+                # 唤醒阻塞在 submit 中的生产者
+                self._cond.notify_all()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(_call(func, args, kwargs))
+                except BaseException as e:
+                    logger.debug('后台发送失败：%s', e)
+                    future.set_exception(e)
+            with self._cond:
+                self._unfinished -= 1
+                self._cond.notify_all()
+
+    def qsize(self) -> int:
+        """
+        :return: 队列中等待发送的消息数
+        """
+        return len(self._queue)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待已入队的消息全部处理完毕
+        :param timeout: 最多等待的秒数，None 表示一直等待
+        :return: 是否在超时前处理完毕
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """
+        停止接收新消息并关闭工作线程
+        :param wait: 是否等待队列中的消息发送完毕，为 False 时未发送的消息会被取消
+        :param timeout: 最多等待的秒数
+        :return:
+        """
+        with self._cond:
+            if not wait:
+                while self._queue:
+                    self._queue.popleft()[0].cancel()
+                    self._unfinished -= 1
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            deadline = None if timeout is None else monotonic() + timeout
+            for t in self._threads:
+                t.join(None if deadline is None else max(0, deadline - monotonic()))
+        _dispatchers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+@atexit.register
+def _shutdown_all():
+    for dispatcher in list(_dispatchers):
+        dispatcher.shutdown(wait=True, timeout=dispatcher.exit_timeout)
@@ -1,11 +1,39 @@
 # -*- coding: utf-8 -*-
 class DingTalkError(Exception):
-    pass
+
+    def __init__(self, *args, errcode: int = None):
+        super().__init__(*args)
+        # 钉钉返回的错误码
+        self.errcode = errcode
 
 
 class WxComError(Exception):
-    pass
+
+    def __init__(self, *args, errcode: int = None):
+        super().__init__(*args)
+        # 企业微信返回的错误码
+        self.errcode = errcode
 
 
 class SendError(Exception):
     pass
+
+
+class ChannelError(SendError):
+
+    def __init__(self, *args, errcode: int = None):
+        super().__init__(*args)
+        # 自定义渠道返回的错误码
+        self.errcode = errcode
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class CircuitOpenError(SendError):
+    pass
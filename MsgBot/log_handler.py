@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class BotHandler(logging.Handler):
+    """
+    将日志发送到机器人的 logging.Handler 基类
+    与 QueueHandler / QueueListener 类似， emit 只是格式化日志并放入内存缓冲区，由后台线程发送，
+    记录日志的线程不会因网络请求而阻塞，也不会因发送失败而抛出异常
+    后台线程每隔 flush_interval 秒将缓冲区中的日志合并为一条消息发送（超长时由机器人自动拆分）
+    缓冲区最多保存 capacity 条，超出时丢弃最早的日志，并在下一条消息中注明丢弃的条数
+    MsgBot 自身的日志不会被发送，避免发送失败的日志再次触发发送
+    子类只需实现 _send
+    """
+
+    def __init__(self, level=logging.ERROR, flush_interval: float = 10, capacity: int = 1000,
+                 title: str = '日志告警', flush_timeout: float = 30):
+        """
+        :param level: 日志级别，默认只发送 ERROR 及以上
+        :param flush_interval: 合并发送的间隔（秒）
+        :param capacity: 缓冲区最多保存的日志条数
+        :param title: 消息标题
+        :param flush_timeout: 关闭时最多等待后台线程发送的秒数
+        """
+        super().__init__(level)
+        if flush_interval <= 0 or capacity < 1:
+            raise ValueError('[flush_interval, capacity] must be positive...')
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.title = title
+        self.flush_timeout = flush_timeout
+        # deque 的 append / popleft 是线程安全的，emit 不需要加锁
+        self._buffer = deque(maxlen=capacity)
+        self.dropped = 0
+        # 保证同一时刻只有一个线程在发送，消息按顺序到达
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'MsgBot-{type(self).__name__}', daemon=True)
+        self._thread.start()
+
+    def filter(self, record: logging.LogRecord):
+        if record.name == 'MsgBot' or record.name.startswith('MsgBot.'):
+            return False
+        return super().filter(record)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            text = self.format(record)
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+            self._buffer.append(text)
+        except Exception:
+            self.handleError(record)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def _take(self) -> list:
+        records = []
+        while True:
+            try:
+                records.append(self._buffer.popleft())
+            except IndexError:
+                return records
+
+    def build_message(self, records: list, dropped: int) -> str:
+        """
+        将多条日志合并为一条消息，可在子类中覆盖
+        :param records: 格式化后的日志
+        :param dropped: 缓冲区已满而被丢弃的条数
+        :return: 消息内容
+        """
+        lines = [f'【{self.title}】共 {len(records) + dropped} 条']
+        if dropped:
+            lines[0] += f'（缓冲区已满，最早的 {dropped} 条已丢弃）'
+        lines.extend(records)
+        return '\n\n'.join(lines)
+
+    def _send(self, message: str):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        在当前线程立即发送缓冲区中的日志，失败时只记录到 MsgBot 自身的日志
+        """
+        with self._send_lock:
+            records = self._take()
+            dropped, self.dropped = self.dropped, 0
+            if not records:
+                return
+            try:
+                self._send(self.build_message(records, dropped))
+            except Exception as e:
+                logger.warning('发送 %d 条日志失败：%s', len(records), e)
+
+    def close(self):
+        """
+        停止后台线程并发送剩余的日志（ logging.shutdown 会在解释器退出时调用）
+        """
+        self._stop.set()
+        self._thread.join(self.flush_timeout)
+        self.flush()
+        super().close()
+
+
+class DingTalkHandler(BotHandler):
+    """
+    将日志发送到钉钉群
+
+        handler = DingTalkHandler(DingTalkBot(web_hook, secret), flush_interval=10)
+        logging.getLogger().addHandler(handler)
+    """
+
+    def __init__(self, bot, at_mobiles: list = None, at_all=False, **kwargs):
+        """
+        :param bot: DingTalkBot 实例（或 DingTalkBotPool ）
+        :param at_mobiles: 发送时 @ 的手机号
+        :param at_all: 是否@所有人
+        :param kwargs: 同 BotHandler
+        """
+        self.bot = bot
+        self.at_mobiles = at_mobiles
+        self.at_all = at_all
+        super().__init__(**kwargs)
+
+    def _send(self, message: str):
+        self.bot.send_text(message, self.at_mobiles, self.at_all)
+
+
+class WxComHandler(BotHandler):
+    """
+    将日志通过企业微信应用消息发送
+
+        handler = WxComHandler(WxComBot(corp_id, corp_secret), agent_id=1000002, to_user='zhangsan')
+        logging.getLogger().addHandler(handler)
+    """
+
+    def __init__(self, bot, agent_id: int, to_user: str = None, to_party: str = None, to_tag: str = None, **kwargs):
+        """
+        :param bot: WxComBot 实例
+        :param agent_id: 企业应用的id
+        :param to_user: 接收消息的成员，多个接收者用 | 分隔
+        :param to_party: 接收消息的部门
+        :param to_tag: 接收消息的标签
+        :param kwargs: 同 BotHandler
+        """
+        if not to_user and not to_party and not to_tag:
+            raise ValueError('[to_user,to_party,to_tag] 不能同时为空')
+        self.bot = bot
+        self.agent_id = agent_id
+        self.to_user = to_user
+        self.to_party = to_party
+        self.to_tag = to_tag
+        super().__init__(**kwargs)
+
+    def _send(self, message: str):
+        self.bot.send_msg_text(self.agent_id, message, to_user=self.to_user, to_party=self.to_party,
+                               to_tag=self.to_tag)
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import weakref
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from MsgBot.exceptions import SendError, RateLimitError, CircuitOpenError
+
+# 默认的耗时分桶（秒），覆盖从编码的微秒级到限流等待的分钟级
+DEFAULT_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def result_code(error: BaseException = None) -> str:
+    """
+    将一次发送的结果归类为 errcode 标签
+    :param error: 发送时抛出的异常，成功时为 None
+    :return: 平台返回的 errcode ，或 rate_limited / circuit_open / network / 异常类名
+    """
+    if error is None:
+        return '0'
+    errcode = getattr(error, 'errcode', None)
+    if errcode is not None:
+        return str(errcode)
+    if isinstance(error, RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, CircuitOpenError):
+        return 'circuit_open'
+    if isinstance(error, SendError):
+        return 'network'
+    return type(error).__name__
+
+
+class MetricsHook(object):
+    """
+    指标回调接口，机器人在发送过程中调用，默认不做任何事
+    可继承此类接入 StatsD 、 OpenTelemetry 等，内置的 Metrics 可导出 Prometheus 文本格式
+    回调在发送线程中同步执行，应尽量轻量
+    """
+
+    def register(self, name: str, bot):
+        """
+        机器人构造时登记自身，可在导出时读取限流器占用等状态
+        """
+
+    def on_stage(self, name: str, stage: str, seconds: float):
+        """
+        一次请求的某个阶段结束
+        :param name: 机器人名称
+        :param stage: rate_limit （等待限流名额）/ token （获取 access_token ）/ encode / http / parse / total
+        :param seconds: 耗时
+        """
+
+    def on_result(self, name: str, errcode: str):
+        """
+        一次请求结束（重试时每次尝试都会调用），或消息被去重拦截（ errcode 为 suppressed ）
+        :param name: 机器人名称
+        :param errcode: 见 result_code
+        """
+
+    def on_token_refresh(self, name: str):
+        """
+        企业微信 access_token 刷新成功
+        """
+
+
+class _NullTrace(object):
+    """
+    未启用指标时使用，所有操作都是空操作
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def mark(self, stage: str):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+class Trace(object):
+    """
+    记录一次请求各阶段的耗时， with 块结束时上报总耗时与结果
+    """
+    __slots__ = ('hook', 'name', 'start', 'last')
+
+    def __init__(self, hook: MetricsHook, name: str):
+        self.hook = hook
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.last = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.hook.on_stage(self.name, 'total', perf_counter() - self.start)
+        self.hook.on_result(self.name, result_code(exc_val))
+        return False
+
+    def mark(self, stage: str):
+        now = perf_counter()
+        self.hook.on_stage(self.name, stage, now - self.last)
+        self.last = now
+
+
+def trace(hook: MetricsHook, name: str):
+    """
+    :return: 未启用指标（ hook 为 None ）时返回空操作的 NULL_TRACE
+    """
+    return NULL_TRACE if hook is None else Trace(hook, name)
+
+
+class Histogram(object):
+    """
+    固定分桶的直方图
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最后一个为 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metrics(MetricsHook):
+    """
+    内置的指标收集器
+    收集各阶段耗时直方图、按 errcode 分类的请求次数与 access_token 刷新次数，
+    限流器占用与队列长度等状态在导出时才读取，不增加发送时的开销
+
+        metrics = Metrics()
+        bot = DingTalkBot(web_hook, metrics=metrics)
+        metrics.gauge('msgbot_queue_depth', dispatcher.qsize, '队列中等待发送的消息数')
+        print(metrics.to_prometheus())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: 耗时直方图的分桶上界（秒）
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (机器人名称, 阶段) -> Histogram
+        self.stages = {}
+        # (机器人名称, errcode) -> 次数
+        self.results = {}
+        # 机器人名称 -> 次数
+        self.token_refreshes = {}
+        self._bots = weakref.WeakValueDictionary()
+        # [(指标名, 取值函数, 说明, 标签), ...]
+        self._gauges = []
+
+    def register(self, name: str, bot):
+        self._bots[name] = bot
+
+    def on_stage(self, name: str, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.stages.get((name, stage))
+            if histogram is None:
+                histogram = self.stages[(name, stage)] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def on_result(self, name: str, errcode: str):
+        with self._lock:
+            self.results[(name, errcode)] = self.results.get((name, errcode), 0) + 1
+
+    def on_token_refresh(self, name: str):
+        with self._lock:
+            self.token_refreshes[name] = self.token_refreshes.get(name, 0) + 1
+
+    def gauge(self, metric: str, func, help_text: str = '', **labels):
+        """
+        登记一个在导出时读取的状态值，如 Dispatcher.qsize 、 Outbox.pending
+        :param metric: 指标名
+        :param func: 无参数的取值函数
+        :param help_text: 说明
+        :param labels: 标签
+        """
+        self._gauges.append((metric, func, help_text, labels))
+
+    def _limiter_lines(self) -> list:
+        remaining, in_use = [], []
+        for name, bot in list(self._bots.items()):
+            limiter = getattr(bot, 'rate_limiter', None)
+            if limiter is None:
+                continue
+            free = limiter.remaining()
+            remaining.append(f'msgbot_rate_limiter_remaining{_labels(bot=name)} {free}')
+            limit = getattr(limiter, 'limit', None) or getattr(limiter, 'capacity', None)
+            if limit is not None:
+                in_use.append(f'msgbot_rate_limiter_in_use{_labels(bot=name)} {limit - free}')
+        lines = []
+        if remaining:
+            lines += ['# HELP msgbot_rate_limiter_remaining 限流器当前可立即占用的名额',
+                      '# TYPE msgbot_rate_limiter_remaining gauge'] + remaining
+        if in_use:
+            lines += ['# HELP msgbot_rate_limiter_in_use 限流窗口内已占用的名额',
+                      '# TYPE msgbot_rate_limiter_in_use gauge'] + in_use
+        return lines
+
+    def to_prometheus(self) -> str:
+        """
+        :return: Prometheus 文本格式（ text/plain; version=0.0.4 ）的全部指标
+        """
+        with self._lock:
+            stages = [(key, list(h.counts), h.sum, h.count) for key, h in sorted(self.stages.items())]
+            results = sorted(self.results.items())
+            refreshes = sorted(self.token_refreshes.items())
+        lines = []
+        if stages:
+            lines += ['# HELP msgbot_stage_seconds 发送各阶段耗时', '# TYPE msgbot_stage_seconds histogram']
+            for (name, stage), counts, total, count in stages:
+                cumulative = 0
+                for bound, n in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += n
+                    lines.append(f'msgbot_stage_seconds_bucket{_labels(bot=name, stage=stage, le=bound)} {cumulative}')
+                lines.append(f'msgbot_stage_seconds_sum{_labels(bot=name, stage=stage)} {total}')
+                lines.append(f'msgbot_stage_seconds_count{_labels(bot=name, stage=stage)} {count}')
+        if results:
+            lines += ['# HELP msgbot_requests_total 按 errcode 分类的请求次数', '# TYPE msgbot_requests_total counter']
+            lines += [f'msgbot_requests_total{_labels(bot=name, errcode=errcode)} {n}'
+                      for (name, errcode), n in results]
+        if refreshes:
+            lines += ['# HELP msgbot_token_refresh_total access_token 刷新次数',
+                      '# TYPE msgbot_token_refresh_total counter']
+            lines += [f'msgbot_token_refresh_total{_labels(bot=name)} {n}' for name, n in refreshes]
+        lines += self._limiter_lines()
+        described = set()
+        for metric, func, help_text, labels in self._gauges:
+            if metric not in described:
+                described.add(metric)
+                lines += [f'# HELP {metric} {help_text or metric}', f'# TYPE {metric} gauge']
+            lines.append(f'{metric}{_labels(**labels) if labels else ""} {func()}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9464, host: str = '127.0.0.1'):
+        """
+        在后台线程启动 HTTP 服务，供 Prometheus 抓取（任意路径均返回全部指标）
+        :param port: 端口
+        :param host: 监听地址
+        :return: http.server.ThreadingHTTPServer ，调用 shutdown() 停止
+        """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='MsgBot-Metrics', daemon=True).start()
+        return server
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+from collections import deque
+from urllib.parse import urlsplit, parse_qs, quote_plus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from MsgBot.rate_limiter import SlidingWindowRateLimiter
+
+# 钉钉错误码
+DING_TALK_OK = 0
+DING_TALK_BAD_TOKEN = 300001
+DING_TALK_SIGN_ERROR = 310000
+DING_TALK_THROTTLED = 130101
+# 企业微信错误码
+WX_COM_BAD_SECRET = 40001
+WX_COM_BAD_TOKEN = 40014
+WX_COM_TOKEN_EXPIRED = 42001
+WX_COM_NO_RECEIVER = 40003
+WX_COM_THROTTLED = 45009
+WX_COM_BAD_WEBHOOK_KEY = 93000
+# 请求体不是合法的 JSON
+INVALID_JSON = 40035
+# 注入该值时模拟网关故障，返回 HTTP 502 与 HTML 错误页
+GATEWAY_ERROR = 502
+_GATEWAY_PAGE = b'<html><head><title>502 Bad Gateway</title></head><body><h1>502 Bad Gateway</h1></body></html>'
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认的 listen 队列长度为 5 ，并发建立连接时会因 SYN 重传产生 1 秒以上的延迟
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class MockServer(object):
+    """
+    本地模拟的钉钉 Webhook 、企业微信 gettoken 、 message/send 与群机器人 webhook/send 接口，用于离线测试与压测
+    支持加签校验、按 access_token （群机器人按 key ）的滑动窗口限流（钉钉 130101 、企业微信 45009）、 token 失效（42001）、
+    注入任意 errcode 以及可配置的响应延迟
+
+        with MockServer(latency=0.01) as server:
+            bot = DingTalkBot(server.web_hook('alert'))
+            wx_com_bot = WxComBot('corp_id', 'corp_secret', api_base=server.url)
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency=0, rate_limit: int = 20, period: float = 60,
+                 ding_talk_secret: str = None, corp_secret: str = None, token_expires_in: int = 7200,
+                 history: int = 10000):
+        """
+        :param host: 监听地址
+        :param port: 端口，0 表示随机
+        :param latency: 每个请求的响应延迟（秒），或以接口路径为参数返回延迟的函数
+        :param rate_limit: 每个 access_token 在 period 秒内最多成功发送的消息数，None 表示不限流
+        :param period: 限流窗口（秒）
+        :param ding_talk_secret: 钉钉加签密钥，设置后校验 timestamp 与 sign
+        :param corp_secret: 企业微信应用密钥，设置后 gettoken 校验 corpsecret
+        :param token_expires_in: 企业微信 access_token 有效期（秒）
+        :param history: 最多保留的已接收消息条数，None 表示不限
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.period = period
+        self.ding_talk_secret = ding_talk_secret
+        self.corp_secret = corp_secret
+        self.token_expires_in = token_expires_in
+        # 已接收的消息：(接口路径, access_token, 消息体)
+        self.received = deque(maxlen=history)
+        # 各 errcode 的响应次数
+        self.responses = {}
+        # 新建连接次数
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._limiters = {}
+        # 有效的企业微信 access_token -> 过期时间
+        self._tokens = {}
+        # 待注入的 errcode ：[(接口路径或 None, errcode), ...]
+        self._injected = deque()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """
+        服务地址，可作为 WxComBot 的 api_base
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def web_hook(self, access_token: str = 'mock') -> str:
+        """
+        :return: 钉钉机器人 Webhook 地址
+        """
+        return f'{self.url}/robot/send?access_token={access_token}'
+
+    def wx_com_web_hook(self, key: str = 'mock') -> str:
+        """
+        :param key: 企业微信群机器人的 key
+        :return: 企业微信群机器人 Webhook 地址
+        """
+        return f'{self.url}/cgi-bin/webhook/send?key={key}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='MsgBot-MockServer', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def inject(self, errcode: int, count: int = 1, path: str = None):
+        """
+        让接下来的 count 个请求直接返回指定的 errcode
+        :param errcode: 错误码， GATEWAY_ERROR 表示返回 HTTP 502 的 HTML 错误页
+        :param count: 请求数
+        :param path: 只对该接口生效，如 /robot/send ，None 表示任意接口
+        """
+        with self._lock:
+            self._injected.extend([(path, errcode)] * count)
+
+    def expire_tokens(self):
+        """
+        使已发放的企业微信 access_token 全部过期，之后的请求返回 42001
+        """
+        with self._lock:
+            for token in self._tokens:
+                self._tokens[token] = 0
+
+    def reset(self):
+        """
+        清空已接收的消息、统计与限流状态
+        """
+        with self._lock:
+            self.received.clear()
+            self.responses.clear()
+            self._limiters.clear()
+            self._injected.clear()
+            self.connections = 0
+
+    def _take_injected(self, path: str):
+        with self._lock:
+            for i, (target, errcode) in enumerate(self._injected):
+                if target is None or target == path:
+                    del self._injected[i]
+                    return errcode
+        return None
+
+    def _throttled(self, token: str) -> bool:
+        if self.rate_limit is None:
+            return False
+        with self._lock:
+            limiter = self._limiters.get(token)
+            if limiter is None:
+                limiter = self._limiters[token] = SlidingWindowRateLimiter(self.rate_limit, self.period)
+        return limiter.try_acquire() > 0
+
+    def _check_sign(self, query: dict) -> bool:
+        timestamp = query.get('timestamp', [''])[0]
+        sign = query.get('sign', [''])[0]
+        if not timestamp.isdigit() or abs(time.time() * 1000 - int(timestamp)) > 3600 * 1000:
+            return False
+        string_to_sign = f'{timestamp}\n{self.ding_talk_secret}'.encode('utf-8')
+        digest = hmac.new(self.ding_talk_secret.encode('utf-8'), string_to_sign, digestmod=hashlib.sha256).digest()
+        # parse_qs 已对 sign 做过一次 URL 解码
+        return hmac.compare_digest(quote_plus(base64.b64encode(digest)), quote_plus(sign))
+
+    def _robot_send(self, query: dict, payload) -> dict:
+        token = query.get('access_token', [''])[0]
+        if not token:
+            return {'errcode': DING_TALK_BAD_TOKEN, 'errmsg': 'token is not exist'}
+        if self.ding_talk_secret and not self._check_sign(query):
+            return {'errcode': DING_TALK_SIGN_ERROR, 'errmsg': 'sign not match'}
+        if not isinstance(payload, dict) or payload.get('msgtype') not in payload:
+            return {'errcode': INVALID_JSON, 'errmsg': 'msgtype is missing or invalid'}
+        if self._throttled(token):
+            return {'errcode': DING_TALK_THROTTLED, 'errmsg': 'send too fast, exceed 20 times per minute'}
+        self.received.append(('/robot/send', token, payload))
+        return {'errcode': DING_TALK_OK, 'errmsg': 'ok'}
+
+    def _get_token(self, query: dict) -> dict:
+        if self.corp_secret is not None and query.get('corpsecret', [''])[0] != self.corp_secret:
+            return {'errcode': WX_COM_BAD_SECRET, 'errmsg': 'invalid credential'}
+        token = secrets.token_hex(16)
+        with self._lock:
+            self._tokens[token] = time.time() + self.token_expires_in
+        return {'errcode': 0, 'errmsg': 'ok', 'access_token': token, 'expires_in': self.token_expires_in}
+
+    def _message_send(self, query: dict, payload) -> dict:
+        token = query.get('access_token', [''])[0]
+        expires_at = self._tokens.get(token)
+        if expires_at is None:
+            return {'errcode': WX_COM_BAD_TOKEN, 'errmsg': 'invalid access_token'}
+        if expires_at <= time.time():
+            return {'errcode': WX_COM_TOKEN_EXPIRED, 'errmsg': 'access_token expired'}
+        if not isinstance(payload, dict) or payload.get('msgtype') not in payload:
+            return {'errcode': INVALID_JSON, 'errmsg': 'msgtype is missing or invalid'}
+        if not payload.get('touser') and not payload.get('toparty') and not payload.get('totag'):
+            return {'errcode': WX_COM_NO_RECEIVER, 'errmsg': 'invalid receiver'}
+        if self._throttled(token):
+            return {'errcode': WX_COM_THROTTLED, 'errmsg': 'api freq out of limit'}
+        self.received.append(('/cgi-bin/message/send', token, payload))
+        return {'errcode': 0, 'errmsg': 'ok', 'invaliduser': '', 'invalidparty': '', 'invalidtag': ''}
+
+    def _webhook_send(self, query: dict, payload) -> dict:
+        key = query.get('key', [''])[0]
+        if not key:
+            return {'errcode': WX_COM_BAD_WEBHOOK_KEY, 'errmsg': 'invalid webhook url'}
+        if not isinstance(payload, dict) or payload.get('msgtype') not in payload:
+            return {'errcode': INVALID_JSON, 'errmsg': 'msgtype is missing or invalid'}
+        if self._throttled(key):
+            return {'errcode': WX_COM_THROTTLED, 'errmsg': 'api freq out of limit'}
+        self.received.append(('/cgi-bin/webhook/send', key, payload))
+        return {'errcode': 0, 'errmsg': 'ok'}
+
+    def handle(self, method: str, path: str, query: dict, body: bytes) -> dict:
+        """
+        处理一个请求（与 HTTP 无关，便于单独测试）
+        :return: 响应数据
+        """
+        routes = {('POST', '/robot/send'), ('GET', '/cgi-bin/gettoken'), ('POST', '/cgi-bin/message/send'),
+                  ('POST', '/cgi-bin/webhook/send')}
+        if (method, path) not in routes:
+            return {'errcode': 404, 'errmsg': f'no such api: {method} {path}'}
+        errcode = self._take_injected(path)
+        if errcode is not None:
+            response = {'errcode': errcode, 'errmsg': 'injected by MockServer'}
+        elif path == '/cgi-bin/gettoken':
+            response = self._get_token(query)
+        else:
+            try:
+                payload = json.loads(body.decode('utf-8'))
+            except ValueError:
+                payload = None
+            if path == '/robot/send':
+                response = self._robot_send(query, payload)
+            elif path == '/cgi-bin/webhook/send':
+                response = self._webhook_send(query, payload)
+            else:
+                response = self._message_send(query, payload)
+        with self._lock:
+            self.responses[response['errcode']] = self.responses.get(response['errcode'], 0) + 1
+        return response
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 使用 HTTP/1.1 以支持 keep-alive
+            protocol_version = 'HTTP/1.1'
+            # 避免 Nagle 算法与延迟确认叠加造成的 40ms 停顿
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def _respond(self, method: str):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                latency = server.latency(url.path) if callable(server.latency) else server.latency
+                if latency:
+                    time.sleep(latency)
+                response = server.handle(method, url.path, parse_qs(url.query), body)
+                if response['errcode'] == GATEWAY_ERROR:
+                    status, content_type, data = 502, 'text/html', _GATEWAY_PAGE
+                else:
+                    status, content_type = (404 if response['errcode'] == 404 else 200), 'application/json'
+                    data = json.dumps(response).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
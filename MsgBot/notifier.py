@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import inspect
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class Notifier(object):
+    """
+    将一条告警同时发送到多个渠道
+    各渠道（DingTalkBot 、 WxComBot 、 WxComWebhookBot 等 MsgBot.channel.Channel 子类）由线程池并发发送，
+    总耗时取决于最慢的渠道；某个渠道失败不会影响其他渠道，异常记录在返回结果中
+
+        notifier = Notifier()
+        notifier.add('ops', DingTalkBot(web_hook), at_all=True)
+        notifier.add('oncall', WxComBot(corp_id, corp_secret), agent_id=1000002, to_user='zhangsan')
+        results = notifier.notify('磁盘告警', '/data 使用率 **95%**')
+    """
+
+    def __init__(self, max_workers: int = 8):
+        """
+        :param max_workers: 并发发送的线程数，建议不小于渠道数
+        """
+        if max_workers < 1:
+            raise ValueError('[max_workers] must be positive...')
+        self.channels = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='MsgBot-Notifier')
+
+    def add(self, name: str, channel, **defaults):
+        """
+        添加渠道
+        :param name: 渠道名称，作为返回结果的键
+        :param channel: 实现了 notify(title, text, **kwargs) 的渠道
+        :param defaults: 该渠道 notify 的默认参数，如钉钉的 at_mobiles 、企业微信的 agent_id 与 to_user
+        :return: channel
+        """
+        if name in self.channels:
+            raise ValueError(f'[name] {name} already exists...')
+        if not callable(getattr(channel, 'notify', None)):
+            raise ValueError('[channel] must have a notify method...')
+        self.channels[name] = (channel, defaults)
+        return channel
+
+    def remove(self, name: str):
+        """
+        移除渠道（不会关闭渠道）
+        :param name: 渠道名称
+        :return: 被移除的渠道
+        """
+        return self.channels.pop(name)[0]
+
+    def _calls(self, title: str, text: str, names, overrides: dict) -> dict:
+        if not isinstance(title, str) or not isinstance(text, str):
+            raise ValueError('[title, text] type must be string...')
+        names = list(self.channels) if names is None else names
+        unknown = [name for name in names if name not in self.channels]
+        if unknown:
+            raise ValueError(f'[names] unknown channels: {unknown}')
+        calls = {}
+        for name in names:
+            channel, defaults = self.channels[name]
+            calls[name] = partial(channel.notify, title, text, **dict(defaults, **overrides.get(name, {})))
+        return calls
+
+    def notify(self, title: str, text: str, names: list = None, overrides: dict = None,
+               timeout: float = None) -> dict:
+        """
+        并发发送到各渠道，等待全部完成后返回
+        :param title: 标题
+        :param text: markdown 格式的正文
+        :param names: 只发送到这些渠道，默认全部
+        :param overrides: 本次发送覆盖的渠道参数，如 {'ops': {'at_all': False}}
+        :param timeout: 最多等待的秒数，超时未完成的渠道结果为 TimeoutError（仍会在后台继续发送）
+        :return: {渠道名称: 响应或异常}
+        """
+        calls = self._calls(title, text, names, overrides or {})
+        futures = {name: self._executor.submit(call) for name, call in calls.items()}
+        wait(futures.values(), timeout=timeout)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                results[name] = TimeoutError(f'等待 {timeout}s 后渠道 {name} 仍未发送完成')
+            elif future.exception() is not None:
+                results[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results
+
+    async def anotify(self, title: str, text: str, names: list = None, overrides: dict = None) -> dict:
+        """
+        notify 的 asyncio 版本，异步渠道（如 AsyncDingTalkBot）直接在事件循环中发送，同步渠道在线程池中发送
+        参数同 notify
+        :return: {渠道名称: 响应或异常}
+        """
+        import asyncio
+        calls = self._calls(title, text, names, overrides or {})
+        loop = asyncio.get_running_loop()
+
+        async def run(call):
+            if inspect.iscoroutinefunction(call.func):
+                return await call()
+            return await loop.run_in_executor(self._executor, call)
+
+        results = await asyncio.gather(*[run(call) for call in calls.values()], return_exceptions=True)
+        return dict(zip(calls, results))
+
+    def close(self):
+        """
+        等待发送中的通知完成并关闭线程池（不会关闭各渠道）
+        :return:
+        """
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
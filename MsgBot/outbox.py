@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import logging
+import sqlite3
+import threading
+from time import monotonic
+from functools import partial
+from MsgBot.retry import is_retryable
+
+logger = logging.getLogger(__name__)
+
+PENDING, ACKED, DEAD = 0, 1, 2
+# close() 默认最多等待投递的秒数
+CLOSE_TIMEOUT = 5
+
+
+class Outbox(object):
+    """
+    持久化发件箱（SQLite WAL 模式）
+    send_* 调用先写入本地数据库再返回，由后台线程按写入顺序投递，平台不可用或进程重启后消息也不会丢失
+    1. 至少投递一次：投递成功后才标记确认，进程在发送后、确认前退出时，重启后会再次发送
+    2. 组提交：并发写入的多条消息合并为一次事务提交（一次 fsync），提高写入吞吐
+    3. 暂时性错误（网络、限流等，见 MsgBot.retry.classify）按指数退避重试，且阻塞后续消息以保证顺序；参数错误等永久性错误的消息标记为死信后跳过
+    4. 已确认的消息定期清理，并截断 WAL 文件
+    send_* 的参数须可 JSON 序列化
+    """
+
+    def __init__(self, bot, path: str, commit_interval: float = 0, batch_size: int = 500,
+                 retry_interval: float = 1, max_retry_interval: float = 300, compact_interval: float = 60):
+        """
+        :param bot: DingTalkBot / WxComBot 等实例
+        :param path: SQLite 数据库文件路径，同一个文件同一时间只应由一个 Outbox 使用
+        :param commit_interval: 组提交前额外等待更多写入的秒数，默认不等待（上一次提交期间到达的写入会自动合并提交）
+        :param batch_size: 单次事务最多写入的消息数
+        :param retry_interval: 首次重试的等待秒数，之后每次翻倍
+        :param max_retry_interval: 重试等待的上限
+        :param compact_interval: 清理已确认消息的间隔秒数
+        """
+        self.bot = bot
+        self.path = path
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.compact_interval = compact_interval
+        conn = self._connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, method TEXT NOT NULL, payload TEXT NOT NULL, '
+                         'created REAL NOT NULL, status INTEGER NOT NULL DEFAULT 0, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, error TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, id)')
+            self._pending = conn.execute('SELECT COUNT(*) FROM outbox WHERE status = ?', (PENDING,)).fetchone()[0]
+        conn.close()
+        self._cond = threading.Condition()
+        # 等待组提交的写入： [(method, payload, created, 写入完成事件, 结果)]
+        self._writes = []
+        self._closed = False
+        self._stopped = False
+        self._committer = threading.Thread(target=self._commit_loop, name='MsgBot-Outbox-Commit', daemon=True)
+        self._drainer = threading.Thread(target=self._drain_loop, name='MsgBot-Outbox-Drain', daemon=True)
+        self._committer.start()
+        self._drainer.start()
+
+    def _connect(self, synchronous: str = 'FULL') -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={synchronous}')
+        conn.isolation_level = 'DEFERRED'
+        return conn
+
+    def __getattr__(self, name: str):
+        # outbox.send_text(...) 等价于 outbox.put('send_text', ...)
+        bot = self.__dict__.get('bot')
+        if name.startswith('send_') and callable(getattr(bot, name, None)):
+            return partial(self.put, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def put(self, method: str, *args, **kwargs) -> int:
+        """
+        写入一条待发送的消息，返回时已持久化到磁盘
+        :param method: bot 的方法名，如 send_text
+        :return: 消息在发件箱中的 id
+        """
+        if not callable(getattr(self.bot, method, None)):
+            raise AttributeError(f'{type(self.bot).__name__!r} object has no method {method!r}')
+        payload = json.dumps({'args': args, 'kwargs': kwargs}, ensure_ascii=False)
+        done = threading.Event()
+        item = [method, payload, time.time(), done, None]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Outbox has been closed')
+            self._writes.append(item)
+            self._cond.notify_all()
+        done.wait()
+        if isinstance(item[4], BaseException):
+            raise item[4]
+        return item[4]
+
+    def _commit_loop(self):
+        conn = self._connect('FULL')
+        try:
+            while True:
+                with self._cond:
+                    while not self._writes and not self._closed:
+                        self._cond.wait()
+                    if not self._writes:
+                        return
+                # 稍等片刻，让并发的写入合并到同一次提交
+                if self.commit_interval > 0 and len(self._writes) < self.batch_size:
+                    time.sleep(self.commit_interval)
+                with self._cond:
+                    batch, self._writes = self._writes[:self.batch_size], self._writes[self.batch_size:]
+                try:
+                    with conn:
+                        for item in batch:
+                            item[4] = conn.execute('INSERT INTO outbox (method, payload, created) VALUES (?, ?, ?)',
+                                                   item[:3]).lastrowid
+                except Exception as e:
+                    for item in batch:
+                        item[4] = e
+                else:
+                    with self._cond:
+                        self._pending += len(batch)
+                        self._cond.notify_all()
+                for item in batch:
+                    item[3].set()
+        finally:
+            conn.close()
+
+    def _deliver(self, conn: sqlite3.Connection, row: tuple) -> bool:
+        """
+        投递一条消息
+        :return: 是否可以继续投递下一条（暂时性错误时返回 False ，等待后重试）
+        """
+        row_id, method, payload, attempts = row
+        data = json.loads(payload)
+        try:
+            getattr(self.bot, method)(*data['args'], **data['kwargs'])
+        except Exception as e:
+            if is_retryable(e):
+                with conn:
+                    conn.execute('UPDATE outbox SET attempts = attempts + 1, error = ? WHERE id = ?', (str(e), row_id))
+                logger.warning('发件箱消息 %s 投递失败，稍后重试：%s', row_id, e)
+                return False
+            with conn:
+                conn.execute('UPDATE outbox SET status = ?, attempts = attempts + 1, error = ? WHERE id = ?',
+                             (DEAD, f'{type(e).__name__}: {e}', row_id))
+            logger.error('发件箱消息 %s 无法投递，已标记为死信：%s', row_id, e)
+        else:
+            with conn:
+                conn.execute('UPDATE outbox SET status = ? WHERE id = ?', (ACKED, row_id))
+        with self._cond:
+            self._pending -= 1
+            self._cond.notify_all()
+        return True
+
+    def _drain_loop(self):
+        # 确认记录丢失只会导致重发，无需每次 fsync
+        conn = self._connect('NORMAL')
+        backoff = self.retry_interval
+        last_compact = monotonic()
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._stopped:
+                        self._cond.wait(self.compact_interval)
+                        if monotonic() - last_compact >= self.compact_interval:
+                            break
+                    if self._stopped:
+                        return
+                if monotonic() - last_compact >= self.compact_interval:
+                    self.compact(conn)
+                    last_compact = monotonic()
+                rows = conn.execute('SELECT id, method, payload, attempts FROM outbox WHERE status = ? ORDER BY id '
+                                    'LIMIT ?', (PENDING, self.batch_size)).fetchall()
+                for row in rows:
+                    if self._stopped:
+                        return
+                    if not self._deliver(conn, row):
+                        with self._cond:
+                            self._cond.wait_for(lambda: self._stopped, timeout=backoff)
+                        backoff = min(backoff * 2, self.max_retry_interval)
+                        break
+                    backoff = self.retry_interval
+        finally:
+            conn.close()
+
+    def compact(self, conn: sqlite3.Connection = None):
+        """
+        删除已确认的消息并截断 WAL 文件
+        :return:
+        """
+        own = conn is None
+        conn = conn or self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM outbox WHERE status = ?', (ACKED,))
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            if own:
+                conn.close()
+
+    def pending(self) -> int:
+        """
+        :return: 已写入但尚未投递的消息数
+        """
+        return self._pending
+
+    def dead_letters(self) -> list:
+        """
+        :return: 无法投递的消息 [(id, method, payload, attempts, error), ...]
+        """
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT id, method, payload, attempts, error FROM outbox WHERE status = ? ORDER BY id',
+                                (DEAD,)).fetchall()
+        finally:
+            conn.close()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待已写入的消息全部投递（或标记为死信）
+        :param timeout: 最多等待的秒数，None 表示一直等待
+        :return: 是否在超时前投递完毕
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._writes and not self._pending, timeout=timeout)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        """
+        停止接收新消息，等待投递完毕（最多 timeout 秒）后停止后台线程，未投递的消息在下次启动时继续投递
+        默认只等待几秒：服务不可用时投递不会很快完成，而未投递的消息已持久化，不必阻塞进程退出
+        :param timeout: 最多等待投递的秒数， 0 表示不等待， None 表示一直等待
+        :return:
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._committer.join()
+        if timeout != 0:
+            self.flush(None if deadline is None else max(0, deadline - monotonic()))
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        # 投递中的请求可能一直挂起（请求超时、重试与限流等待），不再等待：该消息仍为未投递状态，下次启动时重新投递
+        self._drainer.join(None if deadline is None else max(0, deadline - monotonic()))
+        if self._drainer.is_alive():
+            logger.warning('发件箱关闭时仍有消息在投递中，将在下次启动时重新投递')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import stat
+import mmap
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class RateLimiter(object):
+    """
+    限流器基类
+    子类只需实现 try_acquire 、 time_until_next 和 remaining ，且须保证线程安全
+    """
+    # 时钟函数，返回单调递增的秒数
+    clock = staticmethod(time.monotonic)
+    # 等待函数，测试时可替换为推进假时钟的函数
+    sleep = staticmethod(time.sleep)
+
+    def try_acquire(self) -> float:
+        """
+        尝试占用一个发送名额（不等待）
+        :return: 成功占用返回 0 ，否则返回距离下一个名额空出还需等待的秒数（此时不占用名额）
+        """
+        raise NotImplementedError
+
+    def time_until_next(self) -> float:
+        """
+        :return: 距离下一个名额空出还需等待的秒数，当前有空余名额时返回 0
+        """
+        raise NotImplementedError
+
+    def remaining(self) -> int:
+        """
+        :return: 当前可立即占用的名额数
+        """
+        raise NotImplementedError
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        占用一个发送名额，名额不足时等待
+        :param timeout: 最多等待的秒数，None 表示一直等待
+        :return: 是否成功占用
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < wait:
+                    return False
+            self.sleep(wait)
+
+
+class WindowBackend(object):
+    """
+    滑动窗口状态的存储后端
+    acquire 必须是原子的 “检查并记录” 操作，多个进程/主机共享限流时，由后端负责加锁
+    可据此接口实现 Redis 等外部存储的后端
+    """
+
+    def acquire(self, now: float, limit: int, period: float) -> float:
+        """
+        :return: 成功记录本次占用返回 0 ，否则返回需等待的秒数
+        """
+        raise NotImplementedError
+
+    def count(self, now: float, limit: int, period: float) -> tuple:
+        """
+        :return: (需等待的秒数, 窗口内已占用次数)
+        """
+        raise NotImplementedError
+
+
+class MemoryWindowBackend(WindowBackend):
+    """
+    进程内存后端，只保存最近 limit 次的占用时间，判断与更新均为 O(1)
+    """
+
+    def __init__(self):
+        # 最近 limit 次占用的时间，最早的在左侧
+        self._stamps = deque()
+        self._lock = threading.Lock()
+
+    def _wait(self, now: float, limit: int, period: float) -> float:
+        if len(self._stamps) < limit:
+            return 0
+        return max(0.0, self._stamps[0] + period - now)
+
+    def acquire(self, now: float, limit: int, period: float) -> float:
+        with self._lock:
+            wait = self._wait(now, limit, period)
+            if wait > 0:
+                return wait
+            while len(self._stamps) >= limit:
+                self._stamps.popleft()
+            self._stamps.append(now)
+            return 0
+
+    def count(self, now: float, limit: int, period: float) -> tuple:
+        with self._lock:
+            start = now - period
+            return self._wait(now, limit, period), sum(1 for t in self._stamps if t > start)
+
+
+class FileWindowBackend(WindowBackend):
+    """
+    基于 mmap 文件与 fcntl 文件锁的共享后端，同一主机上的多个进程共用一个限流窗口（仅支持 POSIX 系统）
+    文件内容为环形数组：头部为 (limit, head) ，随后是 limit 个 double 类型的占用时间， head 指向最早的一次
+    时间使用 time.time ，重启后残留的文件依然有效
+    """
+    _header = struct.Struct('<II')
+    _stamp = struct.Struct('<d')
+
+    def __init__(self, path: str):
+        """
+        :param path: 共享状态文件路径，使用同一路径的进程共享限流窗口
+        """
+        if fcntl is None:
+            raise RuntimeError('FileWindowBackend 依赖 fcntl ，仅支持 POSIX 系统')
+        self.path = path
+        # 仅当前用户可读写；不跟随符号链接，避免被他人预先放置的链接指向其他文件
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        self._mm = None
+        # flock 对同一进程内共用文件描述符的线程无效，需再加一层线程锁
+        self._lock = threading.Lock()
+
+    def _map(self, limit: int):
+        """
+        在持有文件锁时调用，保证映射大小与 limit 一致
+        """
+        size = self._header.size + self._stamp.size * limit
+        if os.fstat(self._fd).st_size != size:
+            os.ftruncate(self._fd, 0)
+            os.ftruncate(self._fd, size)
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+        if self._mm is None:
+            self._mm = mmap.mmap(self._fd, size)
+        if self._header.unpack_from(self._mm, 0)[0] != limit:
+            self._mm[:] = bytes(size)
+            self._header.pack_into(self._mm, 0, limit, 0)
+        return self._mm
+
+    def _oldest(self, mm, head: int, now: float, period: float) -> float:
+        stamp = self._stamp.unpack_from(mm, self._header.size + self._stamp.size * head)[0]
+        # 系统时间被回拨时，视未来的时间为已过期
+        return 0.0 if stamp > now + period else stamp
+
+    def acquire(self, now: float, limit: int, period: float) -> float:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                mm = self._map(limit)
+                head = self._header.unpack_from(mm, 0)[1]
+                wait = self._oldest(mm, head, now, period) + period - now
+                if wait > 0:
+                    return wait
+                self._stamp.pack_into(mm, self._header.size + self._stamp.size * head, now)
+                self._header.pack_into(mm, 0, limit, (head + 1) % limit)
+                return 0
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def count(self, now: float, limit: int, period: float) -> tuple:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                mm = self._map(limit)
+                head = self._header.unpack_from(mm, 0)[1]
+                wait = max(0.0, self._oldest(mm, head, now, period) + period - now)
+                start = now - period
+                used = 0
+                for i in range(limit):
+                    stamp = self._stamp.unpack_from(mm, self._header.size + self._stamp.size * i)[0]
+                    if start < stamp <= now + period:
+                        used += 1
+                return wait, used
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class SlidingWindowRateLimiter(RateLimiter):
+    """
+    滑动窗口限流：任意 period 秒内最多 limit 次
+    钉钉限定每个机器人每分钟最多发送 20 条消息，即默认值
+    窗口状态保存在 backend 中，默认为进程内存；多进程共用同一 Webhook 时使用 SlidingWindowRateLimiter.shared
+    """
+
+    def __init__(self, limit: int = 20, period: float = 60, clock=None, sleep=None, backend: WindowBackend = None):
+        """
+        :param limit: 窗口内最多占用次数
+        :param period: 窗口长度（秒）
+        :param clock: 时钟函数，默认 time.monotonic ，跨进程共享时须使用 time.time
+        :param sleep: 等待函数，默认 time.sleep
+        :param backend: 窗口状态存储后端，默认 MemoryWindowBackend
+        """
+        if limit < 1 or period <= 0:
+            raise ValueError('[limit, period] must be positive...')
+        self.limit = limit
+        self.period = period
+        if clock is not None:
+            self.clock = clock
+        if sleep is not None:
+            self.sleep = sleep
+        self.backend = backend if backend is not None else MemoryWindowBackend()
+
+    @classmethod
+    def shared(cls, key: str, limit: int = 20, period: float = 60, directory: str = None):
+        """
+        创建同一主机上多进程共享的限流器（如 gunicorn 多个 worker 使用同一 Webhook）
+        :param key: 限流对象的标识，如 Webhook 地址，相同 key 的进程共享同一窗口
+        :param limit: 窗口内最多占用次数
+        :param period: 窗口长度（秒）
+        :param directory: 共享状态文件所在目录，默认为系统临时目录下按用户区分的 msgbot-ratelimit-<uid>
+        :return: SlidingWindowRateLimiter
+        """
+        if directory is None:
+            uid = os.getuid() if hasattr(os, 'getuid') else 0
+            directory = os.path.join(tempfile.gettempdir(), f'msgbot-ratelimit-{uid}')
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # 临时目录对所有用户可写，目录可能被他人抢先创建
+            st = os.lstat(directory)
+            if not stat.S_ISDIR(st.st_mode) or st.st_uid != uid:
+                raise PermissionError(f'{directory} 不是当前用户的目录，请通过 directory 指定共享状态目录')
+        else:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # 使用摘要作为文件名，避免 access_token 出现在文件系统中
+        name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        backend = FileWindowBackend(os.path.join(directory, f'{name}.bin'))
+        return cls(limit, period, clock=time.time, backend=backend)
+
+    def try_acquire(self) -> float:
+        return self.backend.acquire(self.clock(), self.limit, self.period)
+
+    def time_until_next(self) -> float:
+        return self.backend.count(self.clock(), self.limit, self.period)[0]
+
+    def remaining(self) -> int:
+        return self.limit - self.backend.count(self.clock(), self.limit, self.period)[1]
+
+
+class TokenBucketRateLimiter(RateLimiter):
+    """
+    令牌桶限流：令牌以 rate 个/秒 的速度补充，桶内最多 capacity 个
+    允许突发 capacity 条后按平均速率发送，注意任意 60 秒内最多可发送 capacity + 60 * rate 条
+    需要严格遵守 “每分钟 N 条” 时请使用 SlidingWindowRateLimiter
+    """
+
+    def __init__(self, rate: float = 20 / 60, capacity: int = 20, clock=None, sleep=None):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量
+        :param clock: 时钟函数，默认 time.monotonic
+        :param sleep: 等待函数，默认 time.sleep
+        """
+        if rate <= 0 or capacity < 1:
+            raise ValueError('[rate, capacity] must be positive...')
+        self.rate = rate
+        self.capacity = capacity
+        if clock is not None:
+            self.clock = clock
+        if sleep is not None:
+            self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = self.clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        with self._lock:
+            self._refill(self.clock())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def time_until_next(self) -> float:
+        with self._lock:
+            self._refill(self.clock())
+            return 0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def remaining(self) -> int:
+        with self._lock:
+            self._refill(self.clock())
+            return int(self._tokens)
+
+
+class UnlimitedRateLimiter(RateLimiter):
+    """
+    不限流，用于本地压测或已由网关统一限流的场景
+    """
+
+    def try_acquire(self) -> float:
+        return 0
+
+    def time_until_next(self) -> float:
+        return 0
+
+    def remaining(self) -> int:
+        return sys.maxsize
@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+"""
+本机中继服务
+同一主机上的多个脚本通过 Unix 域套接字把 send_* 调用交给一个常驻进程，由它统一持有连接池、
+access_token 、限流器与发件箱：同一 Webhook / 企业应用只有一个机器人实例，token 只获取一次，限流也按主机统一计算
+
+协议：每帧为 4 字节大端长度 + UTF-8 JSON ，一问一答
+    请求 {"channel": "dingtalk", "config": {"web_hook": ...}, "method": "send_text", "args": [...], "kwargs": {...},
+          "durable": false}
+    响应 {"ok": true, "result": ...} 或 {"ok": false, "error": {"type": "DingTalkError", "message": ..., "errcode": ...}}
+    {"op": "ping"} 用于探测服务是否可用
+
+    msgbot relay --outbox-dir /var/lib/msgbot          # 启动中继服务
+    bot = RelayClient('dingtalk', web_hook=web_hook)   # 用法同 DingTalkBot ，服务不可用时直接发送
+    bot.send_text('今天天气真好，是么？')
+"""
+import os
+import json
+import stat
+import socket
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+import socketserver
+from functools import partial
+from MsgBot import exceptions
+from MsgBot.exceptions import SendError
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+# 单帧的长度上限
+MAX_FRAME = 16 * 1024 * 1024
+# 各渠道允许由客户端传入的机器人参数，其余参数（如 token 缓存路径）由中继服务决定
+CHANNELS = {
+    'dingtalk': ('web_hook', 'secret'),
+    'wx_com': ('corp_id', 'corp_secret', 'api_base'),
+    'wx_com_webhook': ('web_hook', 'api_base'),
+}
+
+
+def default_socket_path() -> str:
+    """
+    :return: 环境变量 MSGBOT_RELAY_SOCKET ，默认为系统临时目录下按用户区分的 msgbot-relay-<uid>/relay.sock
+    """
+    return os.environ.get('MSGBOT_RELAY_SOCKET') or os.path.join(_private_dir(), 'relay.sock')
+
+
+def _private_dir() -> str:
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), f'msgbot-relay-{uid}')
+
+
+def _check_owner(path: str):
+    """
+    检查套接字文件属于当前用户，不存在时不检查
+    临时目录对所有用户可写，他人可能抢先创建同名套接字，冒充中继服务收集 access_token 与密钥
+    :raise PermissionError: 属于其他用户
+    """
+    if not hasattr(os, 'getuid'):
+        return
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return
+    if st.st_uid != os.getuid():
+        raise PermissionError(f'{path} 不属于当前用户')
+
+
+def _check_peer(sock: socket.socket):
+    """
+    检查对端进程属于当前用户（仅支持 SO_PEERCRED 的平台），避免检查套接字文件与连接之间被替换
+    :raise PermissionError: 属于其他用户
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return
+    _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    if uid != os.getuid():
+        raise PermissionError(f'中继服务进程不属于当前用户（uid {uid}）')
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        buf += chunk
+    return bytes(buf)
+
+
+def encode_frame(data: dict) -> bytes:
+    """
+    :return: 长度前缀 + JSON ，无法序列化时抛出 TypeError ，超出 MAX_FRAME 时抛出 ValueError
+    """
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    if len(body) > MAX_FRAME:
+        raise ValueError(f'[frame] must be at most {MAX_FRAME} bytes...')
+    return _HEADER.pack(len(body)) + body
+
+
+def send_frame(sock: socket.socket, data: dict):
+    sock.sendall(encode_frame(data))
+
+
+def recv_frame(sock: socket.socket):
+    """
+    :return: 解析后的 JSON ，对方在帧边界处关闭连接时返回 None
+    """
+    header = sock.recv(_HEADER.size, socket.MSG_WAITALL)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        header += _recv_exact(sock, _HEADER.size - len(header))
+    size, = _HEADER.unpack(header)
+    if size > MAX_FRAME:
+        raise ValueError(f'[frame] must be at most {MAX_FRAME} bytes...')
+    return json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+
+def _check_channel(channel: str, config: dict):
+    if channel not in CHANNELS:
+        raise ValueError(f'Unknown channel: {channel}')
+    unknown = set(config) - set(CHANNELS[channel])
+    if unknown:
+        raise ValueError(f'Unknown config for {channel}: {sorted(unknown)}')
+
+
+def _build_bot(channel: str, config: dict, **kwargs):
+    if channel == 'dingtalk':
+        from MsgBot.ding_talk_bot.bot import DingTalkBot
+        return DingTalkBot(**config, **kwargs)
+    if channel == 'wx_com_webhook':
+        from MsgBot.wx_com_bot.webhook import WxComWebhookBot
+        return WxComWebhookBot(**config, **kwargs)
+    from MsgBot.wx_com_bot.bot import WxComBot
+    return WxComBot(**config, **kwargs)
+
+
+def _error(e: BaseException) -> dict:
+    return {'type': type(e).__name__, 'message': str(e), 'errcode': getattr(e, 'errcode', None)}
+
+
+def _raise(error: dict):
+    """
+    按中继服务返回的错误类型重新抛出异常，未知类型抛出 SendError
+    """
+    cls = getattr(exceptions, error['type'], None) or {'ValueError': ValueError, 'TypeError': TypeError,
+                                                       'AttributeError': AttributeError}.get(error['type'])
+    if cls in (exceptions.DingTalkError, exceptions.WxComError):
+        raise cls(error['message'], errcode=error.get('errcode'))
+    if cls is None:
+        raise SendError(f'{error["type"]}: {error["message"]}')
+    raise cls(error['message'])
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class RelayServer(object):
+    """
+    中继服务，为每组渠道参数（同一 Webhook 或同一企业应用）维护一个机器人实例，所有连接共用
+    每个客户端连接由单独的线程处理，同一连接上的请求依次处理
+    套接字文件权限为 0600 ，只有同一用户的进程可以连接；默认路径所在目录权限为 0700
+    """
+
+    def __init__(self, socket_path: str = None, outbox_dir: str = None, token_cache_dir: str = None,
+                 metrics=None, close_timeout: float = 30):
+        """
+        :param socket_path: 套接字路径，默认见 default_socket_path
+        :param outbox_dir: 发件箱目录，设置后 durable 请求写入该目录下各机器人的发件箱，由后台投递
+        :param token_cache_dir: 企业微信 access_token 缓存目录，中继服务重启后可复用未过期的 token
+        :param metrics: 指标回调（如 MsgBot.metrics.Metrics ），传给所有机器人
+        :param close_timeout: 关闭时最多等待发件箱投递的秒数
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.outbox_dir = outbox_dir
+        for directory in (outbox_dir, token_cache_dir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.token_cache_dir = token_cache_dir
+        self.metrics = metrics
+        self.close_timeout = close_timeout
+        self._lock = threading.Lock()
+        # 渠道参数摘要 -> 机器人 / 发件箱
+        self._bots = {}
+        self._outboxes = {}
+        # 当前的客户端连接，关闭服务时一并断开
+        self._connections = set()
+        # 已处理的请求数
+        self.requests = 0
+        self._server = None
+        self._serving = False
+        self._thread = None
+
+    @staticmethod
+    def _key(channel: str, config: dict) -> str:
+        raw = json.dumps([channel, sorted(config.items())], ensure_ascii=False)
+        # 使用摘要作为文件名，避免 access_token 、密钥出现在文件系统中
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+    def bot(self, channel: str, config: dict):
+        """
+        :return: 该组渠道参数对应的机器人，首次使用时创建
+        """
+        _check_channel(channel, config)
+        key = self._key(channel, config)
+        with self._lock:
+            bot = self._bots.get(key)
+            if bot is None:
+                kwargs = {'metrics': self.metrics}
+                if channel == 'wx_com' and self.token_cache_dir:
+                    kwargs['token_cache'] = os.path.join(self.token_cache_dir, f'{key}.json')
+                bot = self._bots[key] = _build_bot(channel, config, **kwargs)
+            return bot
+
+    def outbox(self, channel: str, config: dict):
+        """
+        :return: 该组渠道参数对应的发件箱，未设置 outbox_dir 时返回 None
+        """
+        if not self.outbox_dir:
+            return None
+        bot = self.bot(channel, config)
+        key = self._key(channel, config)
+        with self._lock:
+            outbox = self._outboxes.get(key)
+            if outbox is None:
+                from MsgBot.outbox import Outbox
+                outbox = self._outboxes[key] = Outbox(bot, os.path.join(self.outbox_dir, f'{key}.db'))
+            return outbox
+
+    def handle(self, request: dict) -> dict:
+        """
+        处理一个请求（与套接字无关，便于单独测试）
+        :return: 响应
+        """
+        try:
+            if request.get('op') == 'ping':
+                return {'ok': True, 'result': {'pid': os.getpid(), 'bots': len(self._bots)}}
+            channel, config, method = request['channel'], request.get('config') or {}, request['method']
+            if not method.startswith('send_'):
+                raise AttributeError(f'Unsupported method: {method}')
+            if request.get('durable'):
+                # 直接发送会让调用方误以为消息已持久化
+                if not self.outbox_dir:
+                    raise ValueError('Durable requests require the relay to be started with outbox_dir')
+                target = self.outbox(channel, config)
+                result = {'queued': target.put(method, *request.get('args', ()), **request.get('kwargs', {}))}
+            else:
+                target = self.bot(channel, config)
+                if not callable(getattr(target, method, None)):
+                    raise AttributeError(f'{type(target).__name__!r} object has no method {method!r}')
+                result = getattr(target, method)(*request.get('args', ()), **request.get('kwargs', {}))
+                # send_bulk 返回的 BulkResult 等对象
+                if hasattr(result, 'to_dict'):
+                    result = result.to_dict()
+            return {'ok': True, 'result': result}
+        except Exception as e:
+            logger.debug('中继请求失败：%s', e)
+            return {'ok': False, 'error': _error(e)}
+        finally:
+            with self._lock:
+                self.requests += 1
+
+    def _handler(self):
+        relay = self
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def setup(self):
+                with relay._lock:
+                    relay._connections.add(self.request)
+
+            def finish(self):
+                with relay._lock:
+                    relay._connections.discard(self.request)
+
+            def handle(self):
+                while True:
+                    try:
+                        request = recv_frame(self.request)
+                        if request is None:
+                            return
+                        response = relay.handle(request)
+                        try:
+                            frame = encode_frame(response)
+                        except Exception as e:
+                            # 结果无法序列化或超出帧长度上限，消息已发送，只能返回错误
+                            logger.warning('中继响应无法编码：%s', e)
+                            frame = encode_frame({'ok': False, 'error': _error(e)})
+                        self.request.sendall(frame)
+                    except (OSError, ValueError) as e:
+                        logger.debug('中继连接异常：%s', e)
+                        return
+
+        return Handler
+
+    def _bind(self):
+        directory = os.path.dirname(self.socket_path)
+        if directory == _private_dir() and hasattr(os, 'getuid'):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # 临时目录对所有用户可写，目录可能被他人抢先创建
+            st = os.lstat(directory)
+            if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+                raise PermissionError(f'{directory} 不是当前用户的目录，请通过 socket_path 指定套接字路径')
+        _check_owner(self.socket_path)
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # 上次未正常退出留下的套接字文件
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError(f'Relay is already running on {self.socket_path}')
+            finally:
+                probe.close()
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.socket_path, self._handler())
+        finally:
+            os.umask(old_umask)
+
+    def serve_forever(self):
+        """
+        在当前线程运行，直到 stop() 或 close() 被调用
+        """
+        if self._server is None:
+            self._bind()
+        self._serving = True
+        try:
+            self._server.serve_forever()
+        finally:
+            self._serving = False
+
+    def start(self):
+        """
+        在后台线程运行
+        """
+        self._bind()
+        self._serving = True
+        self._thread = threading.Thread(target=self.serve_forever, name='MsgBot-Relay', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        通知 serve_forever 退出，不等待（可在信号处理函数中调用）
+        """
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def close(self):
+        """
+        停止服务，等待发件箱投递后关闭所有机器人
+        """
+        server, self._server = self._server, None
+        if server is not None:
+            if self._serving:
+                server.shutdown()
+            server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                connections = list(self._connections)
+            for conn in connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            outboxes, self._outboxes = list(self._outboxes.values()), {}
+            bots, self._bots = list(self._bots.values()), {}
+        for outbox in outboxes:
+            outbox.close(self.close_timeout)
+        for bot in bots:
+            bot.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RelayClient(object):
+    """
+    中继服务的客户端， send_* 方法与 DingTalkBot / WxComBot 同名同参
+    中继服务不可用（套接字不存在或拒绝连接）时，改为在本进程直接发送（ fallback 为 False 时抛出 SendError ）
+    套接字文件或服务进程不属于当前用户时同样视为不可用，不发送任何请求
+    请求已发出但连接中断时消息可能已经发送，不会自动改为直接发送，以免重复
+    send_* 的参数须可 JSON 序列化， send_bulk 返回 BulkResult.to_dict() 的结果
+
+        bot = RelayClient('wx_com', corp_id='corp_id', corp_secret='corp_secret')
+        bot.send_msg_text(agent_id=1000002, content='部署完成', to_user='zhangsan')
+    """
+
+    def __init__(self, channel: str, socket_path: str = None, fallback: bool = True, durable: bool = False,
+                 timeout: float = 150, **config):
+        """
+        :param channel: dingtalk 或 wx_com
+        :param socket_path: 中继服务的套接字路径，默认见 default_socket_path
+        :param fallback: 中继服务不可用时是否直接发送
+        :param durable: 是否写入中继服务的发件箱后立即返回（需中继服务设置 outbox_dir ，否则抛出 ValueError ），
+                        返回 {'queued': id}
+        :param timeout: 等待中继服务响应的秒数，应大于限流等待与请求超时之和
+        :param config: 机器人参数，钉钉为 web_hook 、 secret ，企业微信为 corp_id 、 corp_secret 、 api_base
+        """
+        _check_channel(channel, config)
+        self.channel = channel
+        self.config = config
+        self.socket_path = socket_path or default_socket_path()
+        self.fallback = fallback
+        self.durable = durable
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+        # 直接发送时使用的机器人，首次需要时创建
+        self._bot = None
+
+    def __getattr__(self, name: str):
+        # client.send_text(...) 等价于 client.call('send_text', ...)
+        if name.startswith('send_'):
+            return partial(self.call, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    def _connect(self) -> socket.socket:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ConnectionRefusedError('Unix domain sockets are not supported on this platform')
+        _check_owner(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            _check_peer(sock)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close_sock(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _request(self, request: dict):
+        """
+        :return: 中继服务的响应，服务不可用时返回 None
+        """
+        with self._lock:
+            # 复用的连接可能已被重启的中继服务关闭，写入失败时重新连接一次
+            for _ in range(2):
+                if self._sock is None:
+                    try:
+                        self._sock = self._connect()
+                    except PermissionError as e:
+                        # 不把请求（含密钥）发给其他用户的进程
+                        logger.warning('拒绝连接中继服务：%s', e)
+                        return None
+                    except OSError as e:
+                        logger.debug('中继服务不可用：%s', e)
+                        return None
+                try:
+                    send_frame(self._sock, request)
+                except OSError:
+                    self._close_sock()
+                    continue
+                try:
+                    response = recv_frame(self._sock)
+                except (OSError, ValueError) as e:
+                    self._close_sock()
+                    raise SendError(f'中继连接中断，消息可能已发送：{e}')
+                if response is None:
+                    self._close_sock()
+                    raise SendError('中继服务关闭了连接，消息可能已发送')
+                return response
+            return None
+
+    def ping(self) -> bool:
+        """
+        :return: 中继服务是否可用
+        """
+        try:
+            response = self._request({'op': 'ping'})
+        except SendError:
+            return False
+        return response is not None and response.get('ok', False)
+
+    def call(self, method: str, *args, **kwargs):
+        """
+        通过中继服务调用机器人的方法，服务不可用时直接调用
+        :param method: bot 的方法名，如 send_text
+        :return: 发送消息后返回的响应
+        """
+        request = {'channel': self.channel, 'config': self.config, 'method': method, 'args': args,
+                   'kwargs': kwargs, 'durable': self.durable}
+        response = self._request(request)
+        if response is None:
+            if not self.fallback:
+                raise SendError(f'中继服务不可用：{self.socket_path}')
+            return getattr(self._direct(), method)(*args, **kwargs)
+        if not response.get('ok'):
+            _raise(response['error'])
+        return response['result']
+
+    def _direct(self):
+        with self._lock:
+            if self._bot is None:
+                self._bot = _build_bot(self.channel, self.config)
+            return self._bot
+
+    def close(self):
+        with self._lock:
+            self._close_sock()
+            if self._bot is not None:
+                self._bot.close()
+                self._bot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def serve(socket_path: str = None, **kwargs):
+    """
+    在当前线程运行中继服务，收到 SIGTERM / Ctrl+C 时关闭
+    :param socket_path: 套接字路径
+    :param kwargs: 同 RelayServer
+    """
+    import signal
+    server = RelayServer(socket_path, **kwargs)
+    server._bind()
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    logger.warning('中继服务已启动：%s', server.socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
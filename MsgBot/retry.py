@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import threading
+from time import monotonic
+from MsgBot.exceptions import SendError, RateLimitError, DingTalkError, WxComError, CircuitOpenError
+
+# 错误分类
+NETWORK = 'network'
+THROTTLE = 'throttle'
+AUTH = 'auth'
+PERMANENT = 'permanent'
+
+# 平台繁忙，稍后重试即可
+BUSY_ERRCODES = (-1,)
+# 限流： 130101 钉钉发送过快， 45009 企业微信接口调用超过限制， 45033 企业微信接口并发调用超过限制
+THROTTLE_ERRCODES = (130101, 45009, 45033)
+# 限流后会被封禁一段时间（钉钉 130101 封禁 10 分钟），期间重试只会继续失败，直接抛出
+BAN_ERRCODES = (130101,)
+# 鉴权： 310000 钉钉安全设置校验失败（关键词、加签、IP）， 300001 钉钉 access_token 无效，
+#       40001 / 40014 / 42001 企业微信 token 无效或过期， 40013 企业微信 corpid 无效， 60020 企业微信 IP 不在白名单
+AUTH_ERRCODES = (310000, 300001, 40001, 40013, 40014, 42001, 60020)
+
+
+def classify(e: BaseException) -> str:
+    """
+    对发送时的异常分类
+    :return: network / throttle / auth / permanent
+    """
+    if isinstance(e, RateLimitError):
+        return THROTTLE
+    if isinstance(e, SendError):
+        return NETWORK
+    if isinstance(e, (DingTalkError, WxComError)):
+        if e.errcode in THROTTLE_ERRCODES:
+            return THROTTLE
+        if e.errcode in BUSY_ERRCODES:
+            return NETWORK
+        if e.errcode in AUTH_ERRCODES:
+            return AUTH
+    return PERMANENT
+
+
+def is_retryable(e: BaseException) -> bool:
+    """
+    :return: 该异常是否为暂时性错误（网络、限流、平台繁忙），值得稍后重试
+    """
+    return classify(e) in (NETWORK, THROTTLE)
+
+
+class CircuitBreaker(object):
+    """
+    熔断器
+    连续 failure_threshold 次网络或限流错误后熔断（open），熔断期间直接抛出 CircuitOpenError ，不再占用线程等待超时
+    reset_timeout 秒后进入半开（half_open）状态，放行一次试探请求，成功则恢复（closed），失败则继续熔断
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, clock=monotonic):
+        """
+        :param failure_threshold: 触发熔断的连续失败次数
+        :param reset_timeout: 熔断后多少秒放行试探请求
+        :param clock: 时钟函数
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._failures = 0
+        self._opened_at = None
+        # 当前试探请求的编号， 0 表示没有
+        self._trial = 0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """
+        :return: 当前是否允许发起请求
+        """
+        return self.acquire() is not None
+
+    def acquire(self):
+        """
+        申请发起一次请求
+        :return: 不允许时返回 None ；半开状态放行的试探请求返回其编号（正整数），结束后需用 release_trial 交还；
+                 其余返回 0
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return 0
+            if state == self.HALF_OPEN and not self._trial:
+                # 半开状态同一时间只放行一个试探请求
+                self._trials += 1
+                self._trial = self._trials
+                return self._trial
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+            self._trial = 0
+
+    def release_trial(self, trial: int):
+        """
+        交还半开状态的试探名额，用于不计入熔断的结果（客户端限流、调用被中断）
+        只有持有该名额的请求才能交还，名额已被结果回收或转给其他请求时不做处理
+        :param trial: acquire 返回的试探编号
+        """
+        with self._lock:
+            if trial and self._trial == trial:
+                self._trial = 0
+
+
+# 按端点共享的熔断器，同一 Webhook / 企业的多个机器人实例共用
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key: str, failure_threshold: int = 5, reset_timeout: float = 30) -> CircuitBreaker:
+    """
+    获取端点对应的熔断器，不存在时创建
+    同一 key 的熔断器只在首次获取时创建，之后传入的 failure_threshold / reset_timeout 不生效，
+    共用端点的多个 RetryPolicy 应使用相同的熔断参数
+    :param key: 端点标识，如 Webhook 摘要、企业 id （会出现在异常信息中，不应包含 access_token 等密钥）
+    :return: CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(failure_threshold, reset_timeout)
+        return breaker
+
+
+class RetryPolicy(object):
+    """
+    重试策略
+    网络错误与平台繁忙按指数退避（full jitter）重试；被平台限流时等待 throttle_wait 秒后重试，
+    但钉钉 130101 （封禁 10 分钟）不重试；鉴权与其他错误不重试
+    circuit_breaker 为 True 时，同一端点共用一个熔断器，只有平台的响应（网络错误与错误码）计入熔断，
+    客户端限流器等待超时（ RateLimitError ）不计入
+    """
+
+    def __init__(self, max_attempts: int = 3, backoff: float = 0.5, max_backoff: float = 30, jitter: bool = True,
+                 throttle_wait: float = 60, max_elapsed: float = 120, circuit_breaker: bool = True,
+                 failure_threshold: int = 5, reset_timeout: float = 30, sleep=time.sleep):
+        """
+        :param max_attempts: 最多尝试次数（含第一次）
+        :param backoff: 首次重试的退避基数（秒），之后每次翻倍
+        :param max_backoff: 单次退避的上限
+        :param jitter: 是否在 [0, 退避时间] 内随机等待，避免多个客户端同时重试
+        :param throttle_wait: 被平台限流后重试前等待的秒数
+        :param max_elapsed: 整个重试过程最长耗时，超出时不再重试
+        :param circuit_breaker: 是否启用按端点共享的熔断器
+        :param failure_threshold: 触发熔断的连续失败次数（同一端点以首次创建熔断器时的参数为准）
+        :param reset_timeout: 熔断后多少秒放行试探请求（同上）
+        :param sleep: 等待函数
+        """
+        if max_attempts < 1:
+            raise ValueError('[max_attempts] must be positive...')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.throttle_wait = throttle_wait
+        self.max_elapsed = max_elapsed
+        self.circuit_breaker = circuit_breaker
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+
+    def breaker_for(self, key: str):
+        """
+        :param key: 端点标识
+        :return: 未启用熔断时返回 None
+        """
+        if not self.circuit_breaker:
+            return None
+        return get_breaker(key, self.failure_threshold, self.reset_timeout)
+
+    def delay(self, attempt: int, category: str) -> float:
+        """
+        :param attempt: 已失败的次数（从 1 开始）
+        :param category: 错误分类
+        :return: 下一次重试前等待的秒数
+        """
+        if category == THROTTLE:
+            return self.throttle_wait
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, delay) if self.jitter else delay
+
+    def _before(self, breaker: CircuitBreaker, key: str) -> int:
+        """
+        :return: 持有的试探编号， 0 表示不是试探请求
+        """
+        if breaker is None:
+            return 0
+        trial = breaker.acquire()
+        if trial is None:
+            raise CircuitOpenError(f'{key} 已熔断，暂停发送 {breaker.reset_timeout}s')
+        return trial
+
+    def _after_error(self, e: Exception, breaker: CircuitBreaker, attempt: int, started: float):
+        """
+        :return: 需要重试时返回等待秒数，否则重新抛出异常
+        """
+        category = classify(e)
+        # 客户端限流器等待超时与端点无关，不影响同一端点的其他实例
+        if breaker is not None and not isinstance(e, RateLimitError):
+            if category in (NETWORK, THROTTLE):
+                breaker.record_failure()
+            else:
+                # 鉴权或参数错误说明端点可达
+                breaker.record_success()
+        if category not in (NETWORK, THROTTLE) or attempt >= self.max_attempts:
+            raise e
+        if getattr(e, 'errcode', None) in BAN_ERRCODES:
+            raise e
+        delay = self.delay(attempt, category)
+        if monotonic() - started + delay > self.max_elapsed:
+            raise e
+        return delay
+
+    def call(self, func, *args, key: str = '', **kwargs):
+        """
+        按重试策略调用 func
+        :param func: 发送一次消息的函数
+        :param key: 端点标识，用于熔断（会出现在 CircuitOpenError 的信息中）
+        :return: func 的返回值
+        """
+        breaker = self.breaker_for(key)
+        started = monotonic()
+        attempt = 0
+        while True:
+            trial = self._before(breaker, key)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self._after_error(e, breaker, attempt, started)
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            finally:
+                # 未计入熔断的结果（客户端限流、 KeyboardInterrupt 等）也要交还试探名额，否则熔断器无法恢复
+                if trial:
+                    breaker.release_trial(trial)
+            self.sleep(delay)
+
+    async def acall(self, func, *args, key: str = '', **kwargs):
+        """
+        call 的 asyncio 版本， func 为协程函数，等待时使用 asyncio.sleep
+        """
+        # 同步发送不需要 asyncio ，只在此处导入以免拖慢命令行的启动
+        import asyncio
+        breaker = self.breaker_for(key)
+        started = monotonic()
+        attempt = 0
+        while True:
+            trial = self._before(breaker, key)
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self._after_error(e, breaker, attempt, started)
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+            finally:
+                # 未计入熔断的结果（客户端限流、 asyncio.CancelledError 等）也要交还试探名额，否则熔断器无法恢复
+                if trial:
+                    breaker.release_trial(trial)
+            await asyncio.sleep(delay)
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+import inspect
+import logging
+import threading
+from time import monotonic
+from collections import deque
+from functools import partial
+from concurrent.futures import Future
+from MsgBot.exceptions import QueueFullError
+from MsgBot.dispatcher import _dispatchers, _check_bot, _call
+from MsgBot.ding_talk_bot.bot import DingTalkBot
+from MsgBot.ding_talk_bot.coalescer import build_digest
+
+logger = logging.getLogger(__name__)
+
+# 优先级，数值越小越优先
+HIGH = 0
+NORMAL = 1
+LOW = 2
+_NAMES = {'high': HIGH, 'normal': NORMAL, 'low': LOW}
+
+
+class PriorityScheduler(object):
+    """
+    按优先级分道发送
+    send_* 调用额外接受 priority 参数（ high / normal / low ，默认 normal ），消息放入对应优先级的队列并立即返回
+    concurrent.futures.Future ，由后台线程按优先级从高到低发送
+    为高优先级预留发送名额：限流器的剩余名额不多于 reserve 中对应的数量时，该优先级的消息暂缓发送，
+    因此大量低优先级消息不会耗尽额度，紧急告警总能立即发出
+    高优先级消息到达时，对队列中尚未发送的低优先级消息的处理方式：
+        keep: 保留，排在高优先级消息之后
+        drop: 全部取消（ Future 被取消）
+        coalesce: 将其中的 send_text / send_markdown 合并为一条 markdown 汇总消息（仅 DingTalkBot ，其他机器人按 keep 处理）
+    同一优先级内按先后顺序逐条发送；每个优先级队列最多 maxsize 条，超出时丢弃最早的消息
+    """
+    HIGH = HIGH
+    NORMAL = NORMAL
+    LOW = LOW
+    KEEP = 'keep'
+    DROP = 'drop'
+    COALESCE = 'coalesce'
+
+    def __init__(self, bot, reserve: dict = None, on_high: str = KEEP, maxsize: int = 1000,
+                 poll_interval: float = 0.5, digest_title: str = '低优先级消息汇总', exit_timeout: float = 10):
+        """
+        :param bot: DingTalkBot / WxComBot 实例（不支持异步机器人），有 rate_limiter 属性时按其剩余名额预留
+        :param reserve: 各优先级发送时须保留的名额数，默认 {HIGH: 0, NORMAL: 5, LOW: 10} ，
+                        即钉钉每分钟 20 条中，低优先级最多占用 10 条，普通优先级最多占用 15 条
+        :param on_high: 高优先级消息到达时对低优先级消息的处理方式， keep / drop / coalesce
+        :param maxsize: 每个优先级队列的最大长度
+        :param poll_interval: 名额被预留时重新检查剩余名额的间隔（秒）
+        :param digest_title: coalesce 时汇总消息的标题
+        :param exit_timeout: 解释器退出时最多等待发送的秒数
+        """
+        if on_high not in (self.KEEP, self.DROP, self.COALESCE):
+            raise ValueError(f'Unknown on_high: {on_high}')
+        if maxsize < 1:
+            raise ValueError('[maxsize] must be positive...')
+        _check_bot(bot)
+        self.bot = bot
+        self.reserve = {HIGH: 0, NORMAL: 5, LOW: 10}
+        self.reserve.update(reserve or {})
+        self.on_high = on_high
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        self.digest_title = digest_title
+        self.exit_timeout = exit_timeout
+        self._lanes = {priority: deque() for priority in (HIGH, NORMAL, LOW)}
+        self._cond = threading.Condition()
+        # 已入队但尚未完成（含发送中）的消息数
+        self._unfinished = 0
+        self._closed = False
+        # 各优先级已处理的消息数，以及被丢弃、被合并的消息数
+        self.processed = {priority: 0 for priority in self._lanes}
+        self.dropped = 0
+        self.coalesced = 0
+        self._thread = threading.Thread(target=self._worker, name='MsgBot-PriorityScheduler', daemon=True)
+        self._thread.start()
+        _dispatchers.add(self)
+
+    def __getattr__(self, name: str):
+        # scheduler.send_text(..., priority='high') 等价于 scheduler.submit('send_text', ..., priority='high')
+        bot = self.__dict__.get('bot')
+        if name.startswith('send_') and callable(getattr(bot, name, None)):
+            return partial(self.submit, name)
+        raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+
+    @staticmethod
+    def _priority(priority) -> int:
+        if isinstance(priority, str):
+            priority = _NAMES.get(priority.lower(), priority)
+        if priority not in (HIGH, NORMAL, LOW):
+            raise ValueError(f'Unknown priority: {priority}')
+        return priority
+
+    def submit(self, method: str, *args, priority=NORMAL, **kwargs) -> Future:
+        """
+        将一次 bot 方法调用放入对应优先级的队列
+        :param method: bot 的方法名，如 send_text
+        :param priority: high / normal / low ，或 PriorityScheduler.HIGH 等
+        :return: Future ，结果为发送消息后返回的响应
+        """
+        priority = self._priority(priority)
+        getattr(self.bot, method)
+        # 高优先级消息到达时可能被合并，入队前取出正文，避免在持有锁时逐条解析参数
+        item = None
+        if priority == LOW and isinstance(self.bot, DingTalkBot) and method in ('send_text', 'send_markdown'):
+            item = self._digest_item(method, args, kwargs)
+        future = Future()
+        overflow = None
+        preempted = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('PriorityScheduler has been shut down')
+            lane = self._lanes[priority]
+            if len(lane) >= self.maxsize:
+                overflow = lane.popleft()[0]
+                self._unfinished -= 1
+                self.dropped += 1
+            if priority == HIGH and self._lanes[LOW]:
+                if self.on_high == self.DROP:
+                    preempted = [entry[0] for entry in self._lanes[LOW]]
+                    self._unfinished -= len(preempted)
+                    self.dropped += len(preempted)
+                    self._lanes[LOW].clear()
+                elif self.on_high == self.COALESCE:
+                    self._coalesce_low()
+            lane.append((future, method, args, kwargs, item))
+            self._unfinished += 1
+            self._cond.notify_all()
+        if overflow is not None:
+            overflow.set_exception(QueueFullError('队列已满，消息被丢弃'))
+        for dropped in preempted:
+            dropped.cancel()
+        return future
+
+    def _digest_item(self, method: str, args: tuple, kwargs: dict):
+        """
+        :return: (正文, @ 的手机号, 是否@所有人, 显式传入的 q_timeout / r_timeout) ，无法取出参数时返回 None
+        """
+        try:
+            arguments = inspect.signature(getattr(self.bot, method)).bind(*args, **kwargs).arguments
+            if method == 'send_text':
+                text = arguments['content']
+            else:
+                text = f'**{arguments["title"]}**\n\n{arguments["text"]}'
+        except (TypeError, KeyError, ValueError):
+            return None
+        if not isinstance(text, str):
+            return None
+        timeouts = {name: arguments[name] for name in ('q_timeout', 'r_timeout') if arguments.get(name) is not None}
+        return text, arguments.get('at_mobiles') or (), arguments.get('at_all', False), timeouts
+
+    def _coalesce_low(self):
+        """
+        在持有锁时调用，将低优先级队列中的 send_text / send_markdown 合并为一条汇总消息，放在低优先级队列最前面
+        无法合并的消息保持原样，合并失败不影响高优先级消息入队
+        """
+        if not isinstance(self.bot, DingTalkBot):
+            return
+        # 入队时已取出正文，无法合并的消息为 None
+        mergeable = [(entry, entry[-1]) for entry in self._lanes[LOW] if entry[-1] is not None]
+        if len(mergeable) < 2:
+            return
+        texts, at_mobiles, at_all, kwargs = {}, {}, False, {}
+        for _, (text, mobiles, item_at_all, timeouts) in mergeable:
+            texts[text] = texts.get(text, 0) + 1
+            for mobile in mobiles:
+                at_mobiles[mobile] = None
+            at_all = at_all or item_at_all
+            # 汇总消息的等待与请求超时不超过任何一条原消息
+            for name, value in timeouts.items():
+                kwargs[name] = min(kwargs.get(name, value), value)
+        try:
+            digest = build_digest(list(texts.items()), self.digest_title)
+        except Exception as e:
+            logger.warning('合并低优先级消息失败，保持原样发送：%s', e)
+            return
+        futures = [entry[0] for entry, _ in mergeable]
+        mergeable_ids = {id(entry) for entry, _ in mergeable}
+        self._lanes[LOW] = deque(entry for entry in self._lanes[LOW] if id(entry) not in mergeable_ids)
+        self._unfinished -= len(mergeable) - 1
+        self.coalesced += len(mergeable)
+        merged = Future()
+        merged.add_done_callback(partial(self._resolve, futures))
+        self._lanes[LOW].appendleft((merged, 'send_markdown', (self.digest_title, digest, list(at_mobiles), at_all),
+                                     kwargs, None))
+
+    @staticmethod
+    def _resolve(futures: list, merged: Future):
+        """
+        汇总消息发送完成后，将结果同步到被合并的各条消息
+        """
+        for future in futures:
+            if merged.cancelled():
+                future.cancel()
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            if merged.exception() is not None:
+                future.set_exception(merged.exception())
+            else:
+                future.set_result(merged.result())
+
+    def _budget_wait(self, priority: int) -> float:
+        """
+        :return: 该优先级可以发送时返回 0 ，否则返回建议等待的秒数
+        """
+        limiter = getattr(self.bot, 'rate_limiter', None)
+        if limiter is None:
+            return 0
+        reserve = self.reserve.get(priority, 0)
+        if limiter.remaining() > reserve:
+            return 0
+        if reserve <= 0:
+            return limiter.time_until_next() or self.poll_interval
+        return self.poll_interval
+
+    def _next(self):
+        """
+        在持有锁时调用
+        :return: (待发送的消息, 0) ，或暂无可发送消息时 (None, 等待秒数)
+        """
+        for priority, lane in self._lanes.items():
+            if not lane:
+                continue
+            # 预留名额随优先级降低而增加，高优先级不能发送时低优先级也不能发送
+            wait = self._budget_wait(priority)
+            if wait > 0:
+                return None, wait
+            return (priority,) + lane.popleft(), 0
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    entry, wait = self._next()
+                    if entry is not None or (wait is None and self._closed):
+                        break
+                    self._cond.wait(wait)
+                if entry is None:
+                    return
+            priority, future, method, args, kwargs, _ = entry
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(_call(getattr(self.bot, method), args, kwargs))
+                except BaseException as e:
+                    logger.debug('后台发送失败：%s', e)
+                    future.set_exception(e)
+            with self._cond:
+                self.processed[priority] += 1
+                self._unfinished -= 1
+                self._cond.notify_all()
+
+    def qsize(self, priority=None) -> int:
+        """
+        :param priority: 优先级，None 表示全部
+        :return: 队列中等待发送的消息数
+        """
+        with self._cond:
+            if priority is None:
+                return sum(len(lane) for lane in self._lanes.values())
+            return len(self._lanes[self._priority(priority)])
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        等待已入队的消息全部处理完毕
+        :param timeout: 最多等待的秒数，None 表示一直等待
+        :return: 是否在超时前处理完毕
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while self._unfinished:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """
+        停止接收新消息并关闭后台线程
+        :param wait: 是否等待队列中的消息发送完毕，为 False 时未发送的消息会被取消
+        :param timeout: 最多等待的秒数
+        :return:
+        """
+        cancelled = []
+        with self._cond:
+            if not wait:
+                for lane in self._lanes.values():
+                    cancelled.extend(entry[0] for entry in lane)
+                    self._unfinished -= len(lane)
+                    lane.clear()
+            self._closed = True
+            self._cond.notify_all()
+        for future in cancelled:
+            future.cancel()
+        if wait:
+            self._thread.join(timeout)
+        _dispatchers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
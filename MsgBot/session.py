@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def build_session(pool_connections: int = 10, pool_maxsize: int = 10, max_retries=0, pool_block: bool = False,
+                  keep_alive: bool = True) -> requests.Session:
+    """
+    创建带连接池的 requests.Session
+    同一个 Session 复用 TCP/TLS 连接，避免每条消息都重新握手
+    多个机器人实例可共用同一个 Session （构造机器人时传入 session 参数即可）
+    :param pool_connections: 连接池缓存的 host 数量
+    :param pool_maxsize: 每个 host 最多保持的连接数，多线程并发发送时应不小于线程数
+    :param max_retries: int 或 urllib3.util.Retry ，连接层面的重试策略，默认不重试
+    :param pool_block: 连接池已满时是否阻塞等待空闲连接
+    :param keep_alive: 是否保持长连接，为 False 时每次请求后关闭连接
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                          max_retries=max_retries, pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def build_async_session(limit: int = 100, keep_alive: bool = True):
+    """
+    创建带连接池的 aiohttp.ClientSession （需安装 aiohttp ，且须在事件循环中调用）
+    :param limit: 连接池最多同时打开的连接数
+    :param keep_alive: 是否保持长连接
+    :return: aiohttp.ClientSession
+    """
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError('异步机器人依赖 aiohttp ，请先安装： pip install MsgBot[async]')
+    connector = aiohttp.TCPConnector(limit=limit, force_close=not keep_alive)
+    return aiohttp.ClientSession(connector=connector)
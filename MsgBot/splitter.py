@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import re
+
+# markdown 代码块的起止行（ ``` 或 ~~~ ，最多缩进 3 个空格）
+_FENCE_RE = re.compile(rb'^ {0,3}(`{3,}|~{3,})[^\n]*', re.M)
+# 优先切分的位置：段落、换行、空格
+_SEPARATORS = (b'\n\n', b'\n', b' ')
+
+
+def utf8_len(text: str) -> int:
+    """
+    字符串按 UTF-8 编码后的字节数
+    :param text: 字符串
+    :return: 字节数
+    """
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+
+def _fences(data: bytes) -> list:
+    """
+    找出所有代码块，返回 [(起始行开始位置, 起始行结束位置, 起始行, 结束标记, 结束行开始位置), ...]
+    未闭合的代码块一直延续到末尾
+    """
+    fences = []
+    opening = None
+    for m in _FENCE_RE.finditer(data):
+        marker = m.group(1)
+        if opening is None:
+            opening = (m.start(), m.end(), m.group(0).lstrip(b' '), marker)
+        elif marker[:1] == opening[3][:1] and len(marker) >= len(opening[3]) and m.group(0).strip() == marker:
+            fences.append(opening + (m.start(),))
+            opening = None
+    if opening is not None:
+        fences.append(opening + (len(data),))
+    return fences
+
+
+def _cut(data: bytes, start: int, end: int) -> int:
+    """
+    在 (start, end] 中选择切分位置：优先在后半段的段落、换行、空格处切分，其次在前半段，
+    都找不到时在 UTF-8 字符边界处切分
+    """
+    if end >= len(data):
+        return len(data)
+    for lower in (start + (end - start) // 2, start):
+        for sep in _SEPARATORS:
+            i = data.rfind(sep, lower, end)
+            if i != -1:
+                return i + len(sep)
+    # 退到字符起始字节（跳过 10xxxxxx 形式的后续字节）
+    while end > start + 1 and data[end] & 0xC0 == 0x80:
+        end -= 1
+    return end
+
+
+def _split(data: bytes, budget: int, fences: list, close_reserve: int) -> list:
+    """
+    按字节预算切分，代码块被切断时在前一部分末尾补上结束标记，并在后一部分开头重复起始行
+    """
+    chunks = []
+    start = 0
+    fence_index = 0
+    reopen = b''
+    while start < len(data):
+        limit = budget - len(reopen) - close_reserve
+        if limit <= 0:
+            raise ValueError('[max_bytes] 过小，无法容纳代码块的起止行')
+        end = _cut(data, start, start + limit)
+        # 找到覆盖切分位置的代码块（切分位置单调递增，指针只向后移动）
+        while fence_index < len(fences) and fences[fence_index][4] < end:
+            fence_index += 1
+        chunk = reopen + data[start:end].rstrip(b'\n')
+        reopen = b''
+        if fence_index < len(fences) and fences[fence_index][1] < end <= fences[fence_index][4]:
+            fence = fences[fence_index]
+            chunk += b'\n' + fence[3]
+            reopen = fence[2] + b'\n'
+        chunks.append(chunk)
+        start = end
+        # 跳过切分位置的换行
+        while start < len(data) and data[start:start + 1] == b'\n':
+            start += 1
+    return chunks
+
+
+def split_text(text: str, max_bytes: int, markdown: bool = False, number_format: str = None) -> list:
+    """
+    将超出字节上限的消息拆分为多条
+    只对整个消息做一次 UTF-8 编码，之后在字节串上查找切分位置（换行与空格不会出现在多字节字符中间），
+    整体为 O(n)；切分位置依次优先选择段落、换行、空格，找不到时在字符边界处硬切
+    markdown 为 True 时不会切断代码块：被切断的代码块在前一部分补上结束标记，在后一部分重复起始行
+    拆分后的每一部分开头带有序号，序号也计入字节上限
+    :param text: 消息内容
+    :param max_bytes: 每条消息的字节上限
+    :param markdown: 是否为 markdown 消息
+    :param number_format: 序号格式，可使用 {index} 与 {total} ，默认为 ({index}/{total}) 加换行
+    :return: 拆分后的消息列表，未超出上限时为 [text]
+    """
+    if utf8_len(text) <= max_bytes:
+        return [text]
+    if number_format is None:
+        number_format = '({index}/{total})\n\n' if markdown else '({index}/{total})\n'
+    data = text.encode('utf-8')
+    fences = _fences(data) if markdown else []
+    close_reserve = 1 + max(len(fence[3]) for fence in fences) if fences else 0
+    # 序号的长度取决于总数，先按估计的位数切分，位数不够时再重新切分
+    digits = len(str(len(data) // max_bytes + 1))
+    while True:
+        prefix_len = utf8_len(number_format.format(index='9' * digits, total='9' * digits))
+        if max_bytes - prefix_len <= close_reserve:
+            raise ValueError('[max_bytes] 过小，无法容纳序号')
+        chunks = _split(data, max_bytes - prefix_len, fences, close_reserve)
+        if len(str(len(chunks))) <= digits:
+            break
+        digits = len(str(len(chunks)))
+    total = len(chunks)
+    return [number_format.format(index=i, total=total) + chunk.decode('utf-8') for i, chunk in enumerate(chunks, 1)]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+import string
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 标准库编码器：紧凑、不转义中文，与 orjson 的输出一致
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+# 编译模板时用于标记参数位置的私有区字符，正常消息中不会出现
+_MARK_OPEN, _MARK_CLOSE = '\ue000', '\ue001'
+_MARK_RE = re.compile(f'{_MARK_OPEN}(\\d+){_MARK_CLOSE}')
+
+
+def _std_dumps(obj) -> bytes:
+    return _encoder.encode(obj).encode('utf-8')
+
+
+def _std_escape(value: str) -> bytes:
+    return encode_basestring(value)[1:-1].encode('utf-8')
+
+
+def _orjson_escape(value: str) -> bytes:
+    return orjson.dumps(value)[1:-1]
+
+
+# 安装了 orjson 时使用 orjson 编码，否则使用标准库
+# dumps(obj) -> bytes ：将消息体编码为紧凑、不转义中文的 UTF-8 JSON 字节串
+dumps = orjson.dumps if orjson is not None else _std_dumps
+escape = _orjson_escape if orjson is not None else _std_escape
+
+
+class Slot(object):
+    """
+    模板中整个取值都由参数决定的位置，渲染时按 JSON 编码（可以是列表、数字、布尔值等）
+    字符串中的参数直接使用 str.format 风格的 {name} 即可
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f'Slot({self.name!r})'
+
+
+class MessageTemplate(object):
+    """
+    预编译的消息模板
+    编译时将消息体中固定的部分一次性编码为 UTF-8 字节，渲染时只对参数做 JSON 转义后拼接，
+    省去每次发送时构造嵌套字典、匹配 @手机号 与编码整个消息体的开销
+    字符串中的参数使用 str.format 风格（ {name} 、 {value:.2f} ， {{ 与 }} 表示花括号本身），
+    整个取值都由参数决定的位置使用 Slot('name')
+
+        template = MessageTemplate({'msgtype': 'text', 'text': {'content': '{host} 磁盘使用率 {usage:.0%}'}})
+        template.render(host='db-1', usage=0.93)
+    """
+
+    def __init__(self, form_data: dict):
+        """
+        :param form_data: 消息体，结构与各 send_* 方法发送的消息体相同
+        """
+        self.form_data = form_data
+        # [(参数名, 转换符, 格式说明, 是否为整个取值), ...]
+        self._slots = []
+        marked = self._mark(form_data)
+        text = _encoder.encode(marked)
+        parts = _MARK_RE.split(text)
+        statics = parts[0::2]
+        slots = [self._slots[int(index)] for index in parts[1::2]]
+        # 整个取值的参数去掉标记两侧的引号
+        for i, slot in enumerate(slots):
+            if slot[3]:
+                statics[i] = statics[i][:-1]
+                statics[i + 1] = statics[i + 1][1:]
+        self._head = statics[0].encode('utf-8')
+        self._steps = [(slot, static.encode('utf-8')) for slot, static in zip(slots, statics[1:])]
+        self.names = frozenset(slot[0] for slot in slots)
+
+    def __repr__(self):
+        return f'MessageTemplate({self.form_data!r})'
+
+    def _add_slot(self, name: str, conversion, spec, whole: bool) -> str:
+        if not name or not name.isidentifier():
+            raise ValueError(f'模板参数必须是合法的标识符: {name!r}')
+        self._slots.append((name, conversion, spec, whole))
+        return f'{_MARK_OPEN}{len(self._slots) - 1}{_MARK_CLOSE}'
+
+    def _mark(self, value):
+        """
+        将参数替换为标记，返回新的消息体
+        """
+        if isinstance(value, Slot):
+            return self._add_slot(value.name, None, '', True)
+        if isinstance(value, dict):
+            return {key: self._mark(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._mark(item) for item in value]
+        if isinstance(value, str):
+            if _MARK_OPEN in value or _MARK_CLOSE in value:
+                raise ValueError('消息中不能包含私有区字符 \\ue000 或 \\ue001')
+            pieces = []
+            for literal, name, spec, conversion in string.Formatter().parse(value):
+                pieces.append(literal)
+                if name is not None:
+                    pieces.append(self._add_slot(name, conversion, spec, False))
+            return ''.join(pieces)
+        return value
+
+    @staticmethod
+    def literals(text: str) -> list:
+        """
+        模板字符串中被参数隔开的各段固定文本
+        :param text: 模板字符串
+        :return: 固定文本列表
+        """
+        return [literal for literal, _, _, _ in string.Formatter().parse(text)]
+
+    @staticmethod
+    def has_params(value) -> bool:
+        """
+        :param value: 消息体中的取值
+        :return: 是否含参数（ Slot 或字符串中的 {name} ）， {{ 与 }} 表示花括号本身，不算参数
+        """
+        if isinstance(value, Slot):
+            return True
+        if isinstance(value, str):
+            return any(name is not None for _, name, _, _ in string.Formatter().parse(value))
+        if isinstance(value, dict):
+            return any(MessageTemplate.has_params(item) for item in value.values())
+        if isinstance(value, (list, tuple)):
+            return any(MessageTemplate.has_params(item) for item in value)
+        return False
+
+    def render(self, values: dict = None, **kwargs) -> bytes:
+        """
+        渲染为可以直接发送的 UTF-8 JSON 字节串
+        :param values: 参数字典
+        :param kwargs: 参数，与 values 同名时覆盖 values
+        :return: bytes
+        """
+        if values:
+            kwargs = dict(values, **kwargs) if kwargs else values
+        out = [self._head]
+        for (name, conversion, spec, whole), static in self._steps:
+            try:
+                value = kwargs[name]
+            except KeyError:
+                raise KeyError(f'缺少模板参数: {name}') from None
+            if whole:
+                out.append(dumps(value))
+            else:
+                if conversion == 'r':
+                    value = repr(value)
+                elif conversion == 'a':
+                    value = ascii(value)
+                elif conversion == 's':
+                    value = str(value)
+                out.append(escape(value if type(value) is str and not spec else format(value, spec)))
+            out.append(static)
+        return b''.join(out)
@@ -1,2 +1,23 @@
 # -*- coding: utf-8 -*-
-from MsgBot.wx_com_bot.bot import WxComBot
+from typing import TYPE_CHECKING
+from MsgBot import _lazy_getattr
+
+_EXPORTS = {
+    'WxComBot': 'MsgBot.wx_com_bot.bot',
+    'AsyncWxComBot': 'MsgBot.wx_com_bot.async_bot',
+    'TokenManager': 'MsgBot.wx_com_bot.token',
+    'WxComWebhookBot': 'MsgBot.wx_com_bot.webhook',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    return _lazy_getattr(__name__, _EXPORTS, name)
+
+
+if TYPE_CHECKING:
+    from MsgBot.wx_com_bot.bot import WxComBot
+    from MsgBot.wx_com_bot.async_bot import AsyncWxComBot
+    from MsgBot.wx_com_bot.token import TokenManager
+    from MsgBot.wx_com_bot.webhook import WxComWebhookBot
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from MsgBot.channel import AsyncChannel
+from MsgBot.exceptions import SendError
+from MsgBot.wx_com_bot.bulk import BulkResult
+from MsgBot.wx_com_bot.bot import WxComBot
+
+
+class AsyncWxComBot(AsyncChannel, WxComBot):
+    """
+    企业微信消息通知机器人（asyncio 版本）
+    所有 send_msg_* 方法与 WxComBot 同名同参，返回协程，需 await 调用
+    kwargs 为 aiohttp 请求参数，timeout 可直接传秒数
+    依赖 aiohttp ： pip install MsgBot[async]
+    """
+
+    def __init__(self, corp_id: str, corp_secret: str, session=None, pool_maxsize: int = 100,
+                 keep_alive: bool = True, **kwargs):
+        """
+        :param corp_id: 企业 id
+        :param corp_secret: 应用的凭证密钥
+        :param session: 共用的 aiohttp.ClientSession ，传入后由调用方负责关闭
+        :param pool_maxsize: 连接池最多同时打开的连接数
+        :param keep_alive: 是否保持长连接
+        :param kwargs: 其余参数同 WxComBot ，如 dedup
+        """
+        # 协程间的 token 刷新锁，须在事件循环中创建
+        self._token_lock = None
+        # 后台提前刷新 token 的任务，保留引用以免被垃圾回收
+        self._refresh_task = None
+        super().__init__(corp_id, corp_secret, session=session, pool_maxsize=pool_maxsize, keep_alive=keep_alive,
+                         **kwargs)
+
+    async def _fetch_token(self, **kwargs) -> dict:
+        self.logger.info('开始获取 token')
+        kwargs.setdefault('timeout', self.token_timeout)
+        try:
+            async with self._get_session().get(self._token_url(), **self._request_kwargs(kwargs)) as r:
+                status, content = r.status, await r.read()
+        except Exception as e:
+            raise SendError(f'获取 token 失败，详情如下：\n{e}')
+        return self._parse_token(status, content)
+
+    async def _refresh_token(self, stale: str = None, **kwargs) -> str:
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # 等待锁期间其他协程可能已刷新完毕
+            token = self.token_manager.valid_token()
+            if token is not None and token != stale:
+                return token
+            fetched_at = self.token_manager.clock()
+            self.token_manager.update(await self._fetch_token(**kwargs), fetched_at)
+            return self.token_manager.token
+
+    def _refresh_done(self, task):
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None:
+            self.logger.warning(f'提前刷新 token 失败，将在过期后重试：{e}')
+
+    async def _get_valid_token(self) -> str:
+        token = self.token_manager.valid_token()
+        if token is None:
+            return await self._refresh_token()
+        # 临近过期时在后台刷新，已有刷新在进行时不再发起
+        if self.token_manager.should_refresh() and not (self._token_lock and self._token_lock.locked()) \
+                and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self._refresh_token(stale=token))
+            self._refresh_task.add_done_callback(self._refresh_done)
+        return token
+
+    async def close(self):
+        """
+        取消进行中的后台 token 刷新并关闭连接池
+        :return:
+        """
+        task, self._refresh_task = self._refresh_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await super().close()
+
+    async def get_token(self, **kwargs):
+        await self._refresh_token(stale=self.token_manager.token, **kwargs)
+        self.logger.info('获取 token 成功')
+
+    async def _aendpoint(self, stages) -> str:
+        token = await self._get_valid_token()
+        stages.mark('token')
+        return self._send_url(token)
+
+    async def send_bulk(self, agent_id, content: str, msgtype: str = 'text', users=None, parties=None, tags=None,
+                        max_workers: int = 8, safe: int = 0, enable_id_trans: int = 0,
+                        enable_duplicate_check: int = 0, duplicate_check_interval: int = 1800,
+                        **kwargs) -> BulkResult:
+        """
+        同 WxComBot.send_bulk ， max_workers 为同时进行的请求数
+        """
+        forms = self._bulk_forms(agent_id, content, msgtype, users, parties, tags, safe, enable_id_trans,
+                                 enable_duplicate_check, duplicate_check_interval)
+        result = BulkResult()
+        await self._get_valid_token()
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def send(a_id, chunk, form_data):
+            async with semaphore:
+                try:
+                    response = await self._send_parts(self._split_msg(form_data), **kwargs)
+                except Exception as e:
+                    response = e
+            result.add(a_id, chunk, response)
+
+        await asyncio.gather(*[send(*item) for item in forms])
+        return result
@@ -2,64 +2,170 @@
 import json
 import logging
 import requests
-from datetime import datetime, timedelta
+from functools import partial
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from MsgBot.channel import Channel
+from MsgBot.dedup import DedupCache
+from MsgBot.retry import RetryPolicy
+from MsgBot.template import MessageTemplate
+from MsgBot.splitter import split_text, utf8_len
+from MsgBot.metrics import MetricsHook
+from MsgBot.rate_limiter import RateLimiter
 from MsgBot.exceptions import SendError, WxComError
+from MsgBot.wx_com_bot.token import TokenManager, TOKEN_ERRCODES
+from MsgBot.wx_com_bot.bulk import BulkResult, plan_chunks
 
+# 文本与 markdown 消息内容的字节上限，超出部分会被企业微信截断
+MAX_BYTES = 2048
+# 企业微信服务端接口地址
+API_BASE = 'https://qyapi.weixin.qq.com'
 
-class WxComBot(object):
+
+class WxComBot(Channel):
     """
     企业微信消息通知机器人（利用应用）
     目前支持消息类型：
         1. 文本
+        2. markdown
     """
+    error_class = WxComError
+    error_doc = '请查阅企业微信错误码 [ https://work.weixin.qq.com/api/doc/90000/90139/90313 ]'
+    channel_name = '企业微信'
     # 企业 id
     corp_id: str
     # 应用的凭证密钥
     corp_secret: str
-    # 企业微信应用 access_token
-    token: str
-    # access_token 过期时间，默认为 2 小时过期
-    expires_at: datetime
+    # access_token 缓存，默认为 2 小时过期
+    token_manager: TokenManager
+    # 复用连接的 requests.Session
+    session: requests.Session
 
-    def __init__(self, corp_id: str, corp_secret: str):
+    def __init__(self, corp_id: str, corp_secret: str, session: requests.Session = None, pool_maxsize: int = 10,
+                 max_retries=0, keep_alive: bool = True, dedup: DedupCache = None, token_cache: str = None,
+                 refresh_ahead: float = 300, retry_policy: RetryPolicy = None, max_bytes: int = MAX_BYTES,
+                 metrics: MetricsHook = None, metrics_name: str = None, api_base: str = API_BASE,
+                 rate_limiter: RateLimiter = None, token_timeout: float = 10):
+        """
+        :param corp_id: 企业 id
+        :param corp_secret: 应用的凭证密钥
+        :param session: 共用的 requests.Session ，传入后由调用方负责关闭，此时连接池相关参数无效
+        :param pool_maxsize: 连接池最多保持的连接数，多线程并发发送时应不小于线程数
+        :param max_retries: int 或 urllib3.util.Retry ，连接层面的重试策略，默认不重试
+        :param keep_alive: 是否保持长连接
+        :param dedup: 客户端去重缓存，相同消息（内容与接收者均相同）在窗口内只发送一次，默认不去重
+        :param token_cache: access_token 持久化文件路径，短时运行的进程（如 cron）可复用未过期的 token
+        :param refresh_ahead: access_token 过期前多少秒开始在后台刷新
+        :param retry_policy: 重试策略（含按企业共享的熔断器），默认不重试
+        :param max_bytes: send_msg_text / send_msg_md / send_bulk 消息内容的字节上限，超出时自动拆分为多条依次发送，为 None 时不拆分
+        :param metrics: 指标回调（如 MsgBot.metrics.Metrics ），默认不收集
+        :param metrics_name: 指标中的机器人名称，默认为 wx_com:企业id
+        :param api_base: 服务端接口地址，可指向代理或本地的 MsgBot.mock_server.MockServer
+        :param rate_limiter: 限流器，默认不在客户端限流
+        :param token_timeout: 获取 access_token 的请求超时时间，获取期间持有刷新锁，其他发送线程会一同等待
+        """
         self.corp_id = corp_id
+        self.token_timeout = token_timeout
+        self.api_base = api_base.rstrip('/')
         self.corp_secret = corp_secret
-        self.expires_at = datetime.now()
-        logging.basicConfig(format='%(asctime)s [%(name)s] %(levelname)s: %(message)s',
-                            level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
+        self.token_manager = TokenManager(corp_id, corp_secret, refresh_ahead=refresh_ahead, cache_file=token_cache)
         self.logger = logging.getLogger(__name__)
+        super().__init__(session=session, pool_maxsize=pool_maxsize, max_retries=max_retries, keep_alive=keep_alive,
+                         rate_limiter=rate_limiter, dedup=dedup, retry_policy=retry_policy, max_bytes=max_bytes,
+                         metrics=metrics, metrics_name=metrics_name or f'wx_com:{corp_id}',
+                         circuit_key=f'wx_com:{corp_id}')
+        if metrics is not None:
+            self.token_manager.on_refresh = partial(metrics.on_token_refresh, self.metrics_name)
 
-    def get_token(self, **kwargs):
+    def _token_url(self) -> str:
+        return f'{self.api_base}/cgi-bin/gettoken?corpid={self.corp_id}&corpsecret={self.corp_secret}'
+
+    @property
+    def token(self) -> str:
+        """
+        企业微信应用 access_token
+        """
+        return self.token_manager.token
+
+    @property
+    def expires_at(self) -> datetime:
+        """
+        access_token 过期时间
+        """
+        return datetime.fromtimestamp(self.token_manager.expires_at)
+
+    def _fetch_token(self, **kwargs) -> dict:
         self.logger.info('开始获取 token')
-        now = datetime.now()
-        url = f'https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid={self.corp_id}&corpsecret={self.corp_secret}'
-        r = requests.get(url, **kwargs)
-        data = json.loads(r.text)
-        if data['errcode'] != 0:
-            self.logger.error('获取 token 失败！请检查！')
-        self.expires_at = now + timedelta(seconds=data['expires_in'])
-        self.token = data['access_token']
+        # 后台刷新与发送时的获取都不带调用方的超时参数，须有默认超时，避免网络异常时一直持有刷新锁
+        kwargs.setdefault('timeout', self.token_timeout)
+        try:
+            r = self.session.get(self._token_url(), **kwargs)
+        except Exception as e:
+            raise SendError(f'获取 token 失败，详情如下：\n{e}')
+        return self._parse_token(r.status_code, r.content)
+
+    @staticmethod
+    def _parse_token(status: int, content: bytes) -> dict:
+        try:
+            return json.loads(content)
+        except ValueError:
+            # 网关返回的 HTML 错误页等
+            body = content[:200].decode('utf-8', 'replace')
+            raise SendError(f'获取 token 失败，响应不是 JSON （HTTP {status}），详情如下：\n{body}')
+
+    def get_token(self, **kwargs):
+        """
+        立即重新获取 access_token
+        :param kwargs: requests 相关参数，如超时时间
+        :return:
+        """
+        self.token_manager.invalidate(self.token)
+        self.token_manager.get(self._fetch_token, **kwargs)
         self.logger.info('获取 token 成功')
 
-    def _send_msg(self, form_data: dict, **kwargs):
+    @staticmethod
+    def _check_recipients(form_data: dict):
         if not form_data.get('touser') and not form_data.get('toparty') and not form_data.get('totag'):
             raise ValueError('[to_user,to_party,to_tag] 不能同时为空')
-        if len(form_data.get('content', '').encode()) > 2048:
-            self.logger.warning(f'消息长度超出 2048 字节 ，消息将被企业微信截断')
-        now = datetime.now()
-        if now >= self.expires_at:
-            self.get_token()
 
-        url = f'https://qyapi.weixin.qq.com/cgi-bin/message/send?access_token={self.token}&debug=1'
-        try:
-            r = requests.post(url, data=json.dumps(form_data), **kwargs)
-        except Exception as e:
-            raise SendError(f'发送 post 请求失败，详情如下：\n{e}')
-        response = json.loads(r.content.decode('utf-8'))
-        if response.get('errcode') != 0:
-            raise WxComError(f'{response}\n请查阅企业微信错误码 [ https://work.weixin.qq.com/api/doc/90000/90139/90313 ]')
+    def _check_form(self, form_data: dict):
+        # 模板渲染后的字节串在编译模板或 send_template 时已检查
+        if isinstance(form_data, bytes):
+            return
+        self._check_recipients(form_data)
+        body = form_data.get(form_data.get('msgtype'))
+        content = body.get('content') if isinstance(body, dict) else None
+        if isinstance(content, str) and utf8_len(content) > MAX_BYTES:
+            self.logger.warning(f'消息长度超出 {MAX_BYTES} 字节 ，消息将被企业微信截断')
+
+    def _send_url(self, token: str) -> str:
+        return f'{self.api_base}/cgi-bin/message/send?access_token={token}&debug=1'
+
+    def _endpoint(self, stages) -> str:
+        token = self.token_manager.get(self._fetch_token)
+        stages.mark('token')
+        return self._send_url(token)
 
-        return response
+    def _recover(self, error: WxComError, url: str) -> bool:
+        # token 失效（如在其他进程中被刷新）时自动刷新并重发一次
+        if error.errcode not in TOKEN_ERRCODES:
+            return False
+        self.logger.warning(f'token 已失效（errcode: {error.errcode}），刷新后重发')
+        self.token_manager.invalidate(parse_qs(urlsplit(url).query)['access_token'][0])
+        return True
+
+    def _split_msg(self, form_data: dict) -> list:
+        """
+        将内容超出字节上限的消息拆分为多条
+        :param form_data: 消息体
+        :return: 消息体列表
+        """
+        if not self.max_bytes:
+            return [form_data]
+        msgtype = form_data['msgtype']
+        parts = split_text(form_data[msgtype]['content'], self.max_bytes, markdown=msgtype == 'markdown')
+        return [dict(form_data, **{msgtype: {'content': part}}) for part in parts]
 
     def send_msg_text(self, agent_id: int, content: str, to_user: str = None, to_party: str = None, safe: int = 0,
                       to_tag: str = None, enable_id_trans: int = 0, enable_duplicate_check: int = 0,
@@ -67,7 +173,7 @@ class WxComBot(object):
         """
         发送文本类型消息
         :param agent_id: 企业应用的id，整型。企业内部开发，可在应用的设置页面查看
-        :param content: 消息内容，最长不超过2048个字节，超过将截断（支持id转译）
+        :param content: 消息内容，最长不超过2048个字节，超过时自动拆分为多条（支持id转译）
                         content 参数支持换行（\n）、以及 a 标签（打开自定义的网页）
         :param to_user: 指定接收消息的成员，成员ID列表（多个接收者用 | 分隔，最多支持1000个）。
                         特殊情况：指定为 @all ，则向该企业应用的全部成员发送
@@ -80,7 +186,7 @@ class WxComBot(object):
         :param enable_duplicate_check: 表示是否开启重复消息检查，0表示否，1表示是，默认0
         :param duplicate_check_interval: 表示是否重复消息检查的时间间隔，默认1800s，最大不超过4小时
         :param kwargs: requests 相关参数，如超时时间
-        :return:
+        :return: 消息被拆分时为各条消息的响应列表
         """
         form_data = {
             "touser": to_user,
@@ -96,7 +202,7 @@ class WxComBot(object):
             "enable_duplicate_check": enable_duplicate_check,
             "duplicate_check_interval": duplicate_check_interval
         }
-        return self._send_msg(form_data=form_data, **kwargs)
+        return self._send_parts(self._split_msg(form_data), **kwargs)
 
     def send_msg_md(self, agent_id: int, content: str, to_user: str = None, to_party: str = None, safe: int = 0,
                     to_tag: str = None, enable_id_trans: int = 0, enable_duplicate_check: int = 0,
@@ -104,7 +210,7 @@ class WxComBot(object):
         """
         发送 markdown 类型消息
         :param agent_id: 企业应用的id，整型。企业内部开发，可在应用的设置页面查看
-        :param content: 消息内容，最长不超过2048个字节，超过将截断（支持id转译）
+        :param content: 消息内容，最长不超过2048个字节，超过时自动拆分为多条（支持id转译）
                         content 参数支持换行（\n）、以及 a 标签（打开自定义的网页）
         :param to_user: 指定接收消息的成员，成员ID列表（多个接收者用 | 分隔，最多支持1000个）。
                         特殊情况：指定为 @all ，则向该企业应用的全部成员发送
@@ -117,7 +223,7 @@ class WxComBot(object):
         :param enable_duplicate_check: 表示是否开启重复消息检查，0表示否，1表示是，默认0
         :param duplicate_check_interval: 表示是否重复消息检查的时间间隔，默认1800s，最大不超过4小时
         :param kwargs: requests 相关参数，如超时时间
-        :return:
+        :return: 消息被拆分时为各条消息的响应列表
         """
         form_data = {
             "touser": to_user,
@@ -133,4 +239,159 @@ class WxComBot(object):
             "enable_duplicate_check": enable_duplicate_check,
             "duplicate_check_interval": duplicate_check_interval
         }
-        return self._send_msg(form_data=form_data, **kwargs)
+        return self._send_parts(self._split_msg(form_data), **kwargs)
+
+    def notify(self, title: str, text: str, agent_id: int = None, to_user: str = None, to_party: str = None,
+               to_tag: str = None, **kwargs):
+        """
+        以 markdown 消息发送通知，供 MsgBot.notifier.Notifier 调用
+        :param title: 标题，作为 markdown 的一级标题
+        :param text: markdown 格式的正文
+        :param agent_id: 企业应用的id
+        :param to_user: 同 send_msg_md
+        :param to_party: 同 send_msg_md
+        :param to_tag: 同 send_msg_md
+        :param kwargs: 同 send_msg_md
+        :return:
+        """
+        if agent_id is None:
+            raise ValueError('[agent_id] 不能为空')
+        return self.send_msg_md(agent_id, f'### {title}\n{text}', to_user=to_user, to_party=to_party, to_tag=to_tag,
+                                **kwargs)
+
+    @staticmethod
+    def _template(msgtype: str, agent_id, content: str, to_user, to_party, to_tag, safe, enable_id_trans,
+                  enable_duplicate_check, duplicate_check_interval) -> MessageTemplate:
+        recipients = (to_user, to_party, to_tag)
+        # 接收者含参数时可能渲染为空，只能在渲染后检查
+        dynamic = MessageTemplate.has_params(recipients)
+        if not dynamic and not any(recipients):
+            raise ValueError('[to_user,to_party,to_tag] 不能同时为空')
+        if not isinstance(content, str):
+            raise ValueError('[content] type must be string...')
+        template = MessageTemplate({
+            "touser": to_user,
+            "toparty": to_party,
+            "totag": to_tag,
+            "msgtype": msgtype,
+            "agentid": agent_id,
+            msgtype: {
+                "content": content
+            },
+            "safe": safe,
+            "enable_id_trans": enable_id_trans,
+            "enable_duplicate_check": enable_duplicate_check,
+            "duplicate_check_interval": duplicate_check_interval
+        })
+        template.dynamic_recipients = dynamic
+        return template
+
+    @classmethod
+    def text_template(cls, agent_id, content: str, to_user=None, to_party=None, safe=0, to_tag=None,
+                      enable_id_trans=0, enable_duplicate_check=0, duplicate_check_interval=1800) -> MessageTemplate:
+        """
+        编译文本类型消息模板，参数同 send_msg_text
+        字符串参数中可以包含 {name} 形式的参数，任意参数也可以是 Slot('name') ，在渲染时传入
+        :return: MessageTemplate
+        """
+        return cls._template('text', agent_id, content, to_user, to_party, to_tag, safe, enable_id_trans,
+                              enable_duplicate_check, duplicate_check_interval)
+
+    @classmethod
+    def markdown_template(cls, agent_id, content: str, to_user=None, to_party=None, safe=0, to_tag=None,
+                          enable_id_trans=0, enable_duplicate_check=0,
+                          duplicate_check_interval=1800) -> MessageTemplate:
+        """
+        编译 markdown 类型消息模板，参数同 send_msg_md
+        字符串参数中可以包含 {name} 形式的参数（花括号本身写作 {{ 与 }} ），任意参数也可以是 Slot('name')
+        :return: MessageTemplate
+        """
+        return cls._template('markdown', agent_id, content, to_user, to_party, to_tag, safe, enable_id_trans,
+                              enable_duplicate_check, duplicate_check_interval)
+
+    def send_template(self, template, values: dict = None, **kwargs):
+        """
+        使用预编译的模板发送消息
+        :param template: MessageTemplate ，或 MessageTemplate.render 渲染好的字节串（不再检查接收者）
+        :param values: 模板参数
+        :param kwargs: requests 相关参数，如超时时间
+        :return:
+        """
+        data = template.render(values) if isinstance(template, MessageTemplate) else template
+        if not isinstance(data, bytes):
+            raise ValueError('[template] must be MessageTemplate or bytes...')
+        if getattr(template, 'dynamic_recipients', False):
+            self._check_recipients(json.loads(data))
+        return self._send_msg(form_data=data, **kwargs)
+
+    @staticmethod
+    def _bulk_forms(agent_id, content: str, msgtype: str, users, parties, tags, safe: int, enable_id_trans: int,
+                    enable_duplicate_check: int, duplicate_check_interval: int):
+        """
+        :return: [(agent_id, (to_user, to_party, to_tag), form_data), ...]
+        """
+        if msgtype not in ('text', 'markdown'):
+            raise ValueError('[msgtype] must be "text" or "markdown"...')
+        agent_ids = agent_id if isinstance(agent_id, (list, tuple, set)) else [agent_id]
+        chunks = plan_chunks(users, parties, tags)
+        if not chunks:
+            raise ValueError('[users,parties,tags] 不能同时为空')
+        forms = []
+        for a_id in agent_ids:
+            for chunk in chunks:
+                form_data = {
+                    "touser": chunk[0],
+                    "toparty": chunk[1],
+                    "totag": chunk[2],
+                    "msgtype": msgtype,
+                    "agentid": a_id,
+                    msgtype: {
+                        "content": content
+                    },
+                    "safe": safe,
+                    "enable_id_trans": enable_id_trans,
+                    "enable_duplicate_check": enable_duplicate_check,
+                    "duplicate_check_interval": duplicate_check_interval
+                }
+                forms.append((a_id, chunk, form_data))
+        return forms
+
+    def send_bulk(self, agent_id, content: str, msgtype: str = 'text', users=None, parties=None, tags=None,
+                  max_workers: int = 8, safe: int = 0, enable_id_trans: int = 0, enable_duplicate_check: int = 0,
+                  duplicate_check_interval: int = 1800, **kwargs) -> BulkResult:
+        """
+        向大量接收者（可跨多个应用）群发同一条消息
+        接收者按企业微信单次请求的上限（成员 1000 个，部门、标签各 100 个）自动切分，由线程池并发发送，共用同一个 token
+        某个请求失败不会影响其他请求，失败信息记录在返回结果中
+        :param agent_id: 企业应用的id，或多个应用id组成的列表
+        :param content: 消息内容，超出字节上限时自动拆分为多条，同一批接收者按顺序发送
+        :param msgtype: text 或 markdown
+        :param users: 成员ID集合（list / set 或 | 分隔的字符串），数量不限
+        :param parties: 部门ID集合，数量不限
+        :param tags: 标签ID集合，数量不限
+        :param max_workers: 并发线程数，建议不大于连接池的 pool_maxsize
+        :param safe: 同 send_msg_text
+        :param enable_id_trans: 同 send_msg_text
+        :param enable_duplicate_check: 同 send_msg_text
+        :param duplicate_check_interval: 同 send_msg_text
+        :param kwargs: requests 相关参数，如超时时间
+        :return: BulkResult ，包含每个请求的响应以及汇总的 invaliduser / invalidparty / invalidtag
+        """
+        forms = self._bulk_forms(agent_id, content, msgtype, users, parties, tags, safe, enable_id_trans,
+                                 enable_duplicate_check, duplicate_check_interval)
+        result = BulkResult()
+        # 先获取 token ，避免各线程启动时同时等待
+        self.token_manager.get(self._fetch_token)
+
+        def send(item):
+            a_id, chunk, form_data = item
+            try:
+                # 内容超出字节上限时与 send_msg_text 相同，按顺序拆分为多条发送
+                response = self._send_parts(self._split_msg(form_data), **kwargs)
+            except Exception as e:
+                response = e
+            result.add(a_id, chunk, response)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='MsgBot-WxComBulk') as executor:
+            list(executor.map(send, forms))
+        return result
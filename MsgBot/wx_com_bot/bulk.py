@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import threading
+from itertools import zip_longest
+
+# 企业微信单次请求的接收者数量上限
+MAX_USERS = 1000
+MAX_PARTIES = 100
+MAX_TAGS = 100
+
+
+def split_ids(ids, size: int) -> list:
+    """
+    将接收者集合切分为 | 分隔的字符串列表，每段最多 size 个，重复的 id 只保留一个
+    :param ids: 可迭代的 id 集合，或已用 | 分隔的字符串
+    :param size: 每段最多的 id 数量
+    :return: ['id1|id2|...', ...]
+    """
+    if not ids:
+        return []
+    if isinstance(ids, str):
+        ids = ids.split('|')
+    ids = list(dict.fromkeys(str(i) for i in ids if str(i)))
+    return ['|'.join(ids[i:i + size]) for i in range(0, len(ids), size)]
+
+
+def plan_chunks(users=None, parties=None, tags=None) -> list:
+    """
+    按企业微信单次请求的上限切分接收者，尽量让每个请求同时带上成员、部门与标签
+    :return: [(to_user, to_party, to_tag), ...]
+    """
+    if users == '@all' or (not isinstance(users, str) and users and '@all' in users):
+        return [('@all', None, None)]
+    return list(zip_longest(split_ids(users, MAX_USERS), split_ids(parties, MAX_PARTIES),
+                            split_ids(tags, MAX_TAGS)))
+
+
+class BulkResult(object):
+    """
+    send_bulk 的汇总结果
+    items 中每一项为 (agent_id, to_user, to_party, to_tag, 响应或异常) ，消息被拆分时响应为各条消息的响应列表
+    """
+
+    def __init__(self):
+        self.items = []
+        # 企业微信返回的无效接收者
+        self.invalid_users = set()
+        self.invalid_parties = set()
+        self.invalid_tags = set()
+        self._lock = threading.Lock()
+
+    def add(self, agent_id: int, chunk: tuple, result):
+        with self._lock:
+            self.items.append((agent_id,) + tuple(chunk) + (result,))
+            for response in result if isinstance(result, list) else [result]:
+                if not isinstance(response, dict):
+                    continue
+                for field, invalid in (('invaliduser', self.invalid_users), ('invalidparty', self.invalid_parties),
+                                       ('invalidtag', self.invalid_tags)):
+                    if response.get(field):
+                        invalid.update(response[field].split('|'))
+
+    @property
+    def responses(self) -> list:
+        return [item[-1] for item in self.items if not isinstance(item[-1], BaseException)]
+
+    @property
+    def errors(self) -> list:
+        return [item for item in self.items if isinstance(item[-1], BaseException)]
+
+    @property
+    def ok(self) -> bool:
+        """
+        :return: 所有请求是否均发送成功（不含无效接收者的判断）
+        """
+        return not self.errors
+
+    def to_dict(self) -> dict:
+        """
+        :return: 可 JSON 序列化的汇总结果，异常表示为 {'type': 异常类名, 'message': 信息, 'errcode': 错误码}
+        """
+        with self._lock:
+            items = []
+            for agent_id, to_user, to_party, to_tag, result in self.items:
+                item = {'agent_id': agent_id, 'to_user': to_user, 'to_party': to_party, 'to_tag': to_tag}
+                if isinstance(result, BaseException):
+                    item['error'] = {'type': type(result).__name__, 'message': str(result),
+                                     'errcode': getattr(result, 'errcode', None)}
+                else:
+                    item['response'] = result
+                items.append(item)
+            return {'ok': not any('error' in item for item in items), 'items': items,
+                    'invalid_users': sorted(self.invalid_users), 'invalid_parties': sorted(self.invalid_parties),
+                    'invalid_tags': sorted(self.invalid_tags)}
+
+    def __repr__(self):
+        return f'<BulkResult requests={len(self.items)} errors={len(self.errors)} ' \
+               f'invalid_users={len(self.invalid_users)} invalid_parties={len(self.invalid_parties)}>'
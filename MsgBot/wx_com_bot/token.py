@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from MsgBot.exceptions import WxComError
+
+logger = logging.getLogger(__name__)
+
+# access_token 失效相关的错误码： 40001 不合法的 secret 或 token ，40014 不合法的 token ，42001 token 已过期
+TOKEN_ERRCODES = (40001, 40014, 42001)
+
+
+class TokenManager(object):
+    """
+    企业微信 access_token 缓存
+    1. 临近过期（refresh_ahead 秒内）时在后台线程提前刷新，发送消息不必等待 gettoken
+    2. 多个线程同时发现 token 失效时只会发起一次 gettoken 请求
+    3. 可将 token 持久化到本地文件，cron 等短时运行的进程可直接复用，无需每次获取
+    获取 token 的请求由调用方提供（fetch），本类只负责缓存与并发控制
+    """
+
+    def __init__(self, corp_id: str, corp_secret: str, refresh_ahead: float = 300, cache_file: str = None,
+                 clock=time.time):
+        """
+        :param corp_id: 企业 id
+        :param corp_secret: 应用的凭证密钥
+        :param refresh_ahead: 提前多少秒刷新
+        :param cache_file: token 持久化文件路径，默认不持久化
+        :param clock: 时钟函数，返回时间戳
+        """
+        self.corp_id = corp_id
+        self.refresh_ahead = refresh_ahead
+        self.cache_file = cache_file
+        self.clock = clock
+        # 用于核对缓存文件是否属于当前应用，不保存明文 secret
+        self._secret_digest = hashlib.sha256(f'{corp_id}:{corp_secret}'.encode('utf-8')).hexdigest()
+        # (token, 过期时间戳) ，整体替换以保证读取时二者一致
+        self._state = (None, 0.0)
+        self._lock = threading.Lock()
+        # 累计刷新次数
+        self.refresh_count = 0
+        # 刷新成功后的回调（无参数），用于上报指标
+        self.on_refresh = None
+        if cache_file:
+            self._load()
+
+    @property
+    def token(self) -> str:
+        return self._state[0]
+
+    @property
+    def expires_at(self) -> float:
+        return self._state[1]
+
+    def valid_token(self):
+        """
+        :return: 未过期的 token ，没有时返回 None
+        """
+        token, expires_at = self._state
+        return token if token is not None and self.clock() < expires_at else None
+
+    def should_refresh(self) -> bool:
+        """
+        :return: 是否已进入提前刷新的时间段
+        """
+        return self.clock() >= self._state[1] - self.refresh_ahead
+
+    def update(self, data: dict, fetched_at: float):
+        """
+        根据 gettoken 接口的响应更新 token
+        :param data: gettoken 接口返回的数据
+        :param fetched_at: 发起请求的时间戳
+        :return:
+        """
+        errcode = data.get('errcode')
+        if errcode != 0 or not data.get('access_token'):
+            raise WxComError(f'获取 token 失败：{data}\n'
+                             f'请查阅企业微信错误码 [ https://work.weixin.qq.com/api/doc/90000/90139/90313 ]',
+                             errcode=errcode)
+        self._state = (data['access_token'], fetched_at + data.get('expires_in', 7200))
+        self.refresh_count += 1
+        if self.cache_file:
+            self._save()
+        if self.on_refresh is not None:
+            self.on_refresh()
+
+    def invalidate(self, token: str):
+        """
+        标记 token 失效（如发送消息返回 40014 、 42001）
+        只在 token 仍为当前值时生效，避免并发的多个失败请求重复刷新
+        :param token: 失效的 token
+        :return:
+        """
+        if self._state[0] == token:
+            self._state = (token, 0.0)
+
+    def _refresh(self, fetch, **kwargs) -> str:
+        fetched_at = self.clock()
+        self.update(fetch(**kwargs), fetched_at)
+        return self._state[0]
+
+    def _refresh_in_background(self, fetch):
+        try:
+            self._refresh(fetch)
+        except Exception as e:
+            logger.warning('提前刷新 token 失败，将在过期后重试：%s', e)
+        finally:
+            self._lock.release()
+
+    def get(self, fetch, **kwargs) -> str:
+        """
+        获取可用的 token
+        :param fetch: 请求 gettoken 接口的函数，返回响应数据 dict
+        :param kwargs: 传给 fetch 的参数
+        :return: access_token
+        """
+        token = self.valid_token()
+        if token is not None:
+            # 临近过期时由后台线程刷新，已有刷新在进行时不再发起
+            if self.should_refresh() and self._lock.acquire(blocking=False):
+                threading.Thread(target=self._refresh_in_background, args=(fetch,),
+                                 name='MsgBot-TokenRefresh', daemon=True).start()
+            return token
+        with self._lock:
+            # 等待锁期间其他线程可能已刷新完毕
+            token = self.valid_token()
+            if token is None:
+                token = self._refresh(fetch, **kwargs)
+            return token
+
+    def _load(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('digest') == self._secret_digest and data.get('access_token'):
+            self._state = (data['access_token'], float(data.get('expires_at', 0)))
+
+    def _save(self):
+        token, expires_at = self._state
+        tmp = f'{self.cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'digest': self._secret_digest, 'access_token': token, 'expires_at': expires_at}, f)
+            # 原子替换，其他进程不会读到写了一半的文件
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            logger.warning('保存 token 缓存文件失败：%s', e)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import requests
+from MsgBot.channel import Channel
+from MsgBot.dedup import DedupCache
+from MsgBot.retry import RetryPolicy
+from MsgBot.splitter import split_text
+from MsgBot.metrics import MetricsHook
+from MsgBot.rate_limiter import RateLimiter, SlidingWindowRateLimiter
+from MsgBot.exceptions import WxComError
+from MsgBot.wx_com_bot.bot import API_BASE
+
+# 群机器人 text / markdown 消息内容的字节上限
+TEXT_MAX_BYTES = 2048
+MARKDOWN_MAX_BYTES = 4096
+
+
+class WxComWebhookBot(Channel):
+    """
+    企业微信群机器人
+    在群聊中添加机器人后获得 Webhook 地址，无需 access_token
+    每个机器人每分钟限制最多发送20条消息
+    企业微信官方文档：https://developer.work.weixin.qq.com/document/path/91770
+    """
+    error_class = WxComError
+    error_doc = '请查阅企业微信群机器人文档 [ https://developer.work.weixin.qq.com/document/path/91770 ]'
+    channel_name = '企业微信群机器人'
+
+    def __init__(self, web_hook: str, session: requests.Session = None, pool_maxsize: int = 10, max_retries=0,
+                 keep_alive: bool = True, rate_limiter: RateLimiter = None, dedup: DedupCache = None,
+                 retry_policy: RetryPolicy = None, max_bytes: int = MARKDOWN_MAX_BYTES, metrics: MetricsHook = None,
+                 metrics_name: str = None, api_base: str = API_BASE):
+        """
+        :param web_hook: 群机器人 Webhook 地址，或其中的 key
+        :param session: 共用的 requests.Session ，传入后由调用方负责关闭，此时连接池相关参数无效
+        :param pool_maxsize: 连接池最多保持的连接数，多线程并发发送时应不小于线程数
+        :param max_retries: int 或 urllib3.util.Retry ，连接层面的重试策略，默认不重试
+        :param keep_alive: 是否保持长连接
+        :param rate_limiter: 限流器，默认每分钟最多 20 条的滑动窗口限流
+        :param dedup: 客户端去重缓存，默认不去重
+        :param retry_policy: 重试策略（含按 Webhook 共享的熔断器），默认不重试
+        :param max_bytes: 消息内容的字节上限，超出时自动拆分为多条依次发送（ text 消息不超过 2048 ），为 None 时不拆分
+        :param metrics: 指标回调（如 MsgBot.metrics.Metrics ），默认不收集
+        :param metrics_name: 指标中的机器人名称，默认由 Webhook 摘要生成（不暴露 key ）
+        :param api_base: 只传入 key 时使用的服务端接口地址
+        """
+        if not isinstance(web_hook, str) or not web_hook:
+            raise ValueError('[web_hook] type must be string...')
+        if '://' not in web_hook:
+            web_hook = f'{api_base.rstrip("/")}/cgi-bin/webhook/send?key={web_hook}'
+        self.web_hook = web_hook
+        digest = f'wx_com_webhook:{hashlib.blake2b(web_hook.encode(), digest_size=4).hexdigest()}'
+        super().__init__(session=session, pool_maxsize=pool_maxsize, max_retries=max_retries, keep_alive=keep_alive,
+                         rate_limiter=rate_limiter if rate_limiter is not None else SlidingWindowRateLimiter(20, 60),
+                         dedup=dedup, retry_policy=retry_policy, max_bytes=max_bytes, metrics=metrics,
+                         metrics_name=metrics_name or digest, circuit_key=digest)
+
+    def _endpoint(self, stages) -> str:
+        return self.web_hook
+
+    def _split_msg(self, msg: dict, max_bytes: int) -> list:
+        """
+        将内容超出字节上限的消息拆分为多条，@ 只保留在最后一条
+        """
+        if not self.max_bytes:
+            return [msg]
+        msgtype = msg['msgtype']
+        body = msg[msgtype]
+        parts = split_text(body['content'], min(self.max_bytes, max_bytes), markdown=msgtype == 'markdown')
+        if len(parts) == 1:
+            return [msg]
+        msgs = [{'msgtype': msgtype, msgtype: {'content': part}} for part in parts]
+        msgs[-1][msgtype] = dict(body, content=parts[-1])
+        return msgs
+
+    def send_text(self, content: str, mentioned_list: list = None, mentioned_mobile_list: list = None,
+                  q_timeout: int = 60, r_timeout: int = 60):
+        """
+        发送 text 类型消息
+        :param content: 消息内容，超过 2048 字节时自动拆分为多条
+        :param mentioned_list: 要 @ 的成员 userid 列表， ['@all'] 表示 @所有人
+        :param mentioned_mobile_list: 要 @ 的成员手机号列表
+        :param q_timeout: 等待限流名额的超时时间
+        :param r_timeout: requests 超时时间
+        :return: 消息被拆分时为各条消息的响应列表
+        """
+        if not isinstance(content, str):
+            raise ValueError('[content] type must be string...')
+        body = {'content': content}
+        if mentioned_list:
+            body['mentioned_list'] = mentioned_list
+        if mentioned_mobile_list:
+            body['mentioned_mobile_list'] = mentioned_mobile_list
+        msg = {'msgtype': 'text', 'text': body}
+        return self._send_parts(self._split_msg(msg, TEXT_MAX_BYTES), q_timeout, r_timeout)
+
+    def send_markdown(self, content: str, q_timeout: int = 60, r_timeout: int = 60):
+        """
+        发送 markdown 类型消息，可在内容中使用 <@userid> @成员
+        :param content: markdown 格式的消息，超过 4096 字节时自动拆分为多条
+        :param q_timeout: 等待限流名额的超时时间
+        :param r_timeout: requests 超时时间
+        :return: 消息被拆分时为各条消息的响应列表
+        """
+        if not isinstance(content, str):
+            raise ValueError('[content] type must be string...')
+        msg = {'msgtype': 'markdown', 'markdown': {'content': content}}
+        return self._send_parts(self._split_msg(msg, MARKDOWN_MAX_BYTES), q_timeout, r_timeout)
+
+    def notify(self, title: str, text: str, **kwargs):
+        """
+        以 markdown 消息发送通知，供 MsgBot.notifier.Notifier 调用
+        :param title: 标题，作为 markdown 的一级标题
+        :param text: markdown 格式的正文
+        :param kwargs: 同 send_markdown
+        :return:
+        """
+        return self.send_markdown(f'### {title}\n{text}', **kwargs)
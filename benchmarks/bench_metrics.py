@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+指标收集的开销：未启用、启用内置 Metrics 时 _send_once 的耗时（替换为本地假 Session ，不发起网络请求）
+运行： python -m benchmarks.bench_metrics [次数]
+"""
+import sys
+import timeit
+from MsgBot import DingTalkBot
+from MsgBot.metrics import Metrics
+from MsgBot.rate_limiter import UnlimitedRateLimiter
+
+
+class FakeResponse(object):
+    status_code = 200
+    content = b'{"errcode":0,"errmsg":"ok"}'
+
+
+class FakeSession(object):
+
+    def post(self, url, **kwargs):
+        return FakeResponse()
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    form = {'msgtype': 'text', 'text': {'content': '今天天气真好，是么？'}, 'at': {'atMobiles': [], 'isAtAll': False}}
+    for name, metrics in (('disabled', None), ('Metrics', Metrics())):
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x', session=FakeSession(),
+                          rate_limiter=UnlimitedRateLimiter(), metrics=metrics)
+        cost = timeit.timeit(lambda: bot._send_once(form), number=n)
+        print(f'{name:>8}: {cost / n * 1e6:.3f}us/次')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+发件箱写入吞吐：对比逐条提交与组提交（每次提交一次 fsync）
+运行： python -m benchmarks.bench_outbox [线程数] [每线程消息数]
+数据库默认放在系统临时目录，可通过环境变量 OUTBOX_BENCH_DIR 指定（临时目录为内存文件系统时 fsync 几乎无开销）
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+from MsgBot.outbox import Outbox
+
+
+class NullBot(object):
+
+    def send_text(self, content: str):
+        return {'errcode': 0}
+
+
+def run(commit_interval: float, batch_size: int, threads: int, n: int):
+    with tempfile.TemporaryDirectory(dir=os.environ.get('OUTBOX_BENCH_DIR')) as directory:
+        outbox = Outbox(NullBot(), os.path.join(directory, 'outbox.db'), commit_interval=commit_interval,
+                        batch_size=batch_size)
+        workers = [threading.Thread(target=lambda: [outbox.send_text('x' * 200) for _ in range(n)])
+                   for _ in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        cost = time.perf_counter() - start
+        outbox.close()
+    total = threads * n
+    name = 'group commit' if batch_size > 1 else 'per message'
+    print(f'{name:>12}: {total} 条 {cost:.3f}s ，{total / cost:.0f} 条/s')
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    run(0, 1, threads, n)
+    run(0, 500, threads, n)
+
+
+if __name__ == '__main__':
+    main()
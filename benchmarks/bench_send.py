@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+端到端发送性能：同步、多线程、asyncio 三种发送方式在不同消息大小与并发数下的吞吐与 p50 / p99 延迟
+使用本地的 MockServer 模拟钉钉 Webhook 与企业微信接口（不限流），不会访问真实服务
+运行： python -m benchmarks.bench_send [-n 消息条数] [--latency 服务端延迟秒数] [--sizes 100,1000,10000]
+                                      [--concurrency 1,8,32] [--target dingtalk|wx_com] [--modes sync,threaded,async]
+"""
+import asyncio
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from MsgBot import DingTalkBot, WxComBot, UnlimitedRateLimiter
+from MsgBot.mock_server import MockServer
+
+try:
+    from MsgBot import AsyncDingTalkBot, AsyncWxComBot
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def percentile(samples: list, p: float) -> float:
+    """
+    :param samples: 已排序的样本
+    :param p: 百分位，0~100
+    """
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def make_bot(target: str, server: MockServer, concurrency: int, asynchronous: bool = False):
+    if target == 'dingtalk':
+        cls = AsyncDingTalkBot if asynchronous else DingTalkBot
+        return cls(server.web_hook('bench'), pool_maxsize=concurrency, rate_limiter=UnlimitedRateLimiter())
+    cls = AsyncWxComBot if asynchronous else WxComBot
+    return cls('corp_id', 'corp_secret', pool_maxsize=concurrency, api_base=server.url)
+
+
+def sender(target: str, bot, content: str):
+    if target == 'dingtalk':
+        return lambda: bot.send_text(content)
+    return lambda: bot.send_msg_text(agent_id=1, content=content, to_user='bench')
+
+
+def timed(send):
+    start = time.perf_counter()
+    send()
+    return time.perf_counter() - start
+
+
+def run_sync(target: str, server: MockServer, content: str, n: int, concurrency: int) -> list:
+    with make_bot(target, server, 1) as bot:
+        send = sender(target, bot, content)
+        send()
+        return [timed(send) for _ in range(n)]
+
+
+def run_threaded(target: str, server: MockServer, content: str, n: int, concurrency: int) -> list:
+    with make_bot(target, server, concurrency) as bot:
+        send = sender(target, bot, content)
+        send()
+        with ThreadPoolExecutor(concurrency) as executor:
+            return list(executor.map(lambda _: timed(send), range(n)))
+
+
+def run_async(target: str, server: MockServer, content: str, n: int, concurrency: int) -> list:
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        async with make_bot(target, server, concurrency, asynchronous=True) as bot:
+            send = sender(target, bot, content)
+
+            async def one():
+                async with semaphore:
+                    start = time.perf_counter()
+                    await send()
+                    return time.perf_counter() - start
+
+            await send()
+            return await asyncio.gather(*[one() for _ in range(n)])
+
+    return asyncio.run(main())
+
+
+MODES = {'sync': run_sync, 'threaded': run_threaded, 'async': run_async}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', type=int, default=500, help='每组测试发送的消息条数')
+    parser.add_argument('--latency', type=float, default=0.005, help='MockServer 每个请求的响应延迟（秒）')
+    parser.add_argument('--sizes', default='100,1000,10000', help='消息内容的字节数，逗号分隔')
+    parser.add_argument('--concurrency', default='1,8,32', help='并发数，逗号分隔（对 sync 无效）')
+    parser.add_argument('--target', choices=('dingtalk', 'wx_com'), default='dingtalk')
+    parser.add_argument('--modes', default='sync,threaded,async', help='发送方式，逗号分隔')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    modes = args.modes.split(',')
+    if 'async' in modes and aiohttp is None:
+        print('未安装 aiohttp ，跳过 async ： pip install MsgBot[async]')
+        modes.remove('async')
+    print(f'{"mode":>8} {"bytes":>6} {"conc":>5} {"msg/s":>9} {"p50(ms)":>8} {"p99(ms)":>8}')
+    with MockServer(latency=args.latency, rate_limit=None, history=None) as server:
+        for mode in modes:
+            for size in sizes:
+                # 企业微信消息超过 2048 字节会被拆分，按实际发送的条数计算吞吐
+                content = 'x' * size
+                for concurrency in ([1] if mode == 'sync' else levels):
+                    server.reset()
+                    start = time.perf_counter()
+                    samples = sorted(MODES[mode](args.target, server, content, args.n, concurrency))
+                    cost = time.perf_counter() - start
+                    sent = len(server.received)
+                    print(f'{mode:>8} {size:>6} {concurrency:>5} {sent / cost:>9.1f} '
+                          f'{percentile(samples, 50) * 1000:>8.2f} {percentile(samples, 99) * 1000:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+对比 “每条消息新建连接” 与 “连接池复用连接” 的发送耗时
+使用本地的 MockServer 模拟钉钉 Webhook ，不会访问真实服务
+运行： python -m benchmarks.bench_session [消息条数]
+"""
+import sys
+import json
+import time
+import requests
+from MsgBot import DingTalkBot
+from MsgBot.mock_server import MockServer
+
+
+def run(server: MockServer, post, web_hook: str, n: int):
+    """
+    只测量 HTTP 传输部分（限流等逻辑不计入）
+    :param post: requests.post 或 session.post
+    """
+    server.reset()
+    headers = {'Content-Type': 'application/json; charset=utf-8'}
+    start = time.perf_counter()
+    for i in range(n):
+        r = post(url=web_hook, data=json.dumps({'msgtype': 'text', 'text': {'content': f'bench {i}'}}),
+                 headers=headers, timeout=10)
+        json.loads(r.content.decode('utf-8'))
+    cost = time.perf_counter() - start
+    return cost, server.connections
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    with MockServer(rate_limit=None) as server:
+        web_hook = server.web_hook('bench')
+        cost, conns = run(server, requests.post, web_hook, n)
+        report('per-call', n, cost, conns)
+        with DingTalkBot(web_hook) as bot:
+            cost, conns = run(server, bot.session.post, web_hook, n)
+        report('pooled', n, cost, conns)
+
+
+def report(name: str, n: int, cost: float, conns: int):
+    print(f'{name:>8}: {n} 条消息 {cost:.3f}s ，平均 {cost / n * 1000:.3f}ms/条 ，新建连接 {conns} 次')
+
+
+if __name__ == '__main__':
+    main()
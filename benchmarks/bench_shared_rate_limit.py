@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+多进程共用同一 Webhook 时的限流效果
+每个进程不断占用发送名额，统计任意窗口内的实际占用次数是否超出限制
+运行： python -m benchmarks.bench_shared_rate_limit [进程数] [持续秒数]
+"""
+import sys
+import time
+import tempfile
+import multiprocessing
+from MsgBot.rate_limiter import SlidingWindowRateLimiter
+
+LIMIT = 20
+# 缩短窗口以便快速得到结果，逻辑与 60 秒窗口相同
+PERIOD = 1.0
+
+
+def worker(shared: bool, directory: str, duration: float, out):
+    if shared:
+        limiter = SlidingWindowRateLimiter.shared('bench-web-hook', LIMIT, PERIOD, directory=directory)
+    else:
+        limiter = SlidingWindowRateLimiter(LIMIT, PERIOD, clock=time.time)
+    stamps = []
+    latency = []
+    end = time.time() + duration
+    while time.time() < end:
+        start = time.perf_counter()
+        wait = limiter.try_acquire()
+        latency.append(time.perf_counter() - start)
+        if wait == 0:
+            stamps.append(time.time())
+        else:
+            time.sleep(min(wait, max(0.0, end - time.time())))
+    out.put((stamps, latency))
+
+
+def max_in_window(stamps: list) -> int:
+    stamps.sort()
+    most, left = 0, 0
+    for right, t in enumerate(stamps):
+        while t - stamps[left] >= PERIOD:
+            left += 1
+        most = max(most, right - left + 1)
+    return most
+
+
+def run(processes: int, duration: float, shared: bool):
+    out = multiprocessing.Queue()
+    with tempfile.TemporaryDirectory() as directory:
+        procs = [multiprocessing.Process(target=worker, args=(shared, directory, duration, out))
+                 for _ in range(processes)]
+        for p in procs:
+            p.start()
+        results = [out.get() for _ in procs]
+        for p in procs:
+            p.join()
+    stamps = [t for r in results for t in r[0]]
+    latency = sorted(t for r in results for t in r[1])
+    name = 'shared' if shared else 'per-process'
+    p50 = latency[len(latency) // 2] * 1e6 if latency else 0
+    print(f'{name:>11}: {processes} 个进程 {duration}s 内共占用 {len(stamps)} 次，'
+          f'任意 {PERIOD}s 窗口内最多 {max_in_window(stamps)} 次（限制 {LIMIT}），try_acquire p50 {p50:.1f}us')
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    run(processes, duration, shared=False)
+    run(processes, duration, shared=True)
+
+
+if __name__ == '__main__':
+    main()
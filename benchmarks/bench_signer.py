@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+钉钉加签耗时：对比每次发送都重新签名的旧实现与 Signer
+运行： python -m benchmarks.bench_signer [次数]
+"""
+import sys
+import hmac
+import base64
+import hashlib
+import timeit
+from urllib import parse
+from datetime import datetime
+from MsgBot.ding_talk_bot.signer import Signer
+
+WEB_HOOK = 'https://oapi.dingtalk.com/robot/send?access_token=' + 'x' * 64
+SECRET = 'SEC' + 'y' * 64
+
+
+def per_call_url() -> str:
+    """
+    旧实现：每次都创建 HMAC 对象并拼接 URL
+    """
+    timestamp = str(round(datetime.now().timestamp() * 1000))
+    secret_enc = SECRET.encode('utf-8')
+    string_to_sign = '{}\n{}'.format(timestamp, SECRET)
+    hmac_code = hmac.new(secret_enc, string_to_sign.encode('utf-8'), digestmod=hashlib.sha256).digest()
+    sign = parse.quote_plus(base64.b64encode(hmac_code))
+    return f'{WEB_HOOK}&timestamp={timestamp}&sign={sign}'
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    signer = Signer(WEB_HOOK, SECRET)
+    for name, func in (('per-call', per_call_url), ('Signer.refresh', signer.refresh), ('Signer.url', signer.url)):
+        cost = timeit.timeit(func, number=n)
+        print(f'{name:>14}: {cost / n * 1e6:.3f}us/次')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+消息体构造与编码耗时：对比 send_text / send_msg_text 的原有路径与预编译模板
+只统计到得到待发送的字节串为止，不发起网络请求
+运行： python -m benchmarks.bench_template [次数]
+"""
+import sys
+import json
+import timeit
+from MsgBot import DingTalkBot, WxComBot
+from MsgBot.template import orjson
+
+CONTENT = '【告警】主机 {host} 磁盘使用率 {usage} ，请 @15600000000 尽快处理'
+VALUES = {'host': 'db-master-01', 'usage': '93%'}
+
+
+class EncodeOnly(object):
+    """
+    替换 _send_msg ，只完成编码
+    """
+
+    def __init__(self, encode):
+        self.encode = encode
+
+    def __call__(self, form_data, *args, **kwargs):
+        return form_data if isinstance(form_data, bytes) else self.encode(form_data)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dt_bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x')
+    wx_bot = WxComBot('corp_id', 'corp_secret')
+    dt_template = DingTalkBot.text_template(CONTENT)
+    wx_template = WxComBot.text_template(1000002, CONTENT, to_user='zhangsan|lisi')
+    content = CONTENT.format(**VALUES)
+    cases = (
+        ('DingTalk json.dumps', dt_bot, lambda: dt_bot.send_text(content), json.dumps),
+        ('DingTalk dumps', dt_bot, lambda: dt_bot.send_text(content), dt_bot._encode),
+        ('DingTalk template', dt_bot, lambda: dt_bot.send_template(dt_template, VALUES), dt_bot._encode),
+        ('WxCom json.dumps', wx_bot, lambda: wx_bot.send_msg_text(1000002, content, 'zhangsan|lisi'), json.dumps),
+        ('WxCom dumps', wx_bot, lambda: wx_bot.send_msg_text(1000002, content, 'zhangsan|lisi'), wx_bot._encode),
+        ('WxCom template', wx_bot, lambda: wx_bot.send_template(wx_template, VALUES), wx_bot._encode),
+    )
+    print(f'orjson: {"已安装" if orjson is not None else "未安装"}')
+    for name, bot, func, encode in cases:
+        bot._send_msg = EncodeOnly(encode)
+        cost = timeit.timeit(func, number=n)
+        print(f'{name:>20}: {cost / n * 1e6:.3f}us/条')
+
+
+if __name__ == '__main__':
+    main()
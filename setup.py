@@ -18,6 +18,13 @@ setuptools.setup(
     install_requires=[
         'requests'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'fast': ['orjson']
+    },
+    entry_points={
+        'console_scripts': ['msgbot = MsgBot.cli:main']
+    },
     classifiers=[
         'Programming Language :: Python :: 3',
         'License :: OSI Approved :: MIT License',
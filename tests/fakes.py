@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+from collections import deque
+
+
+class FakeClock(object):
+    """
+    可手动推进的时钟，可作为限流器、去重缓存、熔断器等的 clock ， sleep 直接推进时间
+    """
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class FakeResponse(object):
+
+    def __init__(self, data: dict, status_code: int = 200):
+        self.status_code = status_code
+        self.content = json.dumps(data).encode('utf-8')
+        self.text = self.content.decode('utf-8')
+
+
+class FakeSession(object):
+    """
+    替代 requests.Session ，不发起网络请求
+    post 按顺序返回预设的响应（dict ，或要抛出的异常），用完后返回成功；子类可覆盖 respond 按请求构造响应
+    get （企业微信 gettoken）依次返回 token-1 、 token-2 ...
+    需要完整的请求往返（加签、限流、 token 过期等）时请使用 MsgBot.mock_server.MockServer
+    """
+
+    def __init__(self, *responses):
+        self.responses = deque(responses)
+        # 已发送的请求：[(url, 消息体), ...]
+        self.posts = []
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def respond(self, url: str, form_data: dict) -> dict:
+        with self.lock:
+            return self.responses.popleft() if self.responses else {'errcode': 0, 'errmsg': 'ok'}
+
+    def post(self, url, data=None, **kwargs):
+        form_data = json.loads(data) if data else None
+        with self.lock:
+            self.posts.append((url, form_data))
+        response = self.respond(url, form_data)
+        if isinstance(response, Exception):
+            raise response
+        return FakeResponse(response)
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.tokens += 1
+            token = f'token-{self.tokens}'
+        return FakeResponse({'errcode': 0, 'errmsg': 'ok', 'access_token': token, 'expires_in': 7200})
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import json
+import asyncio
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web
+from MsgBot import AsyncDingTalkBot, AsyncWxComBot
+from MsgBot.exceptions import DingTalkError
+
+
+async def _start_server():
+    received = []
+
+    async def robot_send(request):
+        data = await request.json()
+        received.append((request.query['access_token'], data))
+        if data.get('text', {}).get('content') == 'fail':
+            return web.json_response({'errcode': 310000, 'errmsg': 'keywords not in content'})
+        return web.json_response({'errcode': 0, 'errmsg': 'ok'})
+
+    async def get_token(request):
+        return web.json_response({'errcode': 0, 'errmsg': 'ok', 'access_token': 'token', 'expires_in': 7200})
+
+    async def message_send(request):
+        data = json.loads(await request.read())
+        received.append((request.query['access_token'], data))
+        return web.json_response({'errcode': 0, 'errmsg': 'ok'})
+
+    app = web.Application()
+    app.router.add_post('/robot/send', robot_send)
+    app.router.add_get('/cgi-bin/gettoken', get_token)
+    app.router.add_post('/cgi-bin/message/send', message_send)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}', received
+
+
+class TestAsyncBot(object):
+
+    def test_concurrent_webhooks(self):
+        async def main():
+            runner, base, received = await _start_server()
+            try:
+                async with aiohttp.ClientSession() as session:
+                    bots = [AsyncDingTalkBot(f'{base}/robot/send?access_token={i}', session=session)
+                            for i in range(50)]
+                    results = await asyncio.gather(*[bot.send_text(f'hello @138{i:08d}') for i, bot in
+                                                     enumerate(bots)])
+                    with pytest.raises(DingTalkError):
+                        await bots[0].send_text('fail')
+            finally:
+                await runner.cleanup()
+            return results, received
+
+        results, received = asyncio.run(main())
+        assert all(r['errcode'] == 0 for r in results)
+        assert len({token for token, _ in received}) == 50
+        token, data = received[0]
+        assert data['at']['atMobiles'] == [f'138{int(token):08d}']
+
+    def test_wx_com_send(self):
+        async def main():
+            runner, base, received = await _start_server()
+            try:
+                async with AsyncWxComBot('corp_id', 'corp_secret', api_base=base) as bot:
+                    response = await bot.send_msg_md(agent_id=1, content='**hi**', to_user='u1', timeout=5)
+            finally:
+                await runner.cleanup()
+            return response, received
+
+        response, received = asyncio.run(main())
+        assert response['errcode'] == 0
+        assert received == [('token', received[0][1])]
+        assert received[0][1]['markdown']['content'] == '**hi**'
+
+    def test_split_in_order(self):
+        async def main():
+            runner, base, received = await _start_server()
+            try:
+                async with AsyncDingTalkBot(f'{base}/robot/send?access_token=t', max_bytes=100) as bot:
+                    responses = await bot.send_text('\n'.join(f'line {i:03d}' for i in range(30)))
+            finally:
+                await runner.cleanup()
+            return responses, received
+
+        responses, received = asyncio.run(main())
+        assert len(responses) == len(received) > 1
+        contents = [data['text']['content'] for _, data in received]
+        assert contents[0].startswith(f'(1/{len(contents)})\n') and contents[-1].endswith('line 029')
+
+    def test_wx_com_refresh_task(self):
+        async def main():
+            runner, base, received = await _start_server()
+            try:
+                bot = AsyncWxComBot('corp_id', 'corp_secret', api_base=base)
+                await bot.get_token()
+                # 进入提前刷新区间，后台刷新由 bot 持有
+                bot.token_manager.refresh_ahead = 7200
+                await bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+                task = bot._refresh_task
+                assert task is not None
+                await bot.close()
+                assert task.done() and bot._refresh_task is None
+                # 后台刷新失败时只记录日志，不影响发送
+                bot = AsyncWxComBot('corp_id', 'corp_secret', api_base=base)
+                await bot.get_token()
+                bot.token_manager.refresh_ahead = 7200
+                bot._token_url = lambda: 'http://127.0.0.1:1/cgi-bin/gettoken'
+                response = await bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+                await asyncio.gather(bot._refresh_task, return_exceptions=True)
+                assert isinstance(bot._refresh_task.exception(), Exception)
+                await bot.close()
+            finally:
+                await runner.cleanup()
+            return response
+
+        assert asyncio.run(main())['errcode'] == 0
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from MsgBot import WxComBot
+from MsgBot.wx_com_bot.bulk import plan_chunks, split_ids
+from tests.fakes import FakeSession
+
+
+class BulkSession(FakeSession):
+    """
+    应用 3 不允许当前 IP 调用，以 7 结尾的用户无效
+    """
+
+    def respond(self, url: str, form_data: dict) -> dict:
+        if form_data['agentid'] == 3:
+            return {'errcode': 60020, 'errmsg': 'not allow to access from your ip'}
+        invalid = [u for u in (form_data['touser'] or '').split('|') if u.endswith('7')]
+        return {'errcode': 0, 'errmsg': 'ok', 'invaliduser': '|'.join(invalid)}
+
+
+class TestBulk(object):
+
+    def test_plan_chunks(self):
+        assert split_ids('a|b|a|', 1) == ['a', 'b']
+        chunks = plan_chunks(users=range(2500), parties=range(150), tags=None)
+        assert len(chunks) == 3
+        assert [len(c[0].split('|')) for c in chunks] == [1000, 1000, 500]
+        assert [c[1] and len(c[1].split('|')) for c in chunks] == [100, 50, None]
+        assert plan_chunks(users=['@all', 'u1']) == [('@all', None, None)]
+        assert plan_chunks() == []
+
+    def test_send_bulk(self):
+        session = BulkSession()
+        bot = WxComBot('corp_id', 'secret', session=session)
+        users = [f'user{i}' for i in range(2100)]
+        result = bot.send_bulk([1, 2, 3], 'hello', msgtype='markdown', users=users, parties=[1, 2], max_workers=4)
+        assert session.tokens == 1
+        assert len(result.items) == 9
+        assert len(result.errors) == 3 and not result.ok
+        assert all(e[0] == 3 and e[-1].errcode == 60020 for e in result.errors)
+        assert result.invalid_users == {u for u in users if u.endswith('7')}
+        forms = [form_data for _, form_data in session.posts]
+        sent = sorted(u for f in forms if f['agentid'] == 1 for u in f['touser'].split('|'))
+        assert sent == sorted(users)
+        assert all(f['markdown'] == {'content': 'hello'} for f in forms)
+
+    def test_split_long_content(self):
+        session = BulkSession()
+        bot = WxComBot('corp_id', 'secret', session=session, max_bytes=100)
+        content = '\n'.join(f'line {i:03d}' for i in range(30))
+        users = [f'user{i}' for i in range(1500)]
+        result = bot.send_bulk(1, content, users=users)
+        assert result.ok and len(result.items) == 2
+        # 每批接收者各自按顺序收到全部拆分后的消息
+        for _, to_user, _, _, responses in result.items:
+            parts = [f['text']['content'] for _, f in session.posts if f['touser'] == to_user]
+            assert len(parts) == len(responses) > 1
+            assert all(len(part.encode('utf-8')) <= 100 for part in parts)
+            assert parts[0].startswith(f'(1/{len(parts)})\n') and parts[-1].endswith('line 029')
+        assert result.invalid_users == {u for u in users if u.endswith('7')}
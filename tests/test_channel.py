@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import pytest
+from MsgBot import Channel, DingTalkBot, WxComBot, WxComWebhookBot, Notifier, UnlimitedRateLimiter
+from MsgBot.exceptions import SendError, ChannelError, WxComError
+from MsgBot.mock_server import MockServer, WX_COM_BAD_WEBHOOK_KEY, WX_COM_TOKEN_EXPIRED
+
+
+@pytest.fixture
+def server():
+    with MockServer(rate_limit=None) as server:
+        yield server
+
+
+class EchoChannel(Channel):
+    """
+    最小的自定义渠道：只需实现 _endpoint 与 notify
+    """
+
+    def __init__(self, url: str, **kwargs):
+        self.url = url
+        super().__init__(**kwargs)
+
+    def _endpoint(self, stages) -> str:
+        return self.url
+
+    def notify(self, title: str, text: str, **kwargs):
+        return self._send_msg({'msgtype': 'text', 'text': {'content': f'{title}\n{text}'}}, **kwargs)
+
+
+class SlowChannel(object):
+
+    def __init__(self, delay: float, error: Exception = None):
+        self.delay = delay
+        self.error = error
+
+    def notify(self, title: str, text: str, **kwargs):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {'errcode': 0, 'title': title, 'kwargs': kwargs}
+
+
+class TestChannel(object):
+
+    def test_custom_channel(self, server):
+        with EchoChannel(server.web_hook('custom')) as channel:
+            assert channel.notify('部署', '完成')['errcode'] == 0
+            with pytest.raises(ChannelError) as e:
+                EchoChannel(f'{server.url}/robot/send').notify('部署', '完成')
+        assert e.value.errcode == 300001
+        assert server.received[0][2]['text']['content'] == '部署\n完成'
+
+    def test_wx_com_token_recover(self, server):
+        with WxComBot('corp', 'secret', api_base=server.url) as bot:
+            bot.send_msg_text(agent_id=1, content='first', to_user='u1')
+            server.expire_tokens()
+            assert bot.send_msg_text(agent_id=1, content='second', to_user='u1')['errcode'] == 0
+            server.inject(WX_COM_TOKEN_EXPIRED, count=2)
+            with pytest.raises(WxComError):
+                bot.send_msg_text(agent_id=1, content='third', to_user='u1')
+        assert [payload['text']['content'] for _, _, payload in server.received] == ['first', 'second']
+
+    def test_webhook_bot(self, server):
+        with WxComWebhookBot('group', api_base=server.url) as bot:
+            bot.send_text('hello', mentioned_list=['@all'])
+            assert bot.send_markdown('**done**')['errcode'] == 0
+            assert len(bot.send_text('x' * 3000, mentioned_mobile_list=['13800000000'])) == 2
+        assert [item[:2] for item in server.received] == [('/cgi-bin/webhook/send', 'group')] * 4
+        assert server.received[0][2]['text']['mentioned_list'] == ['@all']
+        assert 'mentioned_mobile_list' not in server.received[2][2]['text']
+        assert server.received[3][2]['text']['mentioned_mobile_list'] == ['13800000000']
+        with WxComWebhookBot(f'{server.url}/cgi-bin/webhook/send?key=') as bot:
+            with pytest.raises(WxComError) as e:
+                bot.send_text('no key')
+        assert e.value.errcode == WX_COM_BAD_WEBHOOK_KEY
+
+
+class TestNotifier(object):
+
+    def test_fan_out(self, server):
+        ding_talk = DingTalkBot(server.web_hook('ops'), rate_limiter=UnlimitedRateLimiter())
+        wx_com = WxComBot('corp', 'secret', api_base=server.url)
+        webhook = WxComWebhookBot(server.wx_com_web_hook('group'))
+        with Notifier() as notifier, ding_talk, wx_com, webhook:
+            notifier.add('ops', ding_talk, at_mobiles=['13800000000'])
+            notifier.add('oncall', wx_com, agent_id=1, to_user='u1')
+            notifier.add('group', webhook)
+            results = notifier.notify('磁盘告警', '/data 使用率 **95%**')
+        assert {name: response['errcode'] for name, response in results.items()} == {'ops': 0, 'oncall': 0,
+                                                                                     'group': 0}
+        payloads = {path: payload for path, _, payload in server.received}
+        assert payloads['/robot/send']['at']['atMobiles'] == ['13800000000']
+        assert payloads['/cgi-bin/message/send']['msgtype'] == 'markdown'
+        assert '磁盘告警' in payloads['/cgi-bin/webhook/send']['markdown']['content']
+
+    def test_concurrent_and_isolated(self):
+        with Notifier() as notifier:
+            notifier.add('a', SlowChannel(0.2), level='high')
+            notifier.add('b', SlowChannel(0.2, error=SendError('down')))
+            notifier.add('c', SlowChannel(1))
+            with pytest.raises(ValueError):
+                notifier.add('a', SlowChannel(0))
+            start = time.monotonic()
+            results = notifier.notify('t', 'x', names=['a', 'b'], overrides={'a': {'level': 'low'}})
+            assert time.monotonic() - start < 0.35
+            assert results['a']['kwargs'] == {'level': 'low'} and isinstance(results['b'], SendError)
+            assert isinstance(notifier.notify('t', 'x', names=['c'], timeout=0.1)['c'], TimeoutError)
+
+    def test_anotify(self, server):
+        pytest.importorskip('aiohttp')
+        from MsgBot import AsyncDingTalkBot
+
+        async def main():
+            async with AsyncDingTalkBot(server.web_hook('async')) as bot:
+                with Notifier() as notifier:
+                    notifier.add('async', bot)
+                    notifier.add('sync', SlowChannel(0.1, error=SendError('down')))
+                    return await notifier.anotify('标题', '正文')
+
+        results = asyncio.run(main())
+        assert results['async']['errcode'] == 0 and isinstance(results['sync'], SendError)
+        assert server.received[0][2]['markdown']['title'] == '标题'
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import io
+import sys
+import subprocess
+import pytest
+from MsgBot.cli import main, parse_line, EXIT_OK, EXIT_FAILED, EXIT_USAGE
+from MsgBot.mock_server import MockServer
+
+
+@pytest.fixture
+def server():
+    with MockServer(rate_limit=None) as server:
+        yield server
+
+
+class TestCli(object):
+
+    def test_parse_line(self):
+        assert parse_line('  ') is None
+        assert parse_line('disk full') == {'content': 'disk full'}
+        assert parse_line('{"text": "**hi**", "msgtype": "markdown"}') == {'content': '**hi**', 'msgtype': 'markdown',
+                                                                            'markdown': True}
+        assert parse_line('{not json', fmt='text') == {'content': '{not json'}
+        with pytest.raises(ValueError):
+            parse_line('[1]', fmt='json')
+
+    def test_send_one(self, server):
+        assert main(['dingtalk', '--web-hook', server.web_hook('cli'), '--at', '13800000000', 'hello']) == EXIT_OK
+        path, token, payload = server.received[0]
+        assert token == 'cli' and payload['text']['content'] == 'hello'
+        assert payload['at']['atMobiles'] == ['13800000000']
+
+    def test_stream_one_connection(self, server):
+        stdin = io.StringIO('first\n\n{"title": "日报", "content": "**done**", "markdown": true}\n{broken\nlast\n')
+        assert main(['dingtalk', '--web-hook', server.web_hook()], stdin=stdin) == EXIT_FAILED
+        assert [payload['msgtype'] for _, _, payload in server.received] == ['text', 'markdown', 'text']
+        assert server.received[1][2]['markdown']['title'] == '日报'
+        assert server.connections == 1
+
+    def test_stream_coalesce(self, server):
+        stdin = io.StringIO('disk full\n' * 5 + 'cpu high\n')
+        assert main(['dingtalk', '--web-hook', server.web_hook(), '--coalesce', '60'], stdin=stdin) == EXIT_OK
+        assert len(server.received) == 1
+        assert '×5' in server.received[0][2]['markdown']['text']
+
+    def test_wx_com_token_reused(self, server, tmp_path):
+        args = ['wx_com', '--corp-id', 'corp', '--corp-secret', 'secret', '--agent-id', '1', '--to-user', 'u1',
+                '--api-base', server.url, '--token-cache', str(tmp_path / 'token.json')]
+        assert main(args + ['first']) == EXIT_OK
+        assert main(args + ['--markdown', 'second']) == EXIT_OK
+        assert [payload['msgtype'] for _, _, payload in server.received] == ['text', 'markdown']
+        assert server.received[0][1] == server.received[1][1]
+
+    def test_missing_web_hook(self, monkeypatch):
+        monkeypatch.delenv('DING_TALK_WEB_HOOK', raising=False)
+        assert main(['dingtalk', 'hello']) == EXIT_USAGE
+
+    def test_lazy_import(self):
+        code = ('import sys, MsgBot, MsgBot.cli; '
+                'assert not {"requests", "aiohttp", "MsgBot.ding_talk_bot.bot"} & set(sys.modules)')
+        subprocess.run([sys.executable, '-c', code], check=True)
+        # 同步发送不加载 asyncio
+        code = 'import sys; from MsgBot import DingTalkBot, WxComBot, Notifier; assert "asyncio" not in sys.modules'
+        subprocess.run([sys.executable, '-c', code], check=True)
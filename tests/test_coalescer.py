@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import threading
+import pytest
+from MsgBot.ding_talk_bot.coalescer import DingTalkCoalescer
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send_markdown(self, title, text, at_mobiles=None, at_all=False, **kwargs):
+        self.sent.append((title, text, at_mobiles, at_all))
+        self.kwargs = kwargs
+        return {'errcode': 0}
+
+
+class FailingBot(FakeBot):
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    def send_markdown(self, title, text, at_mobiles=None, at_all=False, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('connection reset by peer')
+        return super().send_markdown(title, text, at_mobiles, at_all, **kwargs)
+
+
+class SlowBot(FakeBot):
+
+    def __init__(self):
+        super().__init__()
+        self.sending = threading.Event()
+        self.release = threading.Event()
+
+    def send_markdown(self, title, text, at_mobiles=None, at_all=False, **kwargs):
+        # 只阻塞第一条汇总
+        if not self.sending.is_set():
+            self.sending.set()
+            self.release.wait(5)
+        return super().send_markdown(title, text, at_mobiles, at_all, **kwargs)
+
+
+class TestDingTalkCoalescer(object):
+
+    def test_merge(self):
+        bot = FakeBot()
+        with DingTalkCoalescer(bot, window=60, title='告警汇总') as coalescer:
+            for i in range(500):
+                coalescer.send_text(f'服务 {i % 3} 不可用', at_mobiles=[f'138{i % 2}'])
+            coalescer.send_markdown('数据库', '连接超时 @1390', at_all=True)
+            assert coalescer.pending() == 501
+            responses = coalescer.flush()
+        assert responses == [{'errcode': 0}]
+        title, text, at_mobiles, at_all = bot.sent[0]
+        assert title == '告警汇总'
+        assert text.startswith('#### 告警汇总（共 501 条）')
+        assert '服务 0 不可用 **（×167）**' in text
+        assert '**数据库**\n\n连接超时 @1390' in text
+        assert at_mobiles == ['1380', '1381'] and at_all
+
+    def test_max_bytes(self):
+        bot = FakeBot()
+        coalescer = DingTalkCoalescer(bot, window=60, max_bytes=1000)
+        for i in range(50):
+            coalescer.send_text(f'{i:02d}' + 'x' * 98)
+        coalescer.close()
+        assert len(bot.sent) > 1
+        assert all(len(text.encode('utf-8')) <= 1100 for _, text, _, _ in bot.sent)
+        numbers = [int(n) for _, text, _, _ in bot.sent for n in re.findall(r'(\d{2})x', text)]
+        assert numbers == list(range(50))
+
+    def test_window(self):
+        bot = FakeBot()
+        coalescer = DingTalkCoalescer(bot, window=0.05, key=lambda text: re.sub(r'\d+', '', text))
+        coalescer.send_text('请求耗时 1200ms')
+        coalescer.send_text('请求耗时 1300ms')
+        deadline = time.monotonic() + 5
+        while not bot.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        coalescer.close()
+        assert len(bot.sent) == 1
+        assert '请求耗时 1200ms **（×2）**' in bot.sent[0][1]
+
+    def test_kwargs(self):
+        bot = FakeBot()
+        coalescer = DingTalkCoalescer(bot, window=60)
+        coalescer.send_text('a', r_timeout=5)
+        coalescer.send_markdown('b', 'c', r_timeout=10, q_timeout=1)
+        coalescer.flush()
+        assert bot.kwargs == {'r_timeout': 10, 'q_timeout': 1}
+        with pytest.raises(TypeError):
+            coalescer.send_text('a', timeout=5)
+        coalescer.close()
+
+    def test_failed_batch_kept(self):
+        bot = FailingBot(failures=2)
+        errors = []
+        coalescer = DingTalkCoalescer(bot, window=0.05, on_error=lambda entries, e: errors.append((entries, e)))
+        coalescer.send_text('服务不可用')
+        deadline = time.monotonic() + 5
+        while not errors and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert errors[0][0] == [('服务不可用', 1)] and isinstance(errors[0][1], ConnectionError)
+        assert coalescer.pending() == 1
+        # flush 失败时批次继续保留
+        with pytest.raises(ConnectionError):
+            coalescer.flush()
+        assert coalescer.pending() == 1
+        coalescer.close()
+        assert coalescer.pending() == 0
+        assert len(bot.sent) == 1 and '服务不可用' in bot.sent[0][1]
+
+    def test_failed_batch_retried_by_timer(self):
+        # 发送失败后没有新消息到达，也会按 retry_interval 重新发送
+        bot = FailingBot(failures=2)
+        coalescer = DingTalkCoalescer(bot, window=0.01, retry_interval=0.05, on_error=lambda entries, e: None)
+        coalescer.send_text('服务不可用')
+        deadline = time.monotonic() + 5
+        while not bot.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(bot.sent) == 1 and coalescer.pending() == 0
+        coalescer.close()
+
+    def test_max_failed(self):
+        bot = FailingBot(failures=3)
+        dropped = []
+        coalescer = DingTalkCoalescer(bot, window=60, max_failed=2, on_drop=dropped.append)
+        for i in range(3):
+            coalescer.send_text(f'm{i}')
+            with pytest.raises(ConnectionError):
+                coalescer.flush()
+        assert dropped == [[('m0', 1)]] and coalescer.pending() == 2
+        coalescer.close()
+        assert [text.split('\n\n')[1] for _, text, _, _ in bot.sent] == ['m1', 'm2']
+
+    def test_flush_waits_for_background_send(self):
+        bot = SlowBot()
+        coalescer = DingTalkCoalescer(bot, window=0.01)
+        coalescer.send_text('first')
+        assert bot.sending.wait(5)
+        coalescer.send_text('second')
+        flushing = threading.Thread(target=coalescer.flush)
+        flushing.start()
+        time.sleep(0.05)
+        bot.release.set()
+        flushing.join(5)
+        coalescer.close()
+        assert ['first' in text for _, text, _, _ in bot.sent] == [True, False]
+        assert 'second' in bot.sent[1][1]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import pytest
+from MsgBot import DingTalkBot, UnlimitedRateLimiter
+from MsgBot.dedup import DedupCache, payload_key
+from MsgBot.exceptions import DingTalkError
+from MsgBot.mock_server import MockServer
+from tests.fakes import FakeClock
+
+
+def text(content: str, to_user: str = 'u1') -> dict:
+    return {'touser': to_user, 'msgtype': 'text', 'text': {'content': content}}
+
+
+class TestDedupCache(object):
+
+    def test_key_normalized(self):
+        assert payload_key({'a': 1, 'b': {'c': '中'}}) == payload_key({'b': {'c': '中'}, 'a': 1})
+        assert payload_key(text('x')) != payload_key(text('x', 'u2'))
+
+    def test_ttl_and_summary(self):
+        clock = FakeClock()
+        cache = DedupCache(ttl=60, clock=clock, suffix=' [x{count}]')
+        assert cache.check(text('a')) == text('a')
+        assert cache.check(text('a')) is None
+        assert cache.check(text('a')) is None
+        assert cache.check(text('a', 'u2')) == text('a', 'u2')
+        assert (cache.passed, cache.suppressed) == (2, 2)
+        clock.now = 60
+        assert cache.check(text('a')) == text('a [x2]')
+        assert cache.check(text('a')) is None
+        clock.now = 120
+        assert cache.expired_summaries() == [text('a [x1]')]
+        assert cache.expired_summaries() == []
+
+    def test_lru(self):
+        cache = DedupCache(ttl=60, maxsize=2, clock=FakeClock())
+        cache.check(text('a'))
+        cache.check(text('b'))
+        cache.check(text('a'))
+        cache.check(text('c'))
+        # b 最久未使用，被淘汰
+        assert len(cache) == 2
+        assert cache.check(text('b')) is not None
+        assert cache.check(text('a')) is not None
+
+    def test_release(self):
+        clock = FakeClock()
+        cache = DedupCache(ttl=60, clock=clock, suffix=' [x{count}]')
+        cache.check(text('a'))
+        cache.release(text('a'))
+        assert len(cache) == 0 and cache.passed == 0
+        assert cache.check(text('a')) == text('a')
+        assert cache.check(text('a')) is None
+        clock.now = 60
+        # 附带重复次数的消息发送失败后，重复次数保留到下一次放行
+        assert cache.check(text('a')) == text('a [x1]')
+        cache.release(text('a'))
+        assert cache.check(text('a')) == text('a [x1]')
+
+    def test_rendered_bytes(self):
+        clock = FakeClock()
+        cache = DedupCache(ttl=60, clock=clock, suffix=' [x{count}]')
+        data = b'{"touser":"u1","msgtype":"text","text":{"content":"a"}}'
+        assert cache.check(data) is data
+        assert cache.check(data) is None
+        clock.now = 60
+        assert cache.check(data) == text('a [x1]')
+
+
+class TestBotDedup(object):
+
+    def test_suppressed_without_request(self):
+        bot = DingTalkBot('http://127.0.0.1:1/robot/send?access_token=x', dedup=DedupCache(ttl=60))
+        payload = {'msgtype': 'text', 'text': {'content': 'a'}}
+        bot._dedup(payload)
+        # 已登记的消息再次发送时不会发起请求，也不占用限流名额
+        assert bot._send_msg(payload)['suppressed']
+        assert bot.rate_limiter.remaining() == 20
+
+    def test_retry_after_failure(self):
+        with MockServer(rate_limit=None) as server:
+            with DingTalkBot(server.web_hook(), dedup=DedupCache(ttl=60),
+                             rate_limiter=UnlimitedRateLimiter()) as bot:
+                server.inject(-1)
+                with pytest.raises(DingTalkError):
+                    bot.send_text('disk full')
+                # 发送失败的消息不应被去重拦截
+                assert 'suppressed' not in bot.send_text('disk full')
+                assert bot.send_text('disk full')['suppressed']
+            assert len(server.received) == 1
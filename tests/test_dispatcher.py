@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import threading
+import pytest
+from MsgBot import AsyncDingTalkBot
+from MsgBot.dispatcher import Dispatcher
+from MsgBot.exceptions import QueueFullError, SendError
+from MsgBot.mock_server import MockServer
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.sent = []
+        # gate 未 set 时 send_text 阻塞，便于构造队列已满的场景
+        self.gate = threading.Event()
+        self.gate.set()
+        # 工作线程已取走消息、开始发送
+        self.started = threading.Event()
+
+    def send_text(self, content: str):
+        self.started.set()
+        self.gate.wait()
+        if content == 'fail':
+            raise SendError('fail')
+        self.sent.append(content)
+        return {'errcode': 0, 'content': content}
+
+
+class TestDispatcher(object):
+
+    def test_send_returns_future(self):
+        bot = FakeBot()
+        with Dispatcher(bot, workers=4) as dispatcher:
+            futures = [dispatcher.send_text(str(i)) for i in range(100)]
+            assert dispatcher.flush(timeout=5)
+            assert [f.result()['content'] for f in futures] == [str(i) for i in range(100)]
+            with pytest.raises(SendError):
+                dispatcher.send_text('fail').result(timeout=5)
+        assert sorted(bot.sent, key=int) == [str(i) for i in range(100)]
+
+    def test_drop_oldest(self):
+        bot = FakeBot()
+        bot.gate.clear()
+        dispatcher = Dispatcher(bot, workers=1, maxsize=2, policy=Dispatcher.DROP_OLDEST)
+        first = dispatcher.send_text('0')
+        # 等待唯一的工作线程取走第一条消息并阻塞
+        assert bot.started.wait(timeout=5)
+        f1, f2, f3 = dispatcher.send_text('1'), dispatcher.send_text('2'), dispatcher.send_text('3')
+        with pytest.raises(QueueFullError):
+            f1.result(timeout=1)
+        bot.gate.set()
+        dispatcher.shutdown()
+        assert first.result() and f2.result() and f3.result()
+        assert bot.sent == ['0', '2', '3']
+
+    def test_drop_newest_and_block_timeout(self):
+        bot = FakeBot()
+        bot.gate.clear()
+        dispatcher = Dispatcher(bot, workers=1, maxsize=1, policy=Dispatcher.DROP_NEWEST)
+        dispatcher.send_text('0')
+        assert bot.started.wait(timeout=5)
+        dispatcher.send_text('1')
+        with pytest.raises(QueueFullError):
+            dispatcher.send_text('2').result(timeout=1)
+        dispatcher.policy, dispatcher.put_timeout = Dispatcher.BLOCK, 0.05
+        with pytest.raises(QueueFullError):
+            dispatcher.send_text('3')
+        assert not dispatcher.flush(timeout=0.05)
+        bot.gate.set()
+        assert dispatcher.flush(timeout=5)
+        dispatcher.shutdown()
+        assert bot.sent == ['0', '1']
+
+    def test_reject_async_bot(self):
+        pytest.importorskip('aiohttp')
+        with MockServer() as server:
+            bot = AsyncDingTalkBot(server.web_hook())
+            with pytest.raises(TypeError):
+                Dispatcher(bot)
+
+            class Wrapper(object):
+                # 非 AsyncChannel 的包装，send_text 同样返回协程
+                send_text = bot.send_text
+
+            with Dispatcher(Wrapper()) as dispatcher:
+                with pytest.raises(TypeError):
+                    dispatcher.send_text('hello').result(timeout=5)
+            assert not server.received
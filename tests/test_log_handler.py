@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+import threading
+import pytest
+from MsgBot.log_handler import DingTalkHandler, WxComHandler
+from MsgBot.exceptions import SendError
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.sent = []
+        self.fail = False
+        # gate 未 set 时发送阻塞，模拟网络很慢的情况
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send_text(self, content: str, at_mobiles: list = None, at_all=False):
+        self.gate.wait()
+        if self.fail:
+            raise SendError('fail')
+        self.sent.append((content, at_mobiles))
+
+    def send_msg_text(self, agent_id: int, content: str, to_user: str = None, to_party: str = None,
+                      to_tag: str = None):
+        self.sent.append((agent_id, content, to_user))
+
+
+def make_logger(handler) -> logging.Logger:
+    log = logging.getLogger(f'test_log_handler.{id(handler)}')
+    log.propagate = False
+    log.addHandler(handler)
+    return log
+
+
+class TestBotHandler(object):
+
+    def test_batch(self):
+        bot = FakeBot()
+        handler = DingTalkHandler(bot, at_mobiles=['156'], flush_interval=60)
+        log = make_logger(handler)
+        log.info('ignored')
+        log.error('error 1')
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            log.exception('error 2')
+        handler.flush()
+        assert len(bot.sent) == 1
+        content, at_mobiles = bot.sent[0]
+        assert content.startswith('【日志告警】共 2 条') and 'error 1' in content and 'ZeroDivisionError' in content
+        assert 'ignored' not in content and at_mobiles == ['156']
+        handler.flush()
+        assert len(bot.sent) == 1
+        handler.close()
+
+    def test_background_thread(self):
+        bot = FakeBot()
+        handler = WxComHandler(bot, agent_id=1, to_user='u1', flush_interval=0.05)
+        log = make_logger(handler)
+        log.critical('down')
+        deadline = time.monotonic() + 5
+        while not bot.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert bot.sent[0][0] == 1 and 'down' in bot.sent[0][1] and bot.sent[0][2] == 'u1'
+        handler.close()
+        with pytest.raises(ValueError):
+            WxComHandler(bot, agent_id=1)
+
+    def test_never_block_or_raise(self):
+        bot = FakeBot()
+        bot.gate.clear()
+        handler = DingTalkHandler(bot, flush_interval=0.01, capacity=3)
+        log = make_logger(handler)
+        log.error('first')
+        time.sleep(0.1)
+        # 后台线程阻塞在发送中，记录日志依然立即返回，超出容量的最早日志被丢弃
+        start = time.monotonic()
+        for i in range(5):
+            log.error(f'error {i}')
+        assert time.monotonic() - start < 0.5
+        bot.fail = True
+        bot.gate.set()
+        time.sleep(0.1)
+        bot.fail = False
+        log.error('last')
+        handler.close()
+        content = bot.sent[-1][0]
+        assert 'last' in content
+        # 发送失败只记录到 MsgBot 自身的日志，而 MsgBot 自身的日志不会被发送
+        record = logging.makeLogRecord({'name': 'MsgBot.log_handler', 'levelno': logging.WARNING, 'msg': 'x'})
+        assert not handler.filter(record)
+
+    def test_dropped_note(self):
+        bot = FakeBot()
+        handler = DingTalkHandler(bot, flush_interval=60, capacity=2)
+        log = make_logger(handler)
+        for i in range(5):
+            log.error(f'error {i}')
+        handler.close()
+        content = bot.sent[0][0]
+        assert '共 5 条' in content and '最早的 3 条已丢弃' in content
+        assert 'error 3' in content and 'error 4' in content and 'error 2' not in content
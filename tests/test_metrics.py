@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import pytest
+from urllib.request import urlopen
+from MsgBot import DingTalkBot, WxComBot, DedupCache
+from MsgBot.metrics import Metrics, MetricsHook, result_code, NULL_TRACE, trace
+from MsgBot.exceptions import DingTalkError, SendError, RateLimitError
+from tests.fakes import FakeSession
+
+
+class TestMetrics(object):
+
+    def test_disabled(self):
+        assert trace(None, 'x') is NULL_TRACE
+        with trace(None, 'x') as stages:
+            stages.mark('http')
+
+    def test_result_code(self):
+        assert result_code() == '0'
+        assert result_code(DingTalkError('x', errcode=130101)) == '130101'
+        assert result_code(RateLimitError('x')) == 'rate_limited'
+        assert result_code(SendError('x')) == 'network'
+        assert result_code(KeyError('x')) == 'KeyError'
+
+    def test_ding_talk(self):
+        metrics = Metrics()
+        session = FakeSession({'errcode': 0}, {'errcode': 310000}, ConnectionError('reset'))
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=secret', session=session,
+                          metrics=metrics, metrics_name='alert', dedup=DedupCache())
+        bot.send_text('a')
+        bot.send_text('a')
+        with pytest.raises(DingTalkError):
+            bot.send_text('b')
+        with pytest.raises(SendError):
+            bot.send_text('c')
+        assert metrics.results == {('alert', '0'): 1, ('alert', 'suppressed'): 1, ('alert', '310000'): 1,
+                                   ('alert', 'network'): 1}
+        assert metrics.stages[('alert', 'total')].count == 3
+        assert metrics.stages[('alert', 'parse')].count == 1
+        assert metrics.stages[('alert', 'http')].count == 2
+        text = metrics.to_prometheus()
+        assert 'msgbot_requests_total{bot="alert",errcode="310000"} 1' in text
+        assert 'msgbot_stage_seconds_bucket{bot="alert",stage="rate_limit",le="+Inf"} 3' in text
+        assert 'msgbot_rate_limiter_in_use{bot="alert"} 3' in text
+        assert 'msgbot_rate_limiter_remaining{bot="alert"} 17' in text
+        assert 'secret' not in DingTalkBot('https://x?access_token=secret', metrics=metrics).metrics_name
+
+    def test_wx_com_token_refresh(self):
+        metrics = Metrics()
+        session = FakeSession({'errcode': 42001}, {'errcode': 0})
+        bot = WxComBot('corp', 'secret', session=session, metrics=metrics)
+        bot.send_msg_text(1, 'hi', to_user='u1')
+        assert metrics.token_refreshes == {'wx_com:corp': 2}
+        assert metrics.stages[('wx_com:corp', 'token')].count == 2
+        assert metrics.results == {('wx_com:corp', '0'): 1}
+        metrics.gauge('msgbot_queue_depth', lambda: 7, 'queue', queue='outbox')
+        text = metrics.to_prometheus()
+        assert 'msgbot_token_refresh_total{bot="wx_com:corp"} 2' in text
+        assert 'msgbot_queue_depth{queue="outbox"} 7' in text
+
+    def test_custom_hook_and_serve(self):
+        events = []
+
+        class Hook(MetricsHook):
+
+            def on_result(self, name: str, errcode: str):
+                events.append((name, errcode))
+
+        bot = DingTalkBot('https://x', session=FakeSession({'errcode': 0}), metrics=Hook(), metrics_name='h')
+        bot.send_text('a')
+        assert events == [('h', '0')]
+        metrics = Metrics()
+        metrics.on_result('b"1', '0')
+        server = metrics.serve(port=0)
+        try:
+            body = urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics', timeout=5).read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert 'msgbot_requests_total{bot="b\\"1",errcode="0"} 1' in body
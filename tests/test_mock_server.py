@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+import requests
+from MsgBot import DingTalkBot, WxComBot, UnlimitedRateLimiter
+from MsgBot.ding_talk_bot import Signer
+from MsgBot.exceptions import DingTalkError, WxComError
+from MsgBot.mock_server import MockServer, DING_TALK_THROTTLED, DING_TALK_SIGN_ERROR, WX_COM_THROTTLED
+
+
+@pytest.fixture
+def server():
+    with MockServer(rate_limit=3, corp_secret='secret') as server:
+        yield server
+
+
+class TestMockServer(object):
+
+    def test_ding_talk_send(self, server):
+        with DingTalkBot(server.web_hook('alert')) as bot:
+            assert bot.send_text('hello', at_mobiles=['13800000000'])['errcode'] == 0
+        assert server.received[0][:2] == ('/robot/send', 'alert')
+        assert server.received[0][2]['at']['atMobiles'] == ['13800000000']
+        assert server.connections == 1
+
+    def test_ding_talk_throttled(self, server):
+        with DingTalkBot(server.web_hook('alert'), rate_limiter=UnlimitedRateLimiter()) as bot:
+            for i in range(3):
+                bot.send_text(f'msg {i}')
+            with pytest.raises(DingTalkError) as e:
+                bot.send_text('too fast')
+        assert e.value.errcode == DING_TALK_THROTTLED
+        assert server.responses == {0: 3, DING_TALK_THROTTLED: 1}
+
+    def test_ding_talk_sign(self):
+        with MockServer(ding_talk_secret='SEC123') as server:
+            with DingTalkBot(server.web_hook(), secret='SEC123') as bot:
+                assert bot.send_text('signed')['errcode'] == 0
+            with DingTalkBot(server.web_hook(), secret='SECwrong') as bot:
+                with pytest.raises(DingTalkError) as e:
+                    bot.send_text('signed')
+        assert e.value.errcode == DING_TALK_SIGN_ERROR
+        assert Signer(server.web_hook(), 'SEC123').url().startswith(server.url)
+
+    def test_inject(self, server):
+        server.inject(500001, count=2, path='/robot/send')
+        with DingTalkBot(server.web_hook()) as bot:
+            for _ in range(2):
+                with pytest.raises(DingTalkError):
+                    bot.send_text('hi')
+            assert bot.send_text('hi')['errcode'] == 0
+
+    def test_wx_com_send(self, server):
+        with WxComBot('corp_id', 'secret', api_base=server.url) as bot:
+            assert bot.send_msg_text(agent_id=1, content='hi', to_user='u1')['errcode'] == 0
+            # token 失效后自动刷新并重发
+            server.expire_tokens()
+            assert bot.send_msg_md(agent_id=1, content='**hi**', to_user='u1')['errcode'] == 0
+            assert server.responses[42001] == 1
+            for _ in range(2):
+                bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+            with pytest.raises(WxComError) as e:
+                bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+        assert e.value.errcode == WX_COM_THROTTLED
+
+    def test_wx_com_bad_secret(self, server):
+        with WxComBot('corp_id', 'wrong', api_base=server.url) as bot:
+            with pytest.raises(WxComError) as e:
+                bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+        assert e.value.errcode == 40001
+
+    def test_latency_and_unknown_path(self):
+        with MockServer(latency=lambda path: 0.05 if path == '/robot/send' else 0) as server:
+            r = requests.post(f'{server.url}/unknown', data=b'{}', timeout=5)
+            assert r.status_code == 404
+            r = requests.post(server.web_hook(), data=b'not json', timeout=5)
+            assert r.elapsed.total_seconds() >= 0.05
+            assert json.loads(r.content)['errcode'] == 40035
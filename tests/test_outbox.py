@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+from time import monotonic
+from MsgBot import DingTalkBot
+from MsgBot.outbox import Outbox, CLOSE_TIMEOUT
+from MsgBot.mock_server import MockServer
+from MsgBot.exceptions import SendError, DingTalkError
+
+
+class FakeBot(object):
+
+    def __init__(self, failures: int = 0):
+        self.sent = []
+        self.failures = failures
+
+    def send_text(self, content: str, at_all=False):
+        if content == 'bad':
+            raise DingTalkError('keywords not in content', errcode=310000)
+        if self.failures:
+            self.failures -= 1
+            raise SendError('connection reset')
+        self.sent.append(content)
+        return {'errcode': 0}
+
+
+def rows(path: str) -> list:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT status FROM outbox ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+class TestOutbox(object):
+
+    def test_deliver_in_order_with_retry(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        bot = FakeBot(failures=3)
+        with Outbox(bot, path, retry_interval=0.01) as outbox:
+            ids = [outbox.send_text(str(i)) for i in range(20)]
+            assert outbox.flush(timeout=10)
+        assert ids == list(range(1, 21))
+        assert bot.sent == [str(i) for i in range(20)]
+
+    def test_concurrent_group_commit(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        bot = FakeBot()
+        outbox = Outbox(bot, path, commit_interval=0.01)
+        threads = [threading.Thread(target=lambda n=n: [outbox.send_text(f'{n}-{i}') for i in range(25)])
+                   for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert outbox.flush(timeout=10)
+        outbox.close()
+        assert sorted(bot.sent) == sorted(f'{n}-{i}' for n in range(8) for i in range(25))
+
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        outbox = Outbox(FakeBot(failures=10 ** 6), path, retry_interval=60)
+        for i in range(5):
+            outbox.send_text(str(i), at_all=True)
+        outbox.close(timeout=0)
+        assert rows(path) == [(0,)] * 5
+        bot = FakeBot()
+        with Outbox(bot, path) as outbox:
+            assert outbox.flush(timeout=10)
+        assert bot.sent == [str(i) for i in range(5)]
+
+    def test_close_during_outage(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        # 端口拒绝连接，消息无法投递
+        bot = DingTalkBot('http://127.0.0.1:1/robot/send?access_token=x')
+        start = monotonic()
+        with Outbox(bot, path, retry_interval=0.01) as outbox:
+            outbox.send_text('down')
+        # 默认只等待 CLOSE_TIMEOUT 秒，不会阻塞进程退出
+        assert monotonic() - start < CLOSE_TIMEOUT + 2
+        assert rows(path) == [(0,)]
+
+    def test_close_with_hanging_delivery(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        # 平台一直不响应，投递中的请求不能让 close 超出 timeout
+        with MockServer(latency=30) as server:
+            bot = DingTalkBot(server.web_hook())
+            outbox = Outbox(bot, path)
+            outbox.send_text('hang')
+            start = monotonic()
+            outbox.close(timeout=0.5)
+            assert monotonic() - start < 2
+            assert rows(path) == [(0,)]
+
+    def test_dead_letter_and_compact(self, tmp_path):
+        path = str(tmp_path / 'outbox.db')
+        bot = FakeBot()
+        with Outbox(bot, path) as outbox:
+            outbox.send_text('ok')
+            outbox.send_text('bad')
+            outbox.send_text('ok again')
+            assert outbox.flush(timeout=10)
+            assert [row[0] for row in outbox.dead_letters()] == [2]
+            outbox.compact()
+        assert bot.sent == ['ok', 'ok again']
+        assert rows(path) == [(2,)]
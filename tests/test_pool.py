@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+import pytest
+from MsgBot import DingTalkBot, DingTalkBotPool
+from MsgBot.exceptions import DingTalkError
+from tests.fakes import FakeSession
+
+
+class PoolSession(FakeSession):
+    """
+    throttled 中的 access_token 始终返回 130101
+    """
+
+    def __init__(self, throttled=()):
+        super().__init__()
+        self.throttled = set(throttled)
+
+    def respond(self, url: str, form_data: dict) -> dict:
+        if url.split('access_token=')[1] in self.throttled:
+            return {'errcode': 130101, 'errmsg': 'send too fast'}
+        return {'errcode': 0, 'errmsg': 'ok'}
+
+    def counts(self) -> Counter:
+        return Counter(url.split('access_token=')[1] for url, _ in self.posts)
+
+
+def make_pool(session, n: int, **kwargs) -> DingTalkBotPool:
+    bots = [DingTalkBot(f'https://oapi.dingtalk.com/robot/send?access_token={i}', session=session) for i in range(n)]
+    return DingTalkBotPool(bots, **kwargs)
+
+
+class TestDingTalkBotPool(object):
+
+    def test_least_loaded(self):
+        session = PoolSession()
+        pool = make_pool(session, 3)
+        for i in range(60):
+            pool.send_text(f'message {i}')
+        assert session.counts() == {'0': 20, '1': 20, '2': 20}
+        stats = pool.stats()
+        assert stats['sent'] == stats['per_minute'] == 60
+        assert stats['capacity_per_minute'] == 60
+        assert all(b['remaining'] == 0 for b in stats['bots'])
+
+    def test_round_robin(self):
+        session = PoolSession()
+        pool = make_pool(session, 3, strategy=DingTalkBotPool.ROUND_ROBIN)
+        for i in range(6):
+            pool.send_markdown('title', f'message {i}')
+        assert session.counts() == {'0': 2, '1': 2, '2': 2}
+
+    def test_failover(self):
+        session = PoolSession(throttled={'0'})
+        pool = make_pool(session, 2)
+        for i in range(5):
+            assert pool.send_text(f'message {i}')['errcode'] == 0
+        # 被限流的机器人进入冷却，之后不再使用
+        assert session.counts() == {'0': 1, '1': 5}
+        stats = pool.stats()
+        assert stats['throttled'] == 1 and stats['bots'][0]['cooling'] > 0
+
+    def test_all_throttled(self):
+        session = PoolSession(throttled={'0', '1'})
+        pool = make_pool(session, 2)
+        with pytest.raises(DingTalkError):
+            pool.send_text('message')
+        assert pool.stats()['throttled'] == 2
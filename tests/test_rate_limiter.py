@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import stat
+import tempfile
+import threading
+import pytest
+from MsgBot import DingTalkBot
+from MsgBot.exceptions import RateLimitError
+from MsgBot.rate_limiter import SlidingWindowRateLimiter, TokenBucketRateLimiter, FileWindowBackend
+from tests.fakes import FakeClock
+
+
+class TestSlidingWindow(object):
+
+    def test_limit_in_window(self):
+        clock = FakeClock(1000.0)
+        limiter = SlidingWindowRateLimiter(20, 60, clock=clock, sleep=clock.sleep)
+        for i in range(20):
+            assert limiter.try_acquire() == 0
+            clock.now += 1
+        assert limiter.remaining() == 0
+        # 第 1 次占用发生在 1000 ，窗口在 1060 才空出
+        assert limiter.try_acquire() == limiter.time_until_next() == 40
+        clock.now = 1060
+        assert limiter.remaining() == 1
+        assert limiter.try_acquire() == 0
+        assert limiter.try_acquire() == 1
+
+    def test_acquire_waits_exactly(self):
+        clock = FakeClock(1000.0)
+        limiter = SlidingWindowRateLimiter(3, 10, clock=clock, sleep=clock.sleep)
+        stamps = []
+        for _ in range(9):
+            assert limiter.acquire()
+            stamps.append(clock.now)
+        assert stamps == [1000] * 3 + [1010] * 3 + [1020] * 3
+        assert not limiter.acquire(timeout=9.9)
+        assert clock.now == 1020
+        assert limiter.acquire(timeout=10)
+
+    def test_thread_safe(self):
+        clock = FakeClock(1000.0)
+        limiter = SlidingWindowRateLimiter(20, 60, clock=clock)
+        acquired = []
+
+        def worker():
+            for _ in range(50):
+                if limiter.try_acquire() == 0:
+                    acquired.append(1)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(acquired) == 20
+
+
+class TestTokenBucket(object):
+
+    def test_burst_then_rate(self):
+        clock = FakeClock(1000.0)
+        limiter = TokenBucketRateLimiter(rate=1, capacity=5, clock=clock, sleep=clock.sleep)
+        for _ in range(5):
+            assert limiter.try_acquire() == 0
+        assert limiter.try_acquire() == 1
+        clock.now += 0.5
+        assert limiter.time_until_next() == 0.5
+        assert limiter.acquire()
+        assert clock.now == 1001
+        clock.now += 100
+        assert limiter.remaining() == 5
+
+
+class TestDingTalkBotRateLimit(object):
+
+    def test_q_timeout(self):
+        clock = FakeClock(1000.0)
+        limiter = SlidingWindowRateLimiter(1, 60, clock=clock, sleep=clock.sleep)
+        limiter.try_acquire()
+        bot = DingTalkBot('http://127.0.0.1:1/robot/send?access_token=x', rate_limiter=limiter)
+        with pytest.raises(RateLimitError):
+            bot.send_text('test', q_timeout=30)
+        assert clock.now == 1000
+
+
+class TestSharedWindow(object):
+
+    def test_instances_share_window(self, tmp_path):
+        clock = FakeClock(1000.0)
+        limiters = [SlidingWindowRateLimiter.shared('web_hook', 5, 60, directory=str(tmp_path)) for _ in range(3)]
+        for limiter in limiters:
+            limiter.clock = clock
+        assert [limiters[i % 3].try_acquire() for i in range(5)] == [0] * 5
+        assert all(limiter.try_acquire() == 60 for limiter in limiters)
+        assert limiters[0].remaining() == 0
+        clock.now += 60
+        assert limiters[2].remaining() == 5
+        assert limiters[1].try_acquire() == 0
+        # 不同 key 互不影响
+        other = SlidingWindowRateLimiter.shared('other_web_hook', 5, 60, directory=str(tmp_path))
+        assert other.remaining() == 5
+
+    def test_limit_changed(self, tmp_path):
+        path = str(tmp_path / 'window.bin')
+        clock = FakeClock(1000.0)
+        SlidingWindowRateLimiter(2, 60, clock=clock, backend=FileWindowBackend(path)).try_acquire()
+        limiter = SlidingWindowRateLimiter(3, 60, clock=clock, backend=FileWindowBackend(path))
+        assert limiter.remaining() == 3
+
+    def test_private_state_file(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+        limiter = SlidingWindowRateLimiter.shared('web_hook', 5, 60)
+        directory = os.path.dirname(limiter.backend.path)
+        assert directory == str(tmp_path / f'msgbot-ratelimit-{os.getuid()}')
+        assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+        assert stat.S_IMODE(os.stat(limiter.backend.path).st_mode) == 0o600
+
+    def test_refuse_symlink(self, tmp_path, monkeypatch):
+        # 他人预先放置的符号链接不能把窗口状态写到其他文件
+        target = tmp_path / 'target'
+        target.write_bytes(b'')
+        os.symlink(target, tmp_path / 'window.bin')
+        with pytest.raises(OSError):
+            FileWindowBackend(str(tmp_path / 'window.bin'))
+        (tmp_path / 'fake-dir').mkdir()
+        os.symlink(tmp_path / 'fake-dir', tmp_path / f'msgbot-ratelimit-{os.getuid()}')
+        monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+        with pytest.raises(PermissionError):
+            SlidingWindowRateLimiter.shared('web_hook', 5, 60)
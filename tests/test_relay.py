@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import threading
+import pytest
+from MsgBot.cli import main, EXIT_OK
+from MsgBot.exceptions import DingTalkError, SendError
+from MsgBot.mock_server import MockServer
+from MsgBot.relay import RelayServer, RelayClient, send_frame, recv_frame, _check_peer
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='requires Unix domain sockets')
+
+
+@pytest.fixture
+def mock():
+    with MockServer(rate_limit=3, corp_secret='secret') as server:
+        yield server
+
+
+@pytest.fixture
+def relay(tmp_path):
+    with RelayServer(str(tmp_path / 'relay.sock'), outbox_dir=str(tmp_path / 'outbox')) as server:
+        yield server
+
+
+class TestRelay(object):
+
+    def test_frame_roundtrip(self):
+        a, b = socket.socketpair()
+        with a, b:
+            send_frame(a, {'content': '你好' * 1000})
+            assert recv_frame(b) == {'content': '你好' * 1000}
+            a.close()
+            assert recv_frame(b) is None
+
+    def test_shared_bot_and_rate_limit(self, mock, relay):
+        clients = [RelayClient('dingtalk', relay.socket_path, web_hook=mock.web_hook('shared')) for _ in range(3)]
+        threads = [threading.Thread(target=client.send_text, args=(f'msg {i}',)) for i, client in enumerate(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(relay._bots) == 1
+        assert oct(os.stat(relay.socket_path).st_mode & 0o777) == '0o600'
+        # 所有客户端共用中继服务中的机器人，服务端返回的错误原样抛出
+        mock.inject(310000)
+        with pytest.raises(DingTalkError) as e:
+            clients[0].send_text('fail')
+        assert e.value.errcode == 310000
+        assert len(mock.received) == 3
+        for client in clients:
+            client.close()
+
+    def test_wx_com_single_token(self, mock, relay):
+        for _ in range(2):
+            with RelayClient('wx_com', relay.socket_path, corp_id='corp', corp_secret='secret',
+                             api_base=mock.url) as client:
+                assert client.send_msg_text(agent_id=1, content='hi', to_user='u1')['errcode'] == 0
+        # 两个客户端复用中继服务获取的同一个 token
+        assert len({token for _, token, _ in mock.received}) == 1
+
+    def test_durable(self, mock, relay):
+        with RelayClient('dingtalk', relay.socket_path, durable=True, web_hook=mock.web_hook()) as client:
+            assert 'queued' in client.send_text('queued')
+        assert relay.outbox('dingtalk', {'web_hook': mock.web_hook()}).flush(timeout=5)
+        assert mock.received[0][2]['text']['content'] == 'queued'
+
+    def test_durable_requires_outbox(self, mock, tmp_path):
+        with RelayServer(str(tmp_path / 'relay.sock')) as relay:
+            with RelayClient('dingtalk', relay.socket_path, durable=True, web_hook=mock.web_hook()) as client:
+                with pytest.raises(ValueError):
+                    client.send_text('queued')
+        assert not mock.received
+
+    def test_bulk_result(self, mock, relay):
+        with RelayClient('wx_com', relay.socket_path, corp_id='corp', corp_secret='secret',
+                         api_base=mock.url) as client:
+            result = client.send_bulk([1, 2], 'hi', users=['u1', 'u2'])
+        assert result['ok'] and len(result['items']) == 2
+        assert result['items'][0]['response']['errcode'] == 0 and result['invalid_users'] == []
+
+    def test_unencodable_result(self, relay, monkeypatch):
+        # 结果无法序列化时返回错误，连接仍可继续使用
+        monkeypatch.setattr(relay, 'handle', lambda request: {'ok': True, 'result': object()})
+        with RelayClient('dingtalk', relay.socket_path, fallback=False, web_hook='x') as client:
+            with pytest.raises(TypeError):
+                client.send_text('hi')
+            monkeypatch.undo()
+            assert client.ping()
+
+    def test_fallback(self, mock, tmp_path):
+        path = str(tmp_path / 'absent.sock')
+        with RelayClient('dingtalk', path, web_hook=mock.web_hook()) as client:
+            assert not client.ping()
+            assert client.send_text('direct')['errcode'] == 0
+        with RelayClient('dingtalk', path, fallback=False, web_hook=mock.web_hook()) as client:
+            with pytest.raises(SendError):
+                client.send_text('direct')
+        assert len(mock.received) == 1
+
+    def test_reconnect_after_restart(self, mock, tmp_path):
+        path = str(tmp_path / 'relay.sock')
+        client = RelayClient('dingtalk', path, fallback=False, web_hook=mock.web_hook())
+        with RelayServer(path):
+            assert client.ping()
+        with RelayServer(path) as relay:
+            assert client.send_text('again')['errcode'] == 0
+            assert relay.requests == 1
+        client.close()
+
+    def test_private_default_dir(self, tmp_path, monkeypatch):
+        monkeypatch.delenv('MSGBOT_RELAY_SOCKET', raising=False)
+        monkeypatch.setattr('tempfile.gettempdir', lambda: str(tmp_path))
+        with RelayServer() as relay:
+            assert os.path.dirname(relay.socket_path).startswith(str(tmp_path))
+            assert oct(os.stat(os.path.dirname(relay.socket_path)).st_mode & 0o777) == '0o700'
+        # 目录被其他用户抢先创建
+        uid = os.getuid()
+        monkeypatch.setattr('os.getuid', lambda: uid + 1)
+        with pytest.raises(PermissionError):
+            RelayServer().start()
+
+    def test_reject_foreign_socket(self, mock, relay, monkeypatch):
+        # 套接字属于其他用户时，不向其发送请求
+        uid = os.getuid()
+        monkeypatch.setattr('os.getuid', lambda: uid + 1)
+        with RelayClient('dingtalk', relay.socket_path, fallback=False, web_hook=mock.web_hook()) as client:
+            with pytest.raises(SendError):
+                client.send_text('secret')
+        with RelayClient('dingtalk', relay.socket_path, web_hook=mock.web_hook()) as client:
+            assert client.send_text('direct')['errcode'] == 0
+        assert relay.requests == 0 and len(mock.received) == 1
+        with pytest.raises(PermissionError):
+            RelayServer(relay.socket_path).start()
+
+    @pytest.mark.skipif(not hasattr(socket, 'SO_PEERCRED'), reason='requires SO_PEERCRED')
+    def test_check_peer(self, monkeypatch):
+        a, b = socket.socketpair()
+        with a, b:
+            _check_peer(a)
+            uid = os.getuid()
+            monkeypatch.setattr('os.getuid', lambda: uid + 1)
+            with pytest.raises(PermissionError):
+                _check_peer(a)
+
+    def test_reject(self, relay):
+        with pytest.raises(ValueError):
+            RelayClient('dingtalk', relay.socket_path, token_cache='/tmp/x', web_hook='x')
+        response = relay.handle({'channel': 'dingtalk', 'config': {'web_hook': 'x'}, 'method': 'close'})
+        assert response['error']['type'] == 'AttributeError'
+
+    def test_cli_relay(self, mock, relay):
+        args = ['dingtalk', '--relay', '--relay-socket', relay.socket_path, '--web-hook', mock.web_hook(), 'hi']
+        assert main(args) == EXIT_OK
+        assert relay.requests == 1 and len(mock.received) == 1
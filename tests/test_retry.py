@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import pytest
+from MsgBot import DingTalkBot
+from MsgBot.retry import RetryPolicy, CircuitBreaker, classify, NETWORK, THROTTLE, AUTH, PERMANENT
+from MsgBot.exceptions import SendError, RateLimitError, DingTalkError, WxComError, CircuitOpenError
+from MsgBot.mock_server import MockServer, GATEWAY_ERROR
+from tests.fakes import FakeClock, FakeSession
+
+
+class Flaky(object):
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestRetry(object):
+
+    def test_classify(self):
+        assert classify(SendError()) == NETWORK
+        assert classify(DingTalkError(errcode=-1)) == NETWORK
+        assert classify(RateLimitError()) == THROTTLE
+        assert classify(DingTalkError(errcode=130101)) == THROTTLE
+        assert classify(WxComError(errcode=45009)) == THROTTLE
+        assert classify(DingTalkError(errcode=310000)) == AUTH
+        assert classify(WxComError(errcode=42001)) == AUTH
+        assert classify(ValueError()) == PERMANENT
+        assert classify(WxComError(errcode=40003)) == PERMANENT
+
+    def test_backoff(self):
+        sleeps = []
+        policy = RetryPolicy(max_attempts=4, backoff=1, jitter=False, throttle_wait=60, circuit_breaker=False,
+                             sleep=sleeps.append)
+        func = Flaky(SendError(), WxComError(errcode=45009), SendError())
+        assert policy.call(func) == 'ok'
+        assert sleeps == [1, 60, 4]
+        # 钉钉 130101 会封禁 10 分钟，不重试
+        func = Flaky(DingTalkError(errcode=130101))
+        with pytest.raises(DingTalkError):
+            policy.call(func)
+        assert func.calls == 1
+        policy.jitter = True
+        assert all(0 <= policy.delay(3, NETWORK) <= 4 for _ in range(100))
+
+    def test_no_retry(self):
+        policy = RetryPolicy(circuit_breaker=False, sleep=lambda s: None)
+        func = Flaky(DingTalkError(errcode=310000))
+        with pytest.raises(DingTalkError):
+            policy.call(func)
+        assert func.calls == 1
+        func = Flaky(*[SendError()] * 3)
+        with pytest.raises(SendError):
+            policy.call(func)
+        assert func.calls == 3
+
+    def test_max_elapsed(self):
+        policy = RetryPolicy(max_elapsed=30, circuit_breaker=False, sleep=lambda s: None)
+        func = Flaky(RateLimitError())
+        with pytest.raises(RateLimitError):
+            policy.call(func)
+        assert func.calls == 1
+
+    def test_circuit_breaker(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+        clock.now = 30
+        assert breaker.allow() and not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        clock.now = 60
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_shared_breaker_fails_fast(self):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=2, sleep=lambda s: None)
+        for _ in range(2):
+            with pytest.raises(SendError):
+                policy.call(Flaky(SendError()), key='test_shared_breaker')
+        func = Flaky()
+        with pytest.raises(CircuitOpenError):
+            RetryPolicy().call(func, key='test_shared_breaker')
+        assert func.calls == 0
+
+    def test_local_rate_limit_not_counted(self):
+        # 客户端限流器等待超时不计入共享的熔断器
+        policy = RetryPolicy(max_attempts=1, failure_threshold=2, sleep=lambda s: None)
+        for _ in range(5):
+            with pytest.raises(RateLimitError):
+                policy.call(Flaky(RateLimitError()), key='test_local_rate_limit')
+        assert policy.breaker_for('test_local_rate_limit').state == CircuitBreaker.CLOSED
+
+    def test_trial_released_on_local_rate_limit(self):
+        # 半开状态的试探请求被客户端限流拦下时，熔断器不能一直停在熔断状态
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=30, sleep=lambda s: None)
+        breaker = policy.breaker_for('test_trial_rate_limit')
+        breaker.clock = clock = FakeClock()
+        with pytest.raises(SendError):
+            policy.call(Flaky(SendError()), key='test_trial_rate_limit')
+        clock.now = 30
+        with pytest.raises(RateLimitError):
+            policy.call(Flaky(RateLimitError()), key='test_trial_rate_limit')
+        assert policy.call(Flaky(), key='test_trial_rate_limit') == 'ok'
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_release_trial_by_owner_only(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        assert breaker.acquire() == 0
+        breaker.record_failure()
+        clock.now = 30
+        trial = breaker.acquire()
+        assert trial and breaker.acquire() is None
+        # 不持有名额的请求交还时不能放行第二个试探请求
+        breaker.release_trial(0)
+        breaker.release_trial(trial + 1)
+        assert not breaker.allow()
+        breaker.release_trial(trial)
+        assert breaker.allow()
+
+    def test_trial_kept_when_other_call_ends(self):
+        # 熔断前发起的请求在其他请求持有试探名额时结束，不能交还别人的名额
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=30, sleep=lambda s: None)
+        breaker = policy.breaker_for('test_trial_owner')
+        breaker.clock = clock = FakeClock()
+        trials = []
+
+        def func():
+            breaker.record_failure()
+            clock.now = 30
+            trials.append(breaker.acquire())
+            raise RateLimitError()
+
+        with pytest.raises(RateLimitError):
+            policy.call(func, key='test_trial_owner')
+        assert trials[0] and not breaker.allow()
+        with pytest.raises(CircuitOpenError):
+            policy.call(Flaky(), key='test_trial_owner')
+
+    def test_trial_released_on_interrupt(self):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=30, sleep=lambda s: None)
+        breaker = policy.breaker_for('test_trial_interrupt')
+        breaker.clock = clock = FakeClock()
+        with pytest.raises(SendError):
+            policy.call(Flaky(SendError()), key='test_trial_interrupt')
+        clock.now = 30
+        with pytest.raises(KeyboardInterrupt):
+            policy.call(Flaky(KeyboardInterrupt()), key='test_trial_interrupt')
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(policy.acall(cancelled, key='test_trial_interrupt'))
+        assert policy.call(Flaky(), key='test_trial_interrupt') == 'ok'
+        assert breaker.state == CircuitBreaker.CLOSED
+
+
+class TestBotRetry(object):
+
+    def test_ding_talk_retry(self):
+        session = FakeSession(*[ConnectionError('connection reset by peer')] * 2)
+        policy = RetryPolicy(max_attempts=3, sleep=lambda s: None)
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=retry', session=session,
+                          retry_policy=policy)
+        assert bot.send_text('hello')['errcode'] == 0
+        assert len(session.posts) == 3
+        # 每次尝试都是一次真实请求，均占用限流名额
+        assert bot.rate_limiter.remaining() == 17
+
+    def test_circuit_open_hides_access_token(self):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, sleep=lambda s: None)
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=leak', session=FakeSession(ConnectionError('reset')),
+                          retry_policy=policy)
+        with pytest.raises(SendError):
+            bot.send_text('hello')
+        with pytest.raises(CircuitOpenError) as e:
+            bot.send_text('hello')
+        assert 'leak' not in str(e.value) and bot.metrics_name in str(e.value)
+
+    def test_gateway_error_page(self):
+        # 网关返回的 HTML 错误页是暂时性错误：重试，并计入熔断
+        with MockServer() as server:
+            policy = RetryPolicy(max_attempts=2, failure_threshold=2, sleep=lambda s: None)
+            with DingTalkBot(server.web_hook('gateway'), retry_policy=policy) as bot:
+                server.inject(GATEWAY_ERROR)
+                assert bot.send_text('hello')['errcode'] == 0
+                server.inject(GATEWAY_ERROR, count=2)
+                with pytest.raises(SendError) as e:
+                    bot.send_text('hello')
+                assert 'HTTP 502' in str(e.value) and '502 Bad Gateway' in str(e.value)
+                assert policy.breaker_for(bot.circuit_key).state == CircuitBreaker.OPEN
+        assert server.responses[GATEWAY_ERROR] == 3
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import threading
+import pytest
+from concurrent.futures import CancelledError
+from MsgBot import AsyncDingTalkBot, DingTalkBot, DingTalkBotPool, WxComWebhookBot
+from MsgBot.scheduler import PriorityScheduler
+from MsgBot.rate_limiter import SlidingWindowRateLimiter
+from MsgBot.mock_server import MockServer
+from tests.fakes import FakeClock
+
+
+class FakeBot(object):
+
+    def __init__(self, limit: int = 100):
+        self.sent = []
+        self.clock = FakeClock()
+        self.rate_limiter = SlidingWindowRateLimiter(limit, 60, clock=self.clock)
+        # gate 未 set 时发送阻塞，便于构造消息排队的场景
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def send_text(self, content: str, at_mobiles: list = None, at_all=False):
+        self.gate.wait()
+        assert self.rate_limiter.try_acquire() == 0
+        self.sent.append(content)
+        return {'errcode': 0, 'content': content}
+
+    def send_markdown(self, title: str, text: str, at_mobiles: list = None, at_all=False):
+        self.gate.wait()
+        assert self.rate_limiter.try_acquire() == 0
+        self.sent.append((title, text, at_mobiles))
+        return {'errcode': 0, 'title': title}
+
+
+class TestPriorityScheduler(object):
+
+    def test_priority_order(self):
+        bot = FakeBot()
+        bot.gate.clear()
+        with PriorityScheduler(bot) as scheduler:
+            scheduler.send_text('first')
+            while scheduler.qsize():
+                pass
+            low, normal = scheduler.send_text('low', priority='low'), scheduler.send_text('normal')
+            high = scheduler.send_text('high', priority=PriorityScheduler.HIGH)
+            assert scheduler.qsize() == 3 and scheduler.qsize('low') == 1
+            bot.gate.set()
+            assert low.result(timeout=5)['content'] == 'low'
+        assert bot.sent == ['first', 'high', 'normal', 'low']
+        assert scheduler.processed == {0: 1, 1: 2, 2: 1}
+        with pytest.raises(ValueError):
+            scheduler.submit('send_text', 'x', priority='urgent')
+
+    def test_reserve_budget(self):
+        bot = FakeBot(limit=6)
+        scheduler = PriorityScheduler(bot, reserve={PriorityScheduler.NORMAL: 2, PriorityScheduler.LOW: 4},
+                                      poll_interval=0.01)
+        futures = [scheduler.send_text(f'low {i}', priority='low') for i in range(5)]
+        futures[1].result(timeout=5)
+        normal = scheduler.send_text('normal')
+        normal.result(timeout=5)
+        # 低优先级只能占用 2 个名额，普通优先级只能再占用 2 个，其余名额留给高优先级
+        assert scheduler.send_text('high 1', priority='high').result(timeout=5)
+        assert scheduler.send_text('high 2', priority='high').result(timeout=5)
+        assert bot.sent == ['low 0', 'low 1', 'normal', 'high 1', 'high 2']
+        assert scheduler.qsize('low') == 3
+        # 窗口过去后剩余的低优先级消息继续发送
+        bot.clock.now = 60
+        futures[3].result(timeout=5)
+        assert scheduler.qsize('low') == 1
+        bot.clock.now = 120
+        assert scheduler.flush(timeout=5)
+        scheduler.shutdown()
+        assert bot.sent[5:] == ['low 2', 'low 3', 'low 4']
+
+    def test_drop_on_high(self):
+        bot = FakeBot(limit=2)
+        scheduler = PriorityScheduler(bot, on_high=PriorityScheduler.DROP, poll_interval=0.01)
+        futures = [scheduler.send_text(f'low {i}', priority='low') for i in range(3)]
+        assert scheduler.send_text('high', priority='high').result(timeout=5)
+        for future in futures:
+            with pytest.raises(CancelledError):
+                future.result(timeout=5)
+        assert bot.sent == ['high'] and scheduler.dropped == 3
+        scheduler.shutdown()
+
+    def test_coalesce_on_high(self):
+        clock = FakeClock()
+        with MockServer(rate_limit=None) as server:
+            bot = DingTalkBot(server.web_hook(), rate_limiter=SlidingWindowRateLimiter(11, 60, clock=clock))
+            # 剩余名额不多于低优先级的预留数，低优先级消息留在队列中
+            bot.rate_limiter.try_acquire()
+            scheduler = PriorityScheduler(bot, on_high=PriorityScheduler.COALESCE, poll_interval=0.01)
+            futures = [scheduler.send_text('disk full', priority='low'),
+                       scheduler.send_text('disk full', priority='low'),
+                       scheduler.send_markdown('cpu', 'high load', at_mobiles=['156'], priority='low'),
+                       scheduler.send_text(content='unbound', unknown=1, priority='low')]
+            scheduler.send_text('high', priority='high').result(timeout=5)
+            clock.now = 60
+            results = [future.result(timeout=5) for future in futures[:3]]
+            # 参数无法绑定的消息不参与合并，留在队列中
+            assert scheduler.qsize('low') == 1
+            scheduler.shutdown(wait=False)
+            payloads = [payload for _, _, payload in server.received]
+        assert payloads[0]['text']['content'] == 'high' and len(payloads) == 2
+        text = payloads[1]['markdown']['text']
+        assert 'disk full **（×2）**' in text and '**cpu**\n\nhigh load' in text
+        assert payloads[1]['at']['atMobiles'] == ['156']
+        assert all(result['errcode'] == 0 for result in results) and scheduler.coalesced == 3
+
+    def test_coalesce_keeps_timeouts(self):
+        sent = []
+
+        class RecordingBot(DingTalkBot):
+
+            def send_text(self, content, at_mobiles=None, at_all=False, q_timeout=60, r_timeout=60):
+                sent.append(('text', content, q_timeout, r_timeout))
+                return {'errcode': 0}
+
+            def send_markdown(self, title, text, at_mobiles=None, at_all=False, q_timeout=60, r_timeout=60):
+                sent.append(('markdown', title, q_timeout, r_timeout))
+                return {'errcode': 0}
+
+        clock = FakeClock()
+        bot = RecordingBot('https://oapi.dingtalk.com/robot/send?access_token=x',
+                           rate_limiter=SlidingWindowRateLimiter(11, 60, clock=clock))
+        # 剩余名额不多于低优先级的预留数，低优先级消息留在队列中
+        bot.rate_limiter.try_acquire()
+        scheduler = PriorityScheduler(bot, on_high=PriorityScheduler.COALESCE, poll_interval=0.01)
+        futures = [scheduler.send_text('a', r_timeout=5, priority='low'),
+                   scheduler.send_text('b', r_timeout=10, q_timeout=3, priority='low'),
+                   scheduler.send_markdown('c', 'd', priority='low')]
+        scheduler.send_text('high', priority='high').result(timeout=5)
+        scheduler.reserve[PriorityScheduler.LOW] = 0
+        assert all(future.result(timeout=5) for future in futures)
+        scheduler.shutdown()
+        # 汇总消息使用各条消息中最小的超时，未指定的保持默认值
+        assert sent == [('text', 'high', 60, 60), ('markdown', scheduler.digest_title, 3, 5)]
+
+    def test_bind_low_once(self, monkeypatch):
+        # 低优先级消息只在入队时解析一次参数，之后每条高优先级消息到达时不再重复解析
+        calls = []
+        digest_item = PriorityScheduler._digest_item
+        monkeypatch.setattr(PriorityScheduler, '_digest_item',
+                            lambda self, *args: calls.append(args) or digest_item(self, *args))
+        clock = FakeClock()
+        with MockServer(rate_limit=None) as server:
+            bot = DingTalkBot(server.web_hook(), rate_limiter=SlidingWindowRateLimiter(11, 60, clock=clock))
+            bot.rate_limiter.try_acquire()
+            scheduler = PriorityScheduler(bot, on_high=PriorityScheduler.COALESCE, poll_interval=0.01)
+            for i in range(5):
+                scheduler.send_text(f'low {i}', priority='low')
+            for i in range(3):
+                scheduler.send_text(f'high {i}', priority='high').result(timeout=5)
+            assert len(calls) == 5 and scheduler.coalesced == 5
+            scheduler.shutdown(wait=False)
+
+    def test_reject_async_bot(self):
+        pytest.importorskip('aiohttp')
+        with MockServer() as server:
+            bot = AsyncDingTalkBot(server.web_hook())
+            with pytest.raises(TypeError):
+                PriorityScheduler(bot)
+
+            class Wrapper(object):
+                # 非 AsyncChannel 的包装，send_text 同样返回协程
+                send_text = bot.send_text
+
+            scheduler = PriorityScheduler(Wrapper())
+            with pytest.raises(TypeError):
+                scheduler.send_text('hello', priority='high').result(timeout=5)
+            scheduler.shutdown()
+            assert not server.received
+
+    @pytest.mark.parametrize('make_bot', [
+        lambda server: WxComWebhookBot(server.wx_com_web_hook()),
+        lambda server: DingTalkBotPool([server.web_hook('a'), server.web_hook('b')]),
+    ], ids=['wx_com_webhook', 'pool'])
+    def test_coalesce_other_bots(self, make_bot):
+        # 非 DingTalkBot 不合并，高优先级消息照常入队，低优先级消息保持原样发送
+        with MockServer(rate_limit=None, latency=0.2) as server:
+            scheduler = PriorityScheduler(make_bot(server), on_high=PriorityScheduler.COALESCE, reserve={},
+                                          poll_interval=0.01)
+            busy = scheduler.send_markdown('busy', priority='high') if isinstance(scheduler.bot, WxComWebhookBot) \
+                else scheduler.send_markdown('busy', 'busy', priority='high')
+            while scheduler.qsize():
+                pass
+            low = [scheduler.send_text(f'low {i}', priority='low') for i in range(2)]
+            high = scheduler.send_text('high', priority='high')
+            assert scheduler.flush(timeout=5) and scheduler.coalesced == 0
+            scheduler.shutdown()
+        assert all(future.result()['errcode'] == 0 for future in [busy, high] + low)
+        assert [payload['text']['content'] for _, _, payload in list(server.received)[1:]] == ['high', 'low 0', 'low 1']
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from requests.adapters import HTTPAdapter
+from MsgBot import DingTalkBot, WxComBot
+from MsgBot.session import build_session
+
+
+class TestSession(object):
+
+    def test_build_session(self):
+        session = build_session(pool_maxsize=32, max_retries=2, keep_alive=False)
+        adapter = session.get_adapter('https://oapi.dingtalk.com')
+        assert isinstance(adapter, HTTPAdapter)
+        assert adapter._pool_maxsize == 32
+        assert adapter.max_retries.total == 2
+        assert session.headers['Connection'] == 'close'
+
+    def test_shared_session(self):
+        session = build_session()
+        closed = []
+        session.close = lambda: closed.append(True)
+        with DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x', session=session) as d_bot, \
+                WxComBot('corp_id', 'corp_secret', session=session) as w_bot:
+            assert d_bot.session is w_bot.session is session
+        # 外部传入的 Session 不由机器人关闭
+        assert not closed
+
+    def test_own_session_closed(self):
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x')
+        closed = []
+        bot.session.close = lambda: closed.append(True)
+        with bot:
+            pass
+        assert closed
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import hmac
+import base64
+import hashlib
+from urllib import parse
+import pytest
+from MsgBot import DingTalkBot
+from MsgBot.ding_talk_bot.signer import Signer
+from tests.fakes import FakeClock
+
+WEB_HOOK = 'https://oapi.dingtalk.com/robot/send?access_token=x'
+SECRET = 'SECtest'
+
+
+def reference_sign(timestamp: int) -> str:
+    # 钉钉文档中的签名算法
+    string_to_sign = '{}\n{}'.format(timestamp, SECRET)
+    hmac_code = hmac.new(SECRET.encode('utf-8'), string_to_sign.encode('utf-8'), digestmod=hashlib.sha256).digest()
+    return parse.quote_plus(base64.b64encode(hmac_code))
+
+
+class TestSigner(object):
+
+    def test_sign(self):
+        signer = Signer(WEB_HOOK, SECRET)
+        for timestamp in (1600000000000, 1600000000123):
+            assert signer.sign(timestamp) == reference_sign(timestamp)
+
+    def test_cached_url(self):
+        clock = FakeClock(1600000000.0)
+        signer = Signer(WEB_HOOK, SECRET, ttl=3480, clock=clock)
+        url = signer.url()
+        assert url == f'{WEB_HOOK}&timestamp=1600000000000&sign={reference_sign(1600000000000)}'
+        clock.now += 3479
+        assert signer.url() is url
+        clock.now += 1
+        assert signer.url() == f'{WEB_HOOK}&timestamp=1600003480000&sign={reference_sign(1600003480000)}'
+
+    def test_invalid_secret(self):
+        with pytest.raises(ValueError):
+            Signer(WEB_HOOK, 'secret')
+
+    def test_bot_web_hook(self):
+        assert DingTalkBot(WEB_HOOK).web_hook == WEB_HOOK
+        bot = DingTalkBot(WEB_HOOK, SECRET)
+        assert bot.web_hook.startswith(f'{WEB_HOOK}&timestamp=')
+        assert bot.web_hook is bot.web_hook
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import re
+import logging
+from MsgBot import DingTalkBot, WxComBot
+from MsgBot.splitter import split_text, utf8_len
+
+
+def body(part: str) -> str:
+    # 去掉序号
+    return re.sub(r'^\(\d+/\d+\)\n\n?', '', part)
+
+
+class TestSplitText(object):
+
+    def test_not_split(self):
+        assert split_text('中' * 10, 30) == ['中' * 10]
+
+    def test_prefer_line_break(self):
+        text = '\n'.join(f'line {i:02d} 中文' for i in range(50))
+        parts = split_text(text, 100)
+        assert all(utf8_len(part) <= 100 for part in parts)
+        assert parts[0].startswith(f'(1/{len(parts)})\n')
+        # 每一部分都由完整的行组成
+        assert '\n'.join(body(part) for part in parts) == text
+
+    def test_utf8_boundary(self):
+        text = '中文' * 100 + 'a😀' * 50
+        parts = split_text(text, 64)
+        assert all(utf8_len(part) <= 64 for part in parts)
+        assert ''.join(body(part) for part in parts) == text
+
+    def test_numbering_digits(self):
+        parts = split_text('x' * 2000, 20)
+        assert len(parts) > 99
+        assert all(utf8_len(part) <= 20 for part in parts)
+        assert parts[-1].startswith(f'({len(parts)}/{len(parts)})')
+
+    def test_markdown_code_fence(self):
+        code = '\n'.join(f'    print({i})  # 注释' for i in range(100))
+        text = f'## 异常\n\n```python\n{code}\n```\n\n结束'
+        parts = split_text(text, 300, markdown=True)
+        assert len(parts) > 2
+        for part in parts:
+            assert utf8_len(part) <= 300
+            assert part.count('```') % 2 == 0
+        assert body(parts[1]).startswith('```python\n')
+        assert parts[-1].endswith('```\n\n结束')
+
+
+class TestBotSplit(object):
+
+    def test_ding_talk(self):
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x', max_bytes=200)
+        sent = []
+        bot._send_msg = lambda msg, q_timeout, r_timeout: sent.append(msg) or len(sent)
+        responses = bot.send_markdown('title', '\n\n'.join(f'段落 {i}' for i in range(40)), at_mobiles=['156'])
+        assert responses == [1, 2, 3]
+        assert [msg['markdown']['title'] for msg in sent[:2]] == [f'title (1/{len(sent)})', f'title (2/{len(sent)})']
+        assert ['at' in msg for msg in sent] == [False] * (len(sent) - 1) + [True]
+        assert bot.send_text('short') == 4 and sent[-1]['text']['content'] == 'short'
+
+    def test_wx_com(self, caplog):
+        bot = WxComBot('corp_id', 'corp_secret')
+        sent = []
+        bot._send_msg = lambda form_data, **kwargs: sent.append(form_data)
+        bot.send_msg_text(1, '告警\n' * 1000, to_user='u1')
+        assert len(sent) > 1
+        assert all(form['touser'] == 'u1' and utf8_len(form['text']['content']) <= 2048 for form in sent)
+        # 不拆分时按嵌套的 content 检查长度
+        with caplog.at_level(logging.WARNING):
+            bot._check_form({'touser': 'u1', 'msgtype': 'text', 'text': {'content': '中' * 700}})
+        assert '2048' in caplog.text
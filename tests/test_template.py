@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from MsgBot import DingTalkBot, WxComBot
+from MsgBot import template as template_module
+from MsgBot.template import MessageTemplate, Slot, dumps
+
+
+class TestMessageTemplate(object):
+
+    def test_render(self):
+        template = MessageTemplate({'msgtype': 'text', 'text': {'content': '{host} 使用率 {usage:.0%} {{x}}'},
+                                    'at': {'atMobiles': Slot('mobiles'), 'isAtAll': Slot('all')}})
+        assert template.names == {'host', 'usage', 'mobiles', 'all'}
+        data = template.render({'host': 'db"\n1', 'usage': 0.934}, mobiles=['1'], all=False)
+        assert json.loads(data) == {'msgtype': 'text', 'text': {'content': 'db"\n1 使用率 93% {x}'},
+                                    'at': {'atMobiles': ['1'], 'isAtAll': False}}
+
+    def test_whole_string_slot(self):
+        template = MessageTemplate({'a': '{x}', 'b': [Slot('y'), 1]})
+        assert json.loads(template.render(x=1, y={'k': '中'})) == {'a': '1', 'b': [{'k': '中'}, 1]}
+
+    def test_errors(self):
+        with pytest.raises(ValueError):
+            MessageTemplate({'a': '{0}'})
+        with pytest.raises(KeyError):
+            MessageTemplate({'a': '{x}'}).render()
+
+    def test_std_encoder(self, monkeypatch):
+        # 未安装 orjson 时的输出与 orjson 一致
+        monkeypatch.setattr(template_module, 'dumps', template_module._std_dumps)
+        monkeypatch.setattr(template_module, 'escape', template_module._std_escape)
+        template = MessageTemplate({'a': '{x}\t{y!r}', 'b': Slot('z')})
+        data = template.render(x='中"\\\x01', y='q', z=[None, True])
+        assert json.loads(data) == {'a': '中"\\\x01\t\'q\'', 'b': [None, True]}
+        assert template_module._std_dumps({'a': '中'}) == '{"a":"中"}'.encode('utf-8')
+
+
+class TestBotTemplate(object):
+
+    def test_ding_talk(self):
+        template = DingTalkBot.text_template('@156 {host} 宕机 @{phone}', at_mobiles=['189'])
+        form = json.loads(template.render(host='db', phone='177'))
+        assert form['text']['content'] == '@156 db 宕机 @177'
+        assert form['at'] == {'atMobiles': ['189', '156'], 'isAtAll': False}
+        template = DingTalkBot.markdown_template('{title}', '# {title}', at_mobiles=Slot('mobiles'))
+        form = json.loads(template.render(title='t', mobiles=['177']))
+        assert form['markdown'] == {'title': 't', 'text': '# t'} and form['at']['atMobiles'] == ['177']
+
+    def test_send(self):
+        bot = DingTalkBot('https://oapi.dingtalk.com/robot/send?access_token=x')
+        sent = []
+        bot._send_msg = lambda form_data, q_timeout, r_timeout: sent.append(form_data)
+        template = DingTalkBot.text_template('{x}')
+        bot.send_template(template, {'x': 1})
+        bot.send_template(template.render(x=2))
+        assert sent == [template.render(x=1), template.render(x=2)]
+        with pytest.raises(ValueError):
+            bot.send_template({'x': 1})
+
+    def test_wx_com(self):
+        template = WxComBot.markdown_template(1, '**{x}**', to_user=Slot('users'))
+        form = json.loads(template.render(x='a', users='u1|u2'))
+        assert form['touser'] == 'u1|u2' and form['markdown'] == {'content': '**a**'}
+        with pytest.raises(ValueError):
+            WxComBot.text_template(1, 'x')
+        assert dumps(form) == template.render(x='a', users='u1|u2')
+
+    def test_wx_com_empty_recipients(self):
+        # 接收者全部由参数决定时，渲染后为空应在发送前报错，而不是等企业微信返回 40003
+        bot = WxComBot('corp_id', 'secret')
+        sent = []
+        bot._send_msg = lambda form_data, **kwargs: sent.append(form_data)
+        template = WxComBot.text_template(1, '{x}', to_user=Slot('users'), to_party='{party}')
+        for values in ({'x': 'a', 'users': None, 'party': ''}, {'x': 'a', 'users': '', 'party': ''}):
+            with pytest.raises(ValueError):
+                bot.send_template(template, values)
+        bot.send_template(template, {'x': 'a', 'users': None, 'party': '2'})
+        assert json.loads(sent[0])['toparty'] == '2'
+        # 接收者固定的模板渲染后不再解析
+        template = WxComBot.text_template(1, '{x}', to_user='u1')
+        assert not template.dynamic_recipients
+        bot.send_template(template, {'x': 'b'})
+        assert len(sent) == 2
+        # {{ 是花括号本身，不是参数
+        template = WxComBot.text_template(1, '{x}', to_user='a{{b')
+        assert not template.dynamic_recipients
+        bot.send_template(template, {'x': 'c'})
+        assert json.loads(sent[2])['touser'] == 'a{b'
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import pytest
+from MsgBot import WxComBot
+from MsgBot.exceptions import SendError, WxComError
+from MsgBot.mock_server import MockServer
+from MsgBot.wx_com_bot.token import TokenManager
+from tests.fakes import FakeClock, FakeResponse, FakeSession
+
+
+class Fetcher(object):
+
+    def __init__(self, delay: float = 0):
+        self.calls = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        return {'errcode': 0, 'errmsg': 'ok', 'access_token': f'token-{calls}', 'expires_in': 7200}
+
+
+class TestTokenManager(object):
+
+    def test_single_flight(self):
+        manager = TokenManager('corp_id', 'secret')
+        fetch = Fetcher(delay=0.05)
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get(fetch))) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert fetch.calls == 1
+        assert tokens == ['token-1'] * 20
+
+    def test_refresh_ahead_in_background(self):
+        clock = FakeClock(1000.0)
+        manager = TokenManager('corp_id', 'secret', refresh_ahead=300, clock=clock)
+        fetch = Fetcher()
+        assert manager.get(fetch) == 'token-1'
+        clock.now += 7200 - 299
+        # 仍返回旧 token ，刷新在后台进行
+        assert manager.get(fetch) == 'token-1'
+        deadline = time.monotonic() + 5
+        while manager.token != 'token-2' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert manager.token == 'token-2' and fetch.calls == 2
+
+    def test_failed_fetch(self):
+        manager = TokenManager('corp_id', 'secret')
+        with pytest.raises(WxComError) as e:
+            manager.get(lambda: {'errcode': 40013, 'errmsg': 'invalid corpid'})
+        assert e.value.errcode == 40013
+        assert manager.token is None
+
+    def test_invalidate(self):
+        manager = TokenManager('corp_id', 'secret')
+        fetch = Fetcher()
+        manager.get(fetch)
+        manager.invalidate('token-0')
+        assert manager.get(fetch) == 'token-1'
+        manager.invalidate('token-1')
+        assert manager.get(fetch) == 'token-2'
+
+    def test_cache_file(self, tmp_path):
+        path = str(tmp_path / 'token.json')
+        TokenManager('corp_id', 'secret', cache_file=path).get(Fetcher())
+        fetch = Fetcher()
+        assert TokenManager('corp_id', 'secret', cache_file=path).get(fetch) == 'token-1'
+        assert fetch.calls == 0
+        # 其他应用的缓存不会被使用
+        assert TokenManager('corp_id', 'other', cache_file=path).get(fetch) == 'token-1'
+        assert fetch.calls == 1
+
+
+class TestWxComBotToken(object):
+
+    def test_retry_on_invalid_token(self):
+        with MockServer() as server:
+            with WxComBot('corp_id', 'secret', api_base=server.url) as bot:
+                bot.get_token()
+                stale = bot.token
+                # token 在其他进程中被刷新，旧 token 失效
+                server.inject(40014, path='/cgi-bin/message/send')
+                assert bot.send_msg_text(agent_id=1, content='hi', to_user='u1')['errcode'] == 0
+                assert bot.token != stale
+            assert server.responses[40014] == 1
+            assert [token for _, token, _ in server.received] == [bot.token]
+
+    def test_token_timeout(self):
+        # gettoken 无响应时不能一直持有刷新锁
+        with MockServer(latency=lambda path: 2 if path.endswith('gettoken') else 0) as server:
+            with WxComBot('corp_id', 'secret', api_base=server.url, token_timeout=0.2) as bot:
+                started = time.monotonic()
+                with pytest.raises(SendError):
+                    bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+                assert time.monotonic() - started < 1
+                assert bot.token_manager.valid_token() is None
+
+    def test_gateway_error_page(self):
+        # 网关返回 HTML 错误页时抛出 SendError ，而不是 json 的 ValueError
+
+        class GatewaySession(FakeSession):
+
+            def get(self, url, **kwargs):
+                response = FakeResponse({}, status_code=502)
+                response.content = b'<html><body>502 Bad Gateway</body></html>'
+                return response
+
+        bot = WxComBot('corp_id', 'secret', session=GatewaySession())
+        with pytest.raises(SendError) as e:
+            bot.send_msg_text(agent_id=1, content='hi', to_user='u1')
+        assert 'HTTP 502' in str(e.value) and '502 Bad Gateway' in str(e.value)